@@ -2,17 +2,28 @@ import cv2
 import numpy as np
 import argparse
 from nodeNetwork import *
+from renderScheduler import RenderScheduler
+from tiledImage import TiledImage
+from imageLoading import loadImage
+from exporter import exportData
 
 #Set up argparser to allow for input image
 parser = argparse.ArgumentParser(description='MFM image analysis')
 parser.add_argument('image', metavar='image', type=str, nargs='+',help='Path of image')
+parser.add_argument("--save-grid", help="save the alignment of the grid to this file when done (see batchProcess.py)", type=str)
+parser.add_argument("--load-grid", help="start with the grid (and settings) saved with --save-grid, e.g. from the previous image in a series", type=str)
+parser.add_argument("--fps", help="most times per second to redraw the windows while the mouse moves (0 redraws on every mouse event)", type=int, default=60)
+parser.add_argument("--tiled", help="read the image from a pyramid of tiles on disk instead of loading it all into memory, for scans that are too big (see tiledImage.py)", action="store_true", default=False)
+parser.add_argument("--format", help="file format to save the data in, csv or npz (a compressed NumPy file with one array per column, see exporter.py)", choices=["csv","npz"], default="csv")
 args=parser.parse_args()
 
-try:
-    image = cv2.imread(args.image[0])
-    image = cv2.resize(image, (1000,1000))
-except:
-    raise Exception("File not found")
+#How big the window is, the image is only stretched to this size when it is shown and is sampled at its own resolution
+WINDOWSIZE=1000
+
+if args.tiled:
+    image=TiledImage(args.image[0])
+else:
+    image=loadImage(args.image[0])
 
 #constants
 WHITE=(255,255,255)
@@ -29,6 +40,13 @@ class SquareNodeNetwork(NodeNetwork):
     def getSamplePointsFromSquare(self,topLeft,topRight,bottomLeft,bottomRight,row=0,col=0):
         return []
     
+    #shiftConstant is saved with the grid (see NodeNetwork.getGridState())
+    def getReaderState(self):
+        return {"shiftConstant":shiftConstant}
+    def setReaderState(self,state):
+        global shiftConstant
+        shiftConstant=state.get("shiftConstant",shiftConstant)
+
     #this shows when two sides are both black/white which means the data is being read wrong
     def hasError(self, samplePoints, rowI, vertexI, pointI):
         return False
@@ -37,7 +55,7 @@ class SquareNodeNetwork(NodeNetwork):
     def drawData(self,im):
         super().drawData(im)
 
-n=SquareNodeNetwork(Node(10,10),Node(800,10),Node(30,800),Node(700,700),10,10,image)
+n=SquareNodeNetwork(Node(10,10),Node(800,10),Node(30,800),Node(700,700),10,10,image,displaySize=(WINDOWSIZE,WINDOWSIZE))
 
 
 
@@ -46,7 +64,7 @@ def show():
     imWidth=1000;
     imHeight=1000;
 
-    outputImage=image.copy()
+    outputImage=n.getBaseImage()
     n.draw(outputImage)
     cv2.imshow("window",outputImage)
 
@@ -69,46 +87,62 @@ def mouse_event(event, x, y,flags, param):
     elif event==cv2.EVENT_MOUSEMOVE:
         n.updateDragging(x,y)
     elif event==cv2.EVENT_LBUTTONUP:
-        n.dragging=False
-        n.setSamplePoints()
+        n.stopDragging()
     elif event == cv2.EVENT_RBUTTONDOWN:
         pass
     lastMouse=(x,y)
-    show()
-
-show();
-cv2.setMouseCallback('window', mouse_event)
-#TODO add a button to cycle a point (correct errors manually)
-while True:
-    key=cv2.waitKey(0)
-    if(key==ord("\r")):
-        break;
-    elif(key==ord("+")):
-        if shiftConstant<0.5:
-            shiftConstant+=0.01
-        n.setSamplePoints()
-    elif(key==ord("-")):
-        if shiftConstant>0:
-            shiftConstant-=0.01
-        n.setSamplePoints()
-    elif(key==ord("r")):
-        n.addRow()
-    elif(key==ord("e")):
-        n.removeRow()
-
-    elif(key==ord("c")):
-        n.addCol()
-    elif(key==ord("x")):
-        n.removeCol()
+    #moving the mouse only changes anything while dragging
+    if event!=cv2.EVENT_MOUSEMOVE or n.dragging:
+        scheduler.requestRender()
+
+#write the color of every sample point to a csv (or npz) file
+def writeData(fileName):
+    exportData(n,fileName)
+
+#start from a saved grid
+if args.load_grid is not None:
+    n.loadGrid(args.load_grid)
+
+#everything below is the interactive window, it is skipped when the reader is run by batchProcess.py
+if __name__=="__main__":
+    #the windows are redrawn at most args.fps times a second (see renderScheduler.py)
+    scheduler=RenderScheduler(show,fps=args.fps)
+    scheduler.requestRender()
+    cv2.setMouseCallback('window', mouse_event)
+    #TODO add a button to cycle a point (correct errors manually)
+    while True:
+        key=scheduler.waitKey()
+        if key==-1:
+            continue
+        if(key==ord("\r")):
+            break;
+        elif(key==ord("+")):
+            if shiftConstant<0.5:
+                shiftConstant+=0.01
+            n.setSamplePoints()
+        elif(key==ord("-")):
+            if shiftConstant>0:
+                shiftConstant-=0.01
+            n.setSamplePoints()
+        elif(key==ord("r")):
+            n.addRow()
+        elif(key==ord("e")):
+            n.removeRow()
+
+        elif(key==ord("c")):
+            n.addCol()
+        elif(key==ord("x")):
+            n.removeCol()
     
-    show()
+        scheduler.requestRender()
 
-with open('output.csv', 'w') as file:
-    file.write(n.dataAsString())
+    writeData('output.'+args.format)
+    if args.save_grid is not None:
+        n.saveGrid(args.save_grid)
 
-outputImage=np.zeros((1000,1000,3), np.uint8)
-outputImage[:,:]=(127,127,127)
-n.drawData(outputImage)
-cv2.imwrite("output.jpg", np.float32(outputImage));
+    outputImage=np.zeros((1000,1000,3), np.uint8)
+    outputImage[:,:]=(127,127,127)
+    n.drawData(outputImage)
+    cv2.imwrite("output.jpg", np.float32(outputImage));
 
-cv2.destroyAllWindows()
+    cv2.destroyAllWindows()
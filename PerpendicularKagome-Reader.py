@@ -2,26 +2,31 @@ import cv2 #for drawing images
 import numpy as np #cv2 likes numpy arrays  
 import argparse #to get the image from the user
 from nodeNetwork import * #Use this as the base class 
+from latticeDetection import proposeGrid
+from renderScheduler import RenderScheduler
+from tiledImage import TiledImage
+from imageLoading import loadImage
+from exporter import exportData
 
 #Set up argparser to allow for input image
 parser = argparse.ArgumentParser(description='Perpendicular Kagome MFM image analysis')
 parser.add_argument('image', metavar='image', type=str, nargs='+',help='Path of image')
+parser.add_argument("--detect", help="find the lattice in the image and start with the grid lined up with it", action="store_true", default=False)
+parser.add_argument("--save-grid", help="save the alignment of the grid to this file when done (see batchProcess.py)", type=str)
+parser.add_argument("--load-grid", help="start with the grid (and settings) saved with --save-grid, e.g. from the previous image in a series", type=str)
+parser.add_argument("--fps", help="most times per second to redraw the windows while the mouse moves (0 redraws on every mouse event)", type=int, default=60)
+parser.add_argument("--tiled", help="read the image from a pyramid of tiles on disk instead of loading it all into memory, for scans that are too big (see tiledImage.py)", action="store_true", default=False)
+parser.add_argument("--format", help="file format to save the data in, csv or npz (a compressed NumPy file with one array per column, see exporter.py)", choices=["csv","npz"], default="csv")
 args=parser.parse_args()
 
-#How big the display window(s) are
+#How big the display window(s) are, the image is only stretched to this size when it is shown and is sampled at its own resolution
 WINDOWSIZE=500
 
 #read image
-image = cv2.imread(args.image[0])
-
-#cv2.imshow(image)
-#cv2.waitkey(0)
-if image is None:
-    raise FileNotFoundError("Cannot find image")
-
-#resize image (makes it easier to work with)
-image=cv2.resize(image,(WINDOWSIZE,WINDOWSIZE))
-
+if args.tiled:
+    image=TiledImage(args.image[0])
+else:
+    image=loadImage(args.image[0])
 
 #this is the pattern of where to sample the image at
 #the squares with "1" in them, will sample at that point, while the ones with "0" will not
@@ -40,61 +45,72 @@ colOffset=0
 
 class PerpendicularKagomeReader(NodeNetwork):
 
-    #given a row,column, and the coordinants of four corners of a square in the grid, where should the sample points in that square be?
-    #output format is [[x1,y1],[x2,y2],[x3,y3]]...
-    #in this case, we only have one or zero sample points in a square so the output will be either [[x,y]] or []
-    def getSamplePointsFromSquare(self, topLeft, topRight, bottomLeft, bottomRight, row=0,col=0):
+    #given the rows, columns, and the coordinants of the four corners of every square in the grid, where should the sample points in those squares be?
+    #each corner is an array with one [x,y] per square, and the output is every sample point along with how many points are in each square
+    #in this case, we only have one or zero sample points in a square
+    def getSamplePointsFromSquares(self, topLeft, topRight, bottomLeft, bottomRight, row, col):
         
-        #find out whiche spot in the gridPattern this square corresponds to based on its row,col and our offsets
+        #find out whiche spot in the gridPattern each square corresponds to based on its row,col and our offsets
+        pattern=np.array(gridPattern)
         patternRow=(row+rowOffset)%len(gridPattern)
         patternCol=(col+colOffset)%len(gridPattern[0])
 
-        #we only sample that point if the value in the gridPattern at that point is 1
-        if gridPattern[patternRow][patternCol]==1:
+        #we only sample a square if the value in the gridPattern at that point is 1
+        sample=pattern[patternRow,patternCol]==1
 
-            #We simply want the center of the square, so we just average the four points and return
-            centerX=(topLeft[0]+topRight[0]+bottomLeft[0]+bottomRight[0])/4
-            centerY=(topLeft[1]+topRight[1]+bottomLeft[1]+bottomRight[1])/4
-            return [[centerX,centerY]]
-        else:
-            #if this is a 0 in the gridpattern, there is no sample point in this square
-            return []
+        #We simply want the center of the square, so we just average the four points
+        center=(topLeft+topRight+bottomLeft+bottomRight)/4
+        return stackSamplePoints(center[:,np.newaxis,:],keep=sample)
+
+    #rowOffset and colOffset are saved with the grid (see NodeNetwork.getGridState())
+    def getReaderState(self):
+        return {"rowOffset":rowOffset,"colOffset":colOffset}
+    def setReaderState(self,state):
+        global rowOffset,colOffset
+        rowOffset=state.get("rowOffset",rowOffset)
+        colOffset=state.get("colOffset",colOffset)
 
     #as far as I can tell, there is no way to detect errors in this lattice type (no impossible color/charge configurations)
     def hasError(self, samplePoints, rowI, vertexI, pointI):
         return False
-    
-    #this is how we convert the data to the output format for the file
-    def dataAsString(self):
-        string=""#the string that will get put into the file
 
+    def getErrors(self, samplePoints):
+        return np.zeros(len(samplePoints),dtype=bool)
+    
+    #this is how we convert the data to the output format for the file, one line at a time
+    def dataAsLines(self):
         #loop through each row and square in that row
-        for (rowI, row) in enumerate(self.samplePoints):
-            for (vertexI, vertex) in enumerate(row):
+        samplePoints=self.samplePoints
+        for rowI in range(samplePoints.rows):
+            line=[]#the line that will get put into the file
+            for vertexI in range(samplePoints.cols):
 
                 #in theory, a vertex is an array of points, so we might have to loop through it and dump those points into the file
-                #however, in the case of this grid there will only ever be 1 or 0 points in a vertex, so we can just look at vertex[0]
+                #however, in the case of this grid there will only ever be 1 or 0 points in a vertex, so we can just look at the first point
 
 
-                if len(vertex)>0:
-                    #the color of the point is stored at index 2 (sorry this is kind of arbitrary)
-                    string+=str(vertex[0][2])+", "
+                if samplePoints.cellSize(rowI,vertexI)>0:
+                    line.append(str(samplePoints.getColor(rowI,vertexI,0))+", ")
                 else:
                     #placeholder if there is nothing
-                    string+=" ,"
-            string+="\n"
-        return string
+                    line.append(" ,")
+            line.append("\n")
+            yield "".join(line)
     
 
 #make the grid overlay by giving it the four corners, the number of rows and columns, the image we want to sample, and how big the sample area should be
 #when it determines the color of a point in an image, it doesn't just look at that one point, it averages in the area around it. This is what pointSampleRadius is for.
 #pointSampleRadius should be roughly half the width of a single dot
-n=PerpendicularKagomeReader(Node(10,10),Node(WINDOWSIZE-10,10),Node(10,WINDOWSIZE-10),Node(WINDOWSIZE-10,WINDOWSIZE-10),15,15,image,pointSampleRadius=5)
+if args.detect:
+    #the lattice repeats every 4 squares across and its rows are 2 squares apart, the islands are in the middle of the squares
+    n=PerpendicularKagomeReader(*proposeGrid(image,periodCells=(2,4),phaseOffset=(0.5,0.5),displaySize=(WINDOWSIZE,WINDOWSIZE)),image,pointSampleRadius=5,displaySize=(WINDOWSIZE,WINDOWSIZE))
+else:
+    n=PerpendicularKagomeReader(Node(10,10),Node(WINDOWSIZE-10,10),Node(10,WINDOWSIZE-10),Node(WINDOWSIZE-10,WINDOWSIZE-10),15,15,image,pointSampleRadius=5,displaySize=(WINDOWSIZE,WINDOWSIZE))
 
 def show():
 
     #this first ouput draws the grid and sample points over our main image
-    outputImage=image.copy()
+    outputImage=n.getBaseImage()
     n.draw(outputImage)
     cv2.imshow("window",outputImage)
 
@@ -135,64 +151,86 @@ def mouse_event(event, x, y,flags, param):
     elif event==cv2.EVENT_LBUTTONUP:
         n.stopDragging()
 
-    #show the update image every frame
-    show()
-
-show()
-#Bind the mouse event function to the window
-cv2.setMouseCallback('window', mouse_event)
-
-
-print("Controls")
-print("Right click: split the grid at that point")
-print("Left click + drag: drag around a reference point")
-print("Shift + Left Click: manually correct the value of a point")
-print("r/e: add or remove a row")
-print("c/x: add or remove a column")
-print("o/p: adjust the row/column offset")
-
-while(True):
-    #wait for the next key press
-    key=cv2.waitKey(0)
-
-    #end the program on "Enter"
-    if(key==ord("\r")):
-        break;
+    #show the updated image, moving the mouse only changes anything while dragging
+    if event!=cv2.EVENT_MOUSEMOVE or n.dragging:
+        scheduler.requestRender()
+
+#write the color of every sample point to a csv (or npz) file
+def writeData(fileName):
+    exportData(n,fileName)
+
+#start from a saved grid
+if args.load_grid is not None:
+    n.loadGrid(args.load_grid)
+
+#everything below is the interactive window, it is skipped when the reader is run by batchProcess.py
+if __name__=="__main__":
+    #the windows are redrawn at most args.fps times a second (see renderScheduler.py)
+    scheduler=RenderScheduler(show,fps=args.fps)
+    scheduler.requestRender()
+    #Bind the mouse event function to the window
+    cv2.setMouseCallback('window', mouse_event)
+
+
+    print("Controls")
+    print("Right click: split the grid at that point")
+    print("Left click + drag: drag around a reference point")
+    print("Shift + Left Click: manually correct the value of a point")
+    print("r/e: add or remove a row")
+    print("c/x: add or remove a column")
+    print("o/p: adjust the row/column offset")
+
+    while(True):
+        #wait for the next key press
+        key=scheduler.waitKey()
+        if key==-1:
+            continue
+
+        #end the program on "Enter"
+        if(key==ord("\r")):
+            break;
     
-    #add/remove row with r/e
-    elif(key==ord("r")):
-        n.addRow()
-    elif(key==ord("e")):
-        n.removeRow()
-
-    #add/remove column with c/x
-    elif(key==ord("c")):
-        n.addCol()
-    elif(key==ord("x")):
-        n.removeCol()
-
-    #use o and p to offset the row and column
-    elif(key==ord("o")):
-        rowOffset=(rowOffset+1)%len(gridPattern)
-        n.setSamplePoints()
-    elif(key==ord("p")):
-        colOffset=(colOffset+1)%len(gridPattern)
-        n.setSamplePoints()
-
-
-    show()
-
-#get the name of the output file based on the input (same name but change extension to .csv)
-csvName=args.image[0].split(".")[0]+".csv"
-print("writing to... "+csvName)
-with open(csvName, 'w') as file:#write filedata
-    file.write(n.dataAsString())
-
-#write outputImage
-outputImage=np.zeros((WINDOWSIZE,WINDOWSIZE,3), np.uint8)
-outputImage[:,:]=(127,127,127)
-n.drawData(outputImage)
-cv2.imwrite("output.jpg", np.float32(outputImage));
-
-#close the windows
-cv2.destroyAllWindows()
\ No newline at end of file
+        #add/remove row with r/e
+        elif(key==ord("r")):
+            n.addRow()
+        elif(key==ord("e")):
+            n.removeRow()
+
+        #add/remove column with c/x
+        elif(key==ord("c")):
+            n.addCol()
+        elif(key==ord("x")):
+            n.removeCol()
+
+        #toggle live preview with v
+        elif(key==ord("v")):
+            n.toggleLivePreview()
+
+        #use o and p to offset the row and column
+        elif(key==ord("o")):
+            rowOffset=(rowOffset+1)%len(gridPattern)
+            n.setSamplePoints()
+        elif(key==ord("p")):
+            colOffset=(colOffset+1)%len(gridPattern)
+            n.setSamplePoints()
+        elif(key==ord("h")):
+            print(n.thresholdSweepAsString(n.useBestThreshold()))
+
+
+        scheduler.requestRender()
+
+    #get the name of the output file based on the input (same name but change extension to .csv)
+    outputName=args.image[0].split(".")[0]+"."+args.format
+    print("writing to... "+outputName)
+    writeData(outputName)
+    if args.save_grid is not None:
+        n.saveGrid(args.save_grid)
+
+    #write outputImage
+    outputImage=np.zeros((WINDOWSIZE,WINDOWSIZE,3), np.uint8)
+    outputImage[:,:]=(127,127,127)
+    n.drawData(outputImage)
+    cv2.imwrite("output.jpg", np.float32(outputImage));
+
+    #close the windows
+    cv2.destroyAllWindows()
@@ -5,6 +5,11 @@ import numpy as np
 from random import randint
 import argparse
 from nodeNetwork import *
+from latticeDetection import proposeGrid
+from renderScheduler import RenderScheduler
+from tiledImage import TiledImage
+from imageLoading import loadImage
+from exporter import exportData
 import json
 
 #Set up argparser to allow for input image
@@ -15,23 +20,27 @@ parser.add_argument('-c', "--columns",  help="number of columns", type=int, defa
 parser.add_argument('-s', "--spacing",  help="how dense the islands are packed small=denser (default=0.25)", type=float, default=0.25)
 parser.add_argument("-a", "--reference_image", help="image of the height(to help line up the sample points)", type=str)
 parser.add_argument("-o", "--offset",  help="flip rotation of the larger islands",action='store_true', default=False)
+parser.add_argument("--detect", help="find the lattice in the image and start with the grid lined up with it (uses the reference image if there is one, ignores -r and -c)", action="store_true", default=False)
+parser.add_argument("--save-grid", help="save the alignment of the grid to this file when done (see batchProcess.py)", type=str)
+parser.add_argument("--load-grid", help="start with the grid (and settings) saved with --save-grid, e.g. from the previous image in a series", type=str)
+parser.add_argument("--fps", help="most times per second to redraw the windows while the mouse moves (0 redraws on every mouse event)", type=int, default=60)
+parser.add_argument("--tiled", help="read the image from a pyramid of tiles on disk instead of loading it all into memory, for scans that are too big (see tiledImage.py)", action="store_true", default=False)
+parser.add_argument("--format", help="file format to save the data in, csv or npz (a compressed NumPy file with one array per column, see exporter.py)", choices=["csv","npz"], default="csv")
 
 args=parser.parse_args()
 
-try:
-    image = cv2.imread(args.image[0])
-    image = cv2.resize(image, (1000,1000))
-except:
-    raise Exception("File not found")
+#How big the window is, the image is only stretched to this size when it is shown and is sampled at its own resolution
+WINDOWSIZE=1000
+
+if args.tiled:
+    image=TiledImage(args.image[0])
+else:
+    image=loadImage(args.image[0])
 
 if args.reference_image is not None:
-    try:
-        height_image = cv2.imread(args.reference_image)
-        height_image = cv2.resize(height_image, (1000,1000))
-    except:
-        raise Exception("File not found")
+    height_image = cv2.resize(loadImage(args.reference_image,color=True), (WINDOWSIZE,WINDOWSIZE))
 else:
-    height_image=np.zeros((1000,1000,3), np.uint8)
+    height_image=np.zeros((WINDOWSIZE,WINDOWSIZE,3), np.uint8)
 
 
 
@@ -48,19 +57,11 @@ colOffset=0
 
 
 class SantaFeNodeNetwork(NodeNetwork):
-    def getSamplePointsFromSquare(self,topLeft,topRight,bottomLeft,bottomRight,row=0,col=0):
-        #multiplier for how far the sample points are from the edge of the square
-        shiftConstant=0.25
-
-        row+=rowOffset
-        col+=colOffset
-
-        samplePoints=[]
-
-        sample=False
-
+    def getSamplePointsFromSquares(self,topLeft,topRight,bottomLeft,bottomRight,row,col):
+        row=row+rowOffset
+        col=col+colOffset
 
-        sampleAreas=[
+        sampleAreas=np.array([
         [0,1,1,0,1,1,0,1,1,0,1,1,0],
         [1,0,0,1,0,0,0,0,0,1,0,0,1],
         [1,0,0,1,0,0,0,0,0,1,0,0,1],
@@ -74,164 +75,182 @@ class SantaFeNodeNetwork(NodeNetwork):
         [1,0,0,1,0,0,0,0,0,1,0,0,1],
         [1,0,0,1,0,0,0,0,0,1,0,0,1],
         [0,1,1,0,1,1,0,1,1,0,1,1,0]
-        ]
-
-        isOdd=(int((row%24)/12)+int((col%24)/12))%2==1
-        if isOdd and offset==False or not isOdd and offset==True:
-
-            sampleAreas=np.rot90(np.array(sampleAreas))
-
-        if(sampleAreas[row%12][col%12]==1):
-            sample=True
-
-
+        ])
+
+        #every other 12x12 block uses the rotated pattern
+        isOdd=((row%24)//12+(col%24)//12)%2==1
+        rotated=isOdd!=offset
+        sample=np.where(rotated,np.rot90(sampleAreas)[row%12,col%12],sampleAreas[row%12,col%12])==1
+
+        center=(topLeft+topRight+bottomLeft+bottomRight)/4
+        return stackSamplePoints(center[:,np.newaxis,:],keep=sample)
+    #offset, rowOffset and colOffset are saved with the grid (see NodeNetwork.getGridState())
+    def getReaderState(self):
+        return {"offset":offset,"rowOffset":rowOffset,"colOffset":colOffset}
+    def setReaderState(self,state):
+        global offset,rowOffset,colOffset
+        offset=state.get("offset",offset)
+        rowOffset=state.get("rowOffset",rowOffset)
+        colOffset=state.get("colOffset",colOffset)
 
-        if(sample):
-            center=[(topLeft[0]+topRight[0]+bottomLeft[0]+bottomRight[0])/4,(topLeft[1]+topRight[1]+bottomLeft[1]+bottomRight[1])/4]
-            samplePoints.append(center)
-
-
-
-
-
-        return samplePoints
     def hasError(self, samplePoints, rowI, vertexI, pointI):
-        surroundingPoints=[]
+        surroundingCells=[]
         if(rowI >0):
-            surroundingPoints.append(samplePoints[rowI-1][vertexI])
+            surroundingCells.append((rowI-1,vertexI))
         if(vertexI>0):
-            surroundingPoints.append(samplePoints[rowI][vertexI-1])
+            surroundingCells.append((rowI,vertexI-1))
 
-        for point in surroundingPoints:
-            if point==[] or point[0][2]==0 or samplePoints[rowI][vertexI][0][2]==0:
+        color=samplePoints.getColor(rowI,vertexI,0)
+        for (otherRowI,otherVertexI) in surroundingCells:
+            if samplePoints.cellSize(otherRowI,otherVertexI)==0 or samplePoints.getColor(otherRowI,otherVertexI,0)==0 or color==0:
                 continue
-            elif point[0][2]==samplePoints[rowI][vertexI][0][2]:
+            elif samplePoints.getColor(otherRowI,otherVertexI,0)==color:
                 return True
 
         return (False)
 
-    def dataAsString(self):
-        string=""
+    #same as hasError() but for every point at once
+    def getErrors(self, samplePoints):
+        #every cell has one or zero points, put the colors in a (rows,cols) array with 0 where there is no point
+        hasPoint=samplePoints.getCellSizes()>0
+        colors=np.zeros(hasPoint.shape,dtype=np.int8)
+        colors[hasPoint]=samplePoints.color
+
+        #a point has an error if it is the same color as the point above or to the left of it
+        errors=np.zeros(hasPoint.shape,dtype=bool)
+        errors[1:,:]|=(colors[1:,:]==colors[:-1,:]) & (colors[:-1,:]!=0)
+        errors[:,1:]|=(colors[:,1:]==colors[:,:-1]) & (colors[:,:-1]!=0)
+        errors&=colors!=0
+        return errors[hasPoint]
+
+    def dataAsLines(self):
         pure=False
 
 
+        samplePoints=self.samplePoints
         if(pure):
-            for row in self.samplePoints:
-                string+="\n"
-                for cell in row:
-                    if(cell==[]):
-                        string+="0"
+            for rowI in range(samplePoints.rows):
+                line=["\n"]
+                for colI in range(samplePoints.cols):
+                    if(samplePoints.cellSize(rowI,colI)==0):
+                        line.append("0")
                     else:
-                        string+=str(cell[0][2])
-                    string+=","
+                        line.append(str(samplePoints.getColor(rowI,colI,0)))
+                    line.append(",")
+                yield "".join(line)
         else:
             if(rowOffset%3==0):
-                string+="first row horizontal\n"
+                yield "first row horizontal\n"
             else:
-                string+="first row vertical\n"
+                yield "first row vertical\n"
 
-            for (rowI, row) in enumerate(self.samplePoints):
-                rowI+=rowOffset
-                for(colI, cell) in enumerate(row):
-                    colI+=colOffset
+            for cellRowI in range(samplePoints.rows):
+                rowI=cellRowI+rowOffset
+                line=[]
+                for cellColI in range(samplePoints.cols):
+                    colI=cellColI+colOffset
+                    isEmpty=samplePoints.cellSize(cellRowI,cellColI)==0
 
                     if(rowI%3==0):
                         #we are in a flat row
                         if(colI%3==1):
-                            if(cell==[]):
-                                string+=" ,"
+                            if(isEmpty):
+                                line.append(" ,")
                             else:
-                                string+=str(cell[0][2]*-1)+","
+                                line.append(str(samplePoints.getColor(cellRowI,cellColI,0)*-1)+",")
                         elif(colI%3==0):
-                            string+=" ,"
+                            line.append(" ,")
 
                     elif(rowI%3==1):
                         #we are in the top of a vertical row
                         if(colI%3==0):
-                            if(cell!=[]):
-                                string+=str(cell[0][2]*-1)+","
+                            if(not isEmpty):
+                                line.append(str(samplePoints.getColor(cellRowI,cellColI,0)*-1)+",")
                             else:
-                                string+=" ,"
+                                line.append(" ,")
                         elif(colI%3==1):
-                            string+=' ,'
+                            line.append(' ,')
 
                     else:
                         continue
                 if(rowI%3!=2):
-                    string+="\n"
+                    line.append("\n")
+                yield "".join(line)
 
-
-        return string
     def drawData(self,im):
-        if self.dragging:
+        if not self.samplePointsVisible():
             return
 
 
         samplePoints=self.samplePoints
 
 
-        for (rowI,row) in enumerate(samplePoints):
-            for(cellI,cell) in enumerate(row):
+        for rowI in range(samplePoints.rows):
+            for cellI in range(samplePoints.cols):
+                if samplePoints.cellSize(rowI,cellI)==0:
+                    continue
+                cell=samplePoints.getPoint(rowI,cellI,0)
 
-                surroundingPoints=[]
+                surroundingCells=[]
                 if(rowI >0):
-                    surroundingPoints.append(samplePoints[rowI-1][cellI])
+                    surroundingCells.append((rowI-1,cellI))
                 if(cellI>0):
-                    surroundingPoints.append(samplePoints[rowI][cellI-1])
+                    surroundingCells.append((rowI,cellI-1))
 
-                for point in surroundingPoints:
-                    if point==[] or cell==[]:
+                for (otherRowI,otherCellI) in surroundingCells:
+                    if samplePoints.cellSize(otherRowI,otherCellI)==0:
                         continue
                     else:
-                        if(cell[0][2]==1):
-                            im=cv2.arrowedLine(im,(int(cell[0][0]),int(cell[0][1])),(int(point[0][0]),int(point[0][1])),WHITE,1,tipLength=0.3)
+                        point=samplePoints.getPoint(otherRowI,otherCellI,0)
+                        if(cell[2]==1):
+                            im=cv2.arrowedLine(im,(int(cell[0]),int(cell[1])),(int(point[0]),int(point[1])),WHITE,1,tipLength=0.3)
                         else:
-                            im=cv2.arrowedLine(im,(int(point[0][0]),int(point[0][1])),(int(cell[0][0]),int(cell[0][1])),WHITE,1,tipLength=0.3)
+                            im=cv2.arrowedLine(im,(int(point[0]),int(point[1])),(int(cell[0]),int(cell[1])),WHITE,1,tipLength=0.3)
 
     def correctError(self,rowI,cellI):
         samplePoints=self.samplePoints
-        cell=self.samplePoints[rowI][cellI]
-        row=samplePoints[rowI]
-        if(len(cell)==0):
+        if(samplePoints.cellSize(rowI,cellI)==0):
             return#no point here
+        cell=samplePoints.getPoint(rowI,cellI,0)
 
         otherRowI=None
         otherCellI=None
-        if(rowI>0 and samplePoints[rowI-1][cellI]!=[]):
+        if(rowI>0 and samplePoints.cellSize(rowI-1,cellI)!=0):
             otherRowI=rowI-1
             otherCellI=cellI
-        if(cellI>0 and samplePoints[rowI][cellI-1]!=[]):
+        if(cellI>0 and samplePoints.cellSize(rowI,cellI-1)!=0):
             otherRowI=rowI
             otherCellI=cellI-1
-        if(rowI<len(samplePoints)-1 and samplePoints[rowI+1][cellI]!=[]):
+        if(rowI<samplePoints.rows-1 and samplePoints.cellSize(rowI+1,cellI)!=0):
             otherRowI=rowI+1
             otherCellI=cellI
-        if(cellI<len(row)-1 and samplePoints[rowI][cellI+1]!=[]):
+        if(cellI<samplePoints.cols-1 and samplePoints.cellSize(rowI,cellI+1)!=0):
             otherRowI=rowI
             otherCellI=cellI+1
 
         if(otherRowI is None):#no surrounding points
             return
+        otherCell=samplePoints.getPoint(otherRowI,otherCellI,0)
 
-        if(cell[0][2]!=samplePoints[otherRowI][otherCellI][0][2]):
+        if(cell[2]!=otherCell[2]):
             return; #no error
 
-        if cell[0][2]==0 or samplePoints[otherRowI][otherCellI][0][2]==0:
+        if cell[2]==0 or otherCell[2]==0:
             return#bad data
 
-        color=self.sampleImageColor(image,cell[0][0],cell[0][1])
-        otherColor=self.sampleImageColor(image,samplePoints[otherRowI][otherCellI][0][0],samplePoints[otherRowI][otherCellI][0][1])
+        color=self.sampleImageColor(image,cell[0],cell[1])
+        otherColor=self.sampleImageColor(image,otherCell[0],otherCell[1])
 
         if(color>otherColor):
-            cell[0][2]=1
-            samplePoints[otherRowI][otherCellI][0][2]=-1
+            samplePoints.setColor(rowI,cellI,0,1)
+            samplePoints.setColor(otherRowI,otherCellI,0,-1)
         else:
-            cell[0][2]=-1
-            samplePoints[otherRowI][otherCellI][0][2]=1
+            samplePoints.setColor(rowI,cellI,0,-1)
+            samplePoints.setColor(otherRowI,otherCellI,0,1)
     def correctErrors(self):
         samplePoints=self.samplePoints
-        for (rowI,row) in enumerate(samplePoints):
-            for(cellI,cell) in enumerate(row):
+        for rowI in range(samplePoints.rows):
+            for cellI in range(samplePoints.cols):
                 self.correctError(rowI,cellI)
 
 
@@ -239,7 +258,11 @@ class SantaFeNodeNetwork(NodeNetwork):
 
 
 
-n=SantaFeNodeNetwork(Node(25,66),Node(551,66),Node(26,529),Node(545,529),args.rows, args.columns,image)
+if args.detect:
+    #the islands repeat every 3 squares
+    n=SantaFeNodeNetwork(*proposeGrid(height_image if args.reference_image is not None else image,periodCells=(3,3),displaySize=(WINDOWSIZE,WINDOWSIZE)),image,displaySize=(WINDOWSIZE,WINDOWSIZE))
+else:
+    n=SantaFeNodeNetwork(Node(25,66),Node(551,66),Node(26,529),Node(545,529),args.rows, args.columns,image,displaySize=(WINDOWSIZE,WINDOWSIZE))
 
 
 show_ref_image=False
@@ -251,7 +274,7 @@ def show():
     if(show_ref_image):
         outputImage=height_image.copy()
     else:
-        outputImage=image.copy()
+        outputImage=n.getBaseImage()
 
     n.draw(outputImage)
     cv2.imshow("window",outputImage)
@@ -284,7 +307,9 @@ def mouse_event(event, x, y,flags, param):
         pass
     lastMouse=(x,y)
 
-    show()
+    #moving the mouse only changes anything while dragging
+    if event!=cv2.EVENT_MOUSEMOVE or n.dragging:
+        scheduler.requestRender()
 """
     print(n.topLeft)
     print(n.topRight)
@@ -294,54 +319,72 @@ def mouse_event(event, x, y,flags, param):
     print(n.cols)"""
 
 
-show();
-cv2.setMouseCallback('window', mouse_event)
-
-while(True):
-    key=cv2.waitKey(0)
-    if(key==ord("\r")):
-        break;
-    elif(key==ord("r")):
-        n.addRow()
-    elif(key==ord("e")):
-        n.removeRow()
-
-    elif(key==ord("c")):
-        n.addCol()
-    elif(key==ord("x")):
-        n.removeCol()
-    elif(key==ord("o")):
-        offset=not offset
-        n.setSamplePoints()
-    elif(key==ord("q")):
-        show_ref_image=not show_ref_image
-    elif(key==ord("a")):
-        rowOffset+=1
-        n.setSamplePoints()
-    elif(key==ord("b")):
-        colOffset+=1
-        n.setSamplePoints()
-    elif(key==ord("j")):
-        for i in range(10):
-            n.jiggleNearestFixedPoint(*lastMouse)
-            print(i)
-        print("done")
-    elif(key==ord("f")):
-        n.correctErrors()
-    elif(key==ord("g")):
-        nearest=n.getNearestSamplePoint(*lastMouse)
-        n.correctError(nearest["row"],nearest["col"])
-    show()
-
-
-outputFileName=args.image[0].split(".")[0]+".csv"
-with open(outputFileName, 'w') as file:
-    file.write(n.dataAsString())
-
-outputImage=np.zeros((1000,1000,3), np.uint8)
-outputImage[:,:]=(127,127,127)
-n.drawData(outputImage)
-
-#cv2.imwrite("output.jpg", np.float32(outputImage));
-
-cv2.destroyAllWindows()
+#write the color of every sample point to a csv (or npz) file
+def writeData(fileName):
+    exportData(n,fileName,rowOffset=rowOffset,colOffset=colOffset)
+
+#start from a saved grid
+if args.load_grid is not None:
+    n.loadGrid(args.load_grid)
+
+#everything below is the interactive window, it is skipped when the reader is run by batchProcess.py
+if __name__=="__main__":
+    #the windows are redrawn at most args.fps times a second (see renderScheduler.py)
+    scheduler=RenderScheduler(show,fps=args.fps)
+    scheduler.requestRender()
+    cv2.setMouseCallback('window', mouse_event)
+
+    while(True):
+        key=scheduler.waitKey()
+        if key==-1:
+            continue
+        if(key==ord("\r")):
+            break;
+        elif(key==ord("r")):
+            n.addRow()
+        elif(key==ord("e")):
+            n.removeRow()
+
+        elif(key==ord("c")):
+            n.addCol()
+        elif(key==ord("x")):
+            n.removeCol()
+        elif(key==ord("v")):
+            n.toggleLivePreview()
+        elif(key==ord("o")):
+            offset=not offset
+            n.setSamplePoints()
+        elif(key==ord("q")):
+            show_ref_image=not show_ref_image
+        elif(key==ord("a")):
+            rowOffset+=1
+            n.setSamplePoints()
+        elif(key==ord("b")):
+            colOffset+=1
+            n.setSamplePoints()
+        elif(key==ord("j")):
+            print("errors removed:",n.jiggleNearestFixedPoint(*lastMouse))
+        elif(key==ord("k")):
+            print("errors removed:",n.autoAlign())
+        elif(key==ord("h")):
+            print(n.thresholdSweepAsString(n.useBestThreshold()))
+        elif(key==ord("f")):
+            n.correctErrors()
+        elif(key==ord("g")):
+            nearest=n.getNearestSamplePoint(*lastMouse)
+            n.correctError(nearest["row"],nearest["col"])
+        scheduler.requestRender()
+
+
+    outputFileName=args.image[0].split(".")[0]+"."+args.format
+    writeData(outputFileName)
+    if args.save_grid is not None:
+        n.saveGrid(args.save_grid)
+
+    outputImage=np.zeros((1000,1000,3), np.uint8)
+    outputImage[:,:]=(127,127,127)
+    n.drawData(outputImage)
+
+    #cv2.imwrite("output.jpg", np.float32(outputImage));
+
+    cv2.destroyAllWindows()
@@ -9,19 +9,32 @@ import numpy as np
 from random import randint
 import argparse
 from nodeNetwork import *
+from latticeDetection import proposeGrid
+from renderScheduler import RenderScheduler
+from tiledImage import TiledImage
+from imageLoading import loadImage
+from exporter import exportData
 
 #Set up argparser to allow for input image
 parser = argparse.ArgumentParser(description='MFM image analysis')
 parser.add_argument('image', metavar='image', type=str, nargs='+',help='Path of image')
 parser.add_argument('-r', "--rows", metavar='r', help="number of rows", type=int, default=10)
 parser.add_argument('-c', "--columns", metavar='c', help="number of columns", type=int, default=10)
+parser.add_argument("--detect", help="find the lattice in the image and start with the grid lined up with it (ignores -r and -c)", action="store_true", default=False)
+parser.add_argument("--save-grid", help="save the alignment of the grid to this file when done (see batchProcess.py)", type=str)
+parser.add_argument("--load-grid", help="start with the grid (and settings) saved with --save-grid, e.g. from the previous image in a series", type=str)
+parser.add_argument("--fps", help="most times per second to redraw the windows while the mouse moves (0 redraws on every mouse event)", type=int, default=60)
+parser.add_argument("--tiled", help="read the image from a pyramid of tiles on disk instead of loading it all into memory, for scans that are too big (see tiledImage.py)", action="store_true", default=False)
+parser.add_argument("--format", help="file format to save the data in, csv or npz (a compressed NumPy file with one array per column, see exporter.py)", choices=["csv","npz"], default="csv")
 args=parser.parse_args()
 
-try:
-    image = cv2.imread(args.image[0])
-    image = cv2.resize(image, (1000,1000))
-except:
-    raise Exception("File not found")
+#How big the window is, the image is only stretched to this size when it is shown and is sampled at its own resolution
+WINDOWSIZE=1000
+
+if args.tiled:
+    image=TiledImage(args.image[0])
+else:
+    image=loadImage(args.image[0])
 
 #constants
 WHITE=(255,255,255)
@@ -34,77 +47,94 @@ shiftConstant=0.25
 
 class SquareNodeNetwork(NodeNetwork):
 
-    #this will return the four points inside a square
-    def getSamplePointsFromSquare(self,topLeft,topRight,bottomLeft,bottomRight,row=0,col=0):
+    #this will return the four points inside every square
+    def getSamplePointsFromSquares(self,topLeft,topRight,bottomLeft,bottomRight,row,col):
         #multiplier for how far the sample points are from the edge of the square
         
 
         #get center of sides of square
-        centerTop=[topLeft[0]+(topRight[0]-topLeft[0])/2, topLeft[1]+(topRight[1]-topLeft[1])/2]
-        centerLeft=[topLeft[0]+(bottomLeft[0]-topLeft[0])/2, topLeft[1]+(bottomLeft[1]-topLeft[1])/2]
-        centerRight=[topRight[0]+(bottomRight[0]-topRight[0])/2, topRight[1]+(bottomRight[1]-topRight[1])/2]
-        centerBottom=[bottomLeft[0]+(bottomRight[0]-bottomLeft[0])/2, bottomLeft[1]+(bottomRight[1]-bottomLeft[1])/2]
+        centerTop=topLeft+(topRight-topLeft)/2
+        centerLeft=topLeft+(bottomLeft-topLeft)/2
+        centerRight=topRight+(bottomRight-topRight)/2
+        centerBottom=bottomLeft+(bottomRight-bottomLeft)/2
 
         #square width and height
-        width=(centerRight[0]-centerLeft[0])
-        height=(centerBottom[1]-centerTop[1])
+        width=(centerRight[:,0]-centerLeft[:,0])
+        height=(centerBottom[:,1]-centerTop[:,1])
 
-        #sample points are stored as [x,y,color]
-        topSamplePoint=[centerTop[0],centerTop[1]+height*shiftConstant]
-        leftSamplePoint=[centerLeft[0]+width*shiftConstant,centerLeft[1]]
-        rightSamplePoint=[centerRight[0]-width*shiftConstant,centerRight[1]]
-        bottomSamplePoint=[centerBottom[0], centerBottom[1]-height*shiftConstant]
+        #sample points are stored as [x,y]
+        topSamplePoint=np.stack([centerTop[:,0],centerTop[:,1]+height*shiftConstant],axis=1)
+        leftSamplePoint=np.stack([centerLeft[:,0]+width*shiftConstant,centerLeft[:,1]],axis=1)
+        rightSamplePoint=np.stack([centerRight[:,0]-width*shiftConstant,centerRight[:,1]],axis=1)
+        bottomSamplePoint=np.stack([centerBottom[:,0], centerBottom[:,1]-height*shiftConstant],axis=1)
 
-        fourSamplePoints=[topSamplePoint,leftSamplePoint,rightSamplePoint,bottomSamplePoint]
-        return fourSamplePoints
+        fourSamplePoints=np.stack([topSamplePoint,leftSamplePoint,rightSamplePoint,bottomSamplePoint],axis=1)
+        return stackSamplePoints(fourSamplePoints)
     
+    #shiftConstant is saved with the grid (see NodeNetwork.getGridState())
+    def getReaderState(self):
+        return {"shiftConstant":shiftConstant}
+    def setReaderState(self,state):
+        global shiftConstant
+        shiftConstant=state.get("shiftConstant",shiftConstant)
+
     #this shows when two sides are both black/white which means the data is being read wrong
     def hasError(self, samplePoints, rowI, vertexI, pointI):
         if pointI==0 or pointI==1:
             return False
 
-        row = samplePoints[rowI]
-        vertex=row[vertexI]
-
         if pointI==2:
-            if vertexI < len(row)-1:
-                if(vertex[2][2] == row[vertexI+1][1][2]):
+            if vertexI < samplePoints.cols-1:
+                if(samplePoints.getColor(rowI,vertexI,2) == samplePoints.getColor(rowI,vertexI+1,1)):
                     return True
         #if we are not in the last row, make sure bottom ponit is the opposite color than the one below it
         if pointI==3:
-            if rowI < len(samplePoints)-1:
-                if(vertex[3][2] == samplePoints[rowI+1][vertexI][0][2]):
+            if rowI < samplePoints.rows-1:
+                if(samplePoints.getColor(rowI,vertexI,3) == samplePoints.getColor(rowI+1,vertexI,0)):
                     return True
         return False
 
+    #same as hasError() but for every point at once
+    def getErrors(self, samplePoints):
+        colors=samplePoints.color.reshape(samplePoints.rows,samplePoints.cols,4)
+        errors=np.zeros(colors.shape,dtype=bool)
+
+        #right point should be the opposite color of the left point in the square to the right
+        errors[:,:-1,2]=colors[:,:-1,2]==colors[:,1:,1]
+        #bottom point should be the opposite color of the top point in the square below
+        errors[:-1,:,3]=colors[:-1,:,3]==colors[1:,:,0]
+        return errors.ravel()
+
     
     def drawData(self,im):
-        if not self.dragging:
+        if self.samplePointsVisible():
             samplePoints=self.samplePoints
 
             height, width, channels = im.shape
 
             margin=50
-            vertexVSpacing=(height-2*margin)/(len(samplePoints)-1)
-            vertexHSpacing=(width-2*margin)/(len(samplePoints[0])-1)
+            vertexVSpacing=(height-2*margin)/(samplePoints.rows-1)
+            vertexHSpacing=(width-2*margin)/(samplePoints.cols-1)
 
             spacing=min(vertexVSpacing, vertexHSpacing)
             vertexVSpacing=spacing
             vertexHSpacing=spacing
 
             islandSpacing=(vertexVSpacing+vertexHSpacing)/6
-            for (rowI, row) in enumerate(samplePoints):
-                for (vertexI, vertex) in enumerate(row):
+            for rowI in range(samplePoints.rows):
+                for vertexI in range(samplePoints.cols):
                     vertexX=int(margin+vertexI*vertexHSpacing)
                     vertexY=int(margin+rowI*vertexVSpacing)
 
-                    if(vertex[0][2]+vertex[1][2]+vertex[2][2]+vertex[3][2]!=0):
+                    #colors of the top, left, right and bottom points
+                    vertex=samplePoints.getCellColors(rowI,vertexI).astype(int)
+                    if(vertex[0]+vertex[1]+vertex[2]+vertex[3]!=0):
                         im=cv2.circle(im,(int(vertexX),int(vertexY)),3,RED,-1)
-                    elif(vertex[0][2]+vertex[1][2]!=0 or vertex[0][2]+vertex[2][2]!=0):
+                    elif(vertex[0]+vertex[1]!=0 or vertex[0]+vertex[2]!=0):
                         im=cv2.circle(im,(int(vertexX),int(vertexY)),3,BLUE,-1)
-                    for (pointI, point) in enumerate(vertex):
+                    for (pointI, pointColor) in enumerate(vertex):
 
-                        if(point[2]==1):
+                        if(pointColor==1):
                             color=WHITE
                         else:
                             color=BLACK
@@ -125,27 +155,27 @@ class SquareNodeNetwork(NodeNetwork):
                         if(rowI==0 and pointI==0):
                             #im=cv2.circle(im,(int(point[0]),int(point[1])),4,color,-1)
                             pass
-                        elif(vertexI == len(row)-1 and pointI==2):
+                        elif(vertexI == samplePoints.cols-1 and pointI==2):
                             #im=cv2.circle(im,(int(point[0]),int(point[1])),4,color,-1)
                             pass
                         elif(vertexI ==0 and pointI==1):
                             #im=cv2.circle(im,(int(point[0]),int(point[1])),4,color,-1)
                             pass
-                        elif(rowI==len(samplePoints)-1 and pointI==3):
+                        elif(rowI==samplePoints.rows-1 and pointI==3):
                             #im=cv2.circle(im,(int(point[0]),int(point[1])),4,color,-1)
                             pass
 
                         elif(pointI==2 or pointI==3):
                             if(pointI==2):
-                                otherPoint=row[vertexI+1][1]
+                                otherPointColor=samplePoints.getColor(rowI,vertexI+1,1)
                                 otherX=x+vertexHSpacing-2*islandSpacing
                                 otherY=y
                             else:
-                                otherPoint=samplePoints[rowI+1][vertexI][0]
+                                otherPointColor=samplePoints.getColor(rowI+1,vertexI,0)
                                 otherX=x
                                 otherY=y+vertexVSpacing-2*islandSpacing
 
-                            if(otherPoint[2]==1):
+                            if(otherPointColor==1):
                                 otherColor=WHITE
                             else:
                                 otherColor=BLACK
@@ -158,7 +188,11 @@ class SquareNodeNetwork(NodeNetwork):
                         im=cv2.circle(im,(int(x),int(y)),3,color,-1)
 
 
-n=SquareNodeNetwork(Node(10,10),Node(800,10),Node(30,800),Node(700,700),args.rows, args.columns,image)
+if args.detect:
+    #the vertices (where the islands meet) are in the middle of the squares
+    n=SquareNodeNetwork(*proposeGrid(image,periodCells=(1,1),phaseOffset=(0.5,0.5),displaySize=(WINDOWSIZE,WINDOWSIZE)),image,displaySize=(WINDOWSIZE,WINDOWSIZE))
+else:
+    n=SquareNodeNetwork(Node(10,10),Node(800,10),Node(30,800),Node(700,700),args.rows, args.columns,image,displaySize=(WINDOWSIZE,WINDOWSIZE))
 
 
 
@@ -167,7 +201,7 @@ def show():
     imWidth=1000;
     imHeight=1000;
 
-    outputImage=image.copy()
+    outputImage=n.getBaseImage()
     n.draw(outputImage)
     cv2.imshow("window",outputImage)
 
@@ -190,46 +224,68 @@ def mouse_event(event, x, y,flags, param):
     elif event==cv2.EVENT_MOUSEMOVE:
         n.updateDragging(x,y)
     elif event==cv2.EVENT_LBUTTONUP:
-        n.dragging=False
-        n.setSamplePoints()
+        n.stopDragging()
     elif event == cv2.EVENT_RBUTTONDOWN:
         pass
     lastMouse=(x,y)
-    show()
-
-show();
-cv2.setMouseCallback('window', mouse_event)
-#TODO add a button to cycle a point (correct errors manually)
-while True:
-    key=cv2.waitKey(0)
-    if(key==ord("\r")):
-        break;
-    elif(key==ord("+")):
-        if shiftConstant<0.5:
-            shiftConstant+=0.01
-        n.setSamplePoints()
-    elif(key==ord("-")):
-        if shiftConstant>0:
-            shiftConstant-=0.01
-        n.setSamplePoints()
-    elif(key==ord("r")):
-        n.addRow()
-    elif(key==ord("e")):
-        n.removeRow()
-
-    elif(key==ord("c")):
-        n.addCol()
-    elif(key==ord("x")):
-        n.removeCol()
+    #moving the mouse only changes anything while dragging
+    if event!=cv2.EVENT_MOUSEMOVE or n.dragging:
+        scheduler.requestRender()
+
+#write the color of every sample point to a csv (or npz) file
+def writeData(fileName):
+    exportData(n,fileName)
+
+#start from a saved grid
+if args.load_grid is not None:
+    n.loadGrid(args.load_grid)
+
+#everything below is the interactive window, it is skipped when the reader is run by batchProcess.py
+if __name__=="__main__":
+    #the windows are redrawn at most args.fps times a second (see renderScheduler.py)
+    scheduler=RenderScheduler(show,fps=args.fps)
+    scheduler.requestRender()
+    cv2.setMouseCallback('window', mouse_event)
+    #TODO add a button to cycle a point (correct errors manually)
+    while True:
+        key=scheduler.waitKey()
+        if key==-1:
+            continue
+        if(key==ord("\r")):
+            break;
+        elif(key==ord("+")):
+            if shiftConstant<0.5:
+                shiftConstant+=0.01
+            n.setSamplePoints()
+        elif(key==ord("-")):
+            if shiftConstant>0:
+                shiftConstant-=0.01
+            n.setSamplePoints()
+        elif(key==ord("r")):
+            n.addRow()
+        elif(key==ord("e")):
+            n.removeRow()
+
+        elif(key==ord("c")):
+            n.addCol()
+        elif(key==ord("x")):
+            n.removeCol()
+        elif(key==ord("v")):
+            n.toggleLivePreview()
+        elif(key==ord("k")):
+            n.autoAlign()
+        elif(key==ord("h")):
+            print(n.thresholdSweepAsString(n.useBestThreshold()))
     
-    show()
+        scheduler.requestRender()
 
-with open('output.csv', 'w') as file:
-    file.write(n.dataAsString())
+    writeData('output.'+args.format)
+    if args.save_grid is not None:
+        n.saveGrid(args.save_grid)
 
-outputImage=np.zeros((1000,1000,3), np.uint8)
-outputImage[:,:]=(127,127,127)
-n.drawData(outputImage)
-cv2.imwrite("output.jpg", np.float32(outputImage));
+    outputImage=np.zeros((1000,1000,3), np.uint8)
+    outputImage[:,:]=(127,127,127)
+    n.drawData(outputImage)
+    cv2.imwrite("output.jpg", np.float32(outputImage));
 
-cv2.destroyAllWindows()
+    cv2.destroyAllWindows()
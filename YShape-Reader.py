@@ -5,6 +5,11 @@ import numpy as np
 from random import randint
 import argparse
 from nodeNetwork import *
+from latticeDetection import proposeGrid
+from renderScheduler import RenderScheduler
+from tiledImage import TiledImage
+from imageLoading import loadImage
+from exporter import exportData
 
 #Set up argparser to allow for input image
 parser = argparse.ArgumentParser(description='MFM image analysis')
@@ -15,24 +20,26 @@ parser.add_argument('-s', "--spacing",  help="how dense the islands are packed s
 parser.add_argument("-o", "--offset",  help="Set if the first row is shifted to the right, don't set if the second row is shifted to the right",action='store_true', default=False)
 parser.add_argument("-t", "--trim", help="Set if the offset row is shorter than the non-offset rows",action="store_true", default=False)
 parser.add_argument("-a", "--reference_image", help="image of the height(to help line up the sample points)", type=str)
+parser.add_argument("--detect", help="find the lattice in the image and start with the grid lined up with it (uses the reference image if there is one, ignores -r and -c)", action="store_true", default=False)
+parser.add_argument("--save-grid", help="save the alignment of the grid to this file when done (see batchProcess.py)", type=str)
+parser.add_argument("--load-grid", help="start with the grid (and settings) saved with --save-grid, e.g. from the previous image in a series", type=str)
+parser.add_argument("--fps", help="most times per second to redraw the windows while the mouse moves (0 redraws on every mouse event)", type=int, default=60)
+parser.add_argument("--tiled", help="read the image from a pyramid of tiles on disk instead of loading it all into memory, for scans that are too big (see tiledImage.py)", action="store_true", default=False)
+parser.add_argument("--format", help="file format to save the data in, csv or npz (a compressed NumPy file with one array per column, see exporter.py)", choices=["csv","npz"], default="csv")
 args=parser.parse_args()
 
 WINDOWSIZE=800
 
 
 #read image and reference image
-try:
-    image = cv2.imread(args.image[0])
-    image=cv2.resize(image,(WINDOWSIZE,WINDOWSIZE))
-except:
-    raise Exception("File not found")
+#the image is only stretched to WINDOWSIZE when it is shown, it is sampled at its own resolution
+if args.tiled:
+    image=TiledImage(args.image[0])
+else:
+    image=loadImage(args.image[0])
 
 if args.reference_image is not None:
-    try:
-        height_image = cv2.imread(args.reference_image)
-        height_image = cv2.resize(height_image, (WINDOWSIZE,WINDOWSIZE))
-    except:
-        raise Exception("File not found")
+    height_image = cv2.resize(loadImage(args.reference_image,color=True), (WINDOWSIZE,WINDOWSIZE))
 else:
     height_image=np.zeros((1000,1000,3), np.uint8)
 
@@ -48,47 +55,51 @@ RED=(0,0,255)
 shiftConstant=args.spacing;
 show_ref_image=False
 class YShapeNodeNetwork(NodeNetwork):
-    def getSamplePointsFromSquare(self,topLeft,topRight,bottomLeft,bottomRight,row=0,col=0):
+    def getSamplePointsFromSquares(self,topLeft,topRight,bottomLeft,bottomRight,row,col):
         #multiplier for how far the sample points are from the edge of the square
 
         #get center of sides of square
-        centerTop=[topLeft[0]+(topRight[0]-topLeft[0])/2, topLeft[1]+(topRight[1]-topLeft[1])/2]
-        centerLeft=[topLeft[0]+(bottomLeft[0]-topLeft[0])/2, topLeft[1]+(bottomLeft[1]-topLeft[1])/2]
-        centerRight=[topRight[0]+(bottomRight[0]-topRight[0])/2, topRight[1]+(bottomRight[1]-topRight[1])/2]
-        centerBottom=[bottomLeft[0]+(bottomRight[0]-bottomLeft[0])/2, bottomLeft[1]+(bottomRight[1]-bottomLeft[1])/2]
+        centerTop=topLeft+(topRight-topLeft)/2
+        centerLeft=topLeft+(bottomLeft-topLeft)/2
+        centerRight=topRight+(bottomRight-topRight)/2
+        centerBottom=bottomLeft+(bottomRight-bottomLeft)/2
 
         #square width and height
-        width=(centerRight[0]-centerLeft[0])
-        height=(centerBottom[1]-centerTop[1])
+        width=(centerRight[:,0]-centerLeft[:,0])
+        height=(centerBottom[:,1]-centerTop[:,1])
 
-        #sample points are stored as [x,y,color]
-        leftSamplePoint=[topLeft[0]+width*shiftConstant, topLeft[1]+height*shiftConstant]
-        rightSamplePoint=[topRight[0]-width*shiftConstant, topRight[1]+height*shiftConstant]
-        middleSamplePoint=[(centerLeft[0]+centerRight[0])/2,(centerLeft[1]+centerRight[1])/2]
-        bottomSamplePoint=[centerBottom[0], centerBottom[1]-height*shiftConstant]
+        #sample points are stored as [x,y]
+        leftSamplePoint=np.stack([topLeft[:,0]+width*shiftConstant, topLeft[:,1]+height*shiftConstant],axis=1)
+        rightSamplePoint=np.stack([topRight[:,0]-width*shiftConstant, topRight[:,1]+height*shiftConstant],axis=1)
+        middleSamplePoint=(centerLeft+centerRight)/2
+        bottomSamplePoint=np.stack([centerBottom[:,0], centerBottom[:,1]-height*shiftConstant],axis=1)
 
-        samplePoints=[leftSamplePoint, rightSamplePoint, middleSamplePoint, bottomSamplePoint]
+        samplePoints=np.stack([leftSamplePoint, rightSamplePoint, middleSamplePoint, bottomSamplePoint],axis=1)
+        keep=np.ones(len(row),dtype=bool)
 
-        if((row%2==0 and args.offset==True) or (row%2==1 and args.offset==False) ):
-            for point in samplePoints:
-                point[0]+=width/2
+        shifted=(row%2==0)==args.offset
+        samplePoints[shifted,:,0]+=(width[shifted]/2)[:,np.newaxis]
 
-            #odd rows are shorter
-            if(args.trim and col+1==self.cols-1):
-                return [];
+        #odd rows are shorter
+        if(args.trim):
+            keep[shifted & (col+1==self.cols-1)]=False
 
 
 
-        return samplePoints
+        return stackSamplePoints(samplePoints,keep=keep)
     def drawData(self, im):
-        if not self.dragging:
+        if self.samplePointsVisible():
             samplePoints=self.samplePoints;
 
             height, width, channels = im.shape
 
-            for (rowI, row) in enumerate(samplePoints):
-                for (vertexI, vertex) in enumerate(row):
-                    for (pointI, point) in enumerate(vertex):
+            for rowI in range(samplePoints.rows):
+                for vertexI in range(samplePoints.cols):
+                    if samplePoints.cellSize(rowI,vertexI)==0:
+                        continue
+                    middle=samplePoints.getPoint(rowI,vertexI,2)
+                    for pointI in range(samplePoints.cellSize(rowI,vertexI)):
+                        point=samplePoints.getPoint(rowI,vertexI,pointI)
                         if(point[2]==1):
                             color=WHITE
                         elif(point[2]==0):
@@ -96,13 +107,22 @@ class YShapeNodeNetwork(NodeNetwork):
                         else:
                             color=BLACK
                         if(pointI!=2):
-                            im=cv2.line(im,(int(point[0]),int(point[1])),(int(vertex[2][0]),int(vertex[2][1])),color,2)
+                            im=cv2.line(im,(int(point[0]),int(point[1])),(int(middle[0]),int(middle[1])),color,2)
                         im=cv2.circle(im, (int(point[0]),int(point[1])), 3, color, -1)
+    #shiftConstant and the row offset/trim are saved with the grid (see NodeNetwork.getGridState())
+    def getReaderState(self):
+        return {"shiftConstant":shiftConstant,"offset":args.offset,"trim":args.trim}
+    def setReaderState(self,state):
+        global shiftConstant
+        shiftConstant=state.get("shiftConstant",shiftConstant)
+        args.offset=state.get("offset",args.offset)
+        args.trim=state.get("trim",args.trim)
+
     def hasError(self, samplePoints, rowI, vertexI, pointI):
         if(pointI==2):
             sum=0;
-            for point in samplePoints[rowI][vertexI]:
-                sum+=point[2]
+            for color in samplePoints.getCellColors(rowI,vertexI).tolist():
+                sum+=color
             if(sum==0):
                 return False
             else:
@@ -110,8 +130,20 @@ class YShapeNodeNetwork(NodeNetwork):
         else:
             return False
 
+    #same as hasError() but for every point at once
+    def getErrors(self, samplePoints):
+        #every square has four or zero points, the middle point shows an error if the colors don't add up to 0
+        colors=samplePoints.color.reshape(-1,4).astype(np.int64)
+        errors=np.zeros(colors.shape,dtype=bool)
+        errors[:,2]=colors.sum(axis=1)!=0
+        return errors.ravel()
+
 
-n=YShapeNodeNetwork(Node(10,10),Node(800,10),Node(30,800),Node(700,700),args.rows+1, args.columns+1,image)
+if args.detect:
+    #one island in the middle of every square, the shifted rows are handled by -o
+    n=YShapeNodeNetwork(*proposeGrid(height_image if args.reference_image is not None else image,periodCells=(1,1),phaseOffset=(0.5,0.5),displaySize=(WINDOWSIZE,WINDOWSIZE)),image,displaySize=(WINDOWSIZE,WINDOWSIZE))
+else:
+    n=YShapeNodeNetwork(Node(10,10),Node(800,10),Node(30,800),Node(700,700),args.rows+1, args.columns+1,image,displaySize=(WINDOWSIZE,WINDOWSIZE))
 n.pointSampleWidth=3
 
 
@@ -123,7 +155,7 @@ def show():
     if(show_ref_image):
         outputImage=height_image.copy()
     else:
-        outputImage=image.copy()
+        outputImage=n.getBaseImage()
     n.draw(outputImage)
     cv2.imshow("window",outputImage)
 
@@ -156,67 +188,89 @@ def mouse_event(event, x, y,flags, param):
         pass
 
     lastMouse=(x,y)
-    show()
-
-show();
-cv2.setMouseCallback('window', mouse_event)
-
-print("Enter: Quit and Save")
-print("+/-: Increase/decrease island spacing")
-print("r/e: Add/remove row")
-print("c/x: Add/remove column")
-print("o: toggle row offset")
-print("t: toggle row trim")
-print("q: toggle reference image")
-
-lastMouse=(0,0)
-
-while(True):
-    key=cv2.waitKey(0)
-
-    if(key==ord("\r")):
-        break;
-    elif(key==ord("+")):
-        if shiftConstant<0.5:
-            shiftConstant+=0.01
-        n.setSamplePoints()
-    elif(key==ord("-")):
-        if shiftConstant>0:
-            shiftConstant-=0.01
-        n.setSamplePoints()
-    elif(key==ord("r")):
-        n.addRow()
-    elif(key==ord("e")):
-        n.removeRow()
-
-    elif(key==ord("c")):
-        n.addCol()
-    elif(key==ord("x")):
-        n.removeCol()
-    elif(key==ord("o")):
-        args.offset=not args.offset
-        n.setSamplePoints()
-    elif(key==ord("t")):
-        args.trim=not args.trim
-        n.setSamplePoints()
-    elif(key==ord("q")):
-        show_ref_image=not show_ref_image
-    elif(key==ord("j")):
-        for i in range(10):
-            n.jiggleNearestFixedPoint(*lastMouse)
-    show()
+    #moving the mouse only changes anything while dragging
+    if event!=cv2.EVENT_MOUSEMOVE or n.dragging:
+        scheduler.requestRender()
 
-with open('output.csv', 'w') as file:
+#write the color of every sample point to a csv (or npz) file
+def writeData(fileName):
     if(args.offset==True):
-        file.write("first row offset\n")
+        header="first row offset\n"
     else:
-        file.write("second row offset\n")
-    file.write("topLeft, topRight, middle, bottom\n")
-    file.write(n.dataAsString())
+        header="second row offset\n"
+    header+="topLeft, topRight, middle, bottom\n"
+    exportData(n,fileName,header=header,offset=args.offset)
+
+#start from a saved grid
+if args.load_grid is not None:
+    n.loadGrid(args.load_grid)
+
+#everything below is the interactive window, it is skipped when the reader is run by batchProcess.py
+if __name__=="__main__":
+    #the windows are redrawn at most args.fps times a second (see renderScheduler.py)
+    scheduler=RenderScheduler(show,fps=args.fps)
+    scheduler.requestRender()
+    cv2.setMouseCallback('window', mouse_event)
+
+    print("Enter: Quit and Save")
+    print("+/-: Increase/decrease island spacing")
+    print("r/e: Add/remove row")
+    print("c/x: Add/remove column")
+    print("o: toggle row offset")
+    print("t: toggle row trim")
+    print("q: toggle reference image")
+
+    lastMouse=(0,0)
+
+    while(True):
+        key=scheduler.waitKey()
+        if key==-1:
+            continue
+
+        if(key==ord("\r")):
+            break;
+        elif(key==ord("+")):
+            if shiftConstant<0.5:
+                shiftConstant+=0.01
+            n.setSamplePoints()
+        elif(key==ord("-")):
+            if shiftConstant>0:
+                shiftConstant-=0.01
+            n.setSamplePoints()
+        elif(key==ord("r")):
+            n.addRow()
+        elif(key==ord("e")):
+            n.removeRow()
+
+        elif(key==ord("c")):
+            n.addCol()
+        elif(key==ord("x")):
+            n.removeCol()
+        elif(key==ord("v")):
+            n.toggleLivePreview()
+        elif(key==ord("o")):
+            args.offset=not args.offset
+            n.setSamplePoints()
+        elif(key==ord("t")):
+            args.trim=not args.trim
+            n.setSamplePoints()
+        elif(key==ord("q")):
+            show_ref_image=not show_ref_image
+        elif(key==ord("j")):
+            n.jiggleNearestFixedPoint(*lastMouse)
+        elif(key==ord("k")):
+            n.autoAlign()
+        elif(key==ord("h")):
+            print(n.thresholdSweepAsString(n.useBestThreshold()))
+        scheduler.requestRender()
+
+    writeData('output.'+args.format)
+    if args.save_grid is not None:
+        n.saveGrid(args.save_grid)
 
-outputImage=np.zeros((1000,1000,3), np.uint8)
-outputImage[:,:]=(127,127,127)
-n.drawData(outputImage)
-cv2.imwrite("output.jpg", np.float32(outputImage));
+    outputImage=np.zeros((1000,1000,3), np.uint8)
+    outputImage[:,:]=(127,127,127)
+    n.drawData(outputImage)
+    cv2.imwrite("output.jpg", np.float32(outputImage));
 
-cv2.destroyAllWindows()
+    cv2.destroyAllWindows()
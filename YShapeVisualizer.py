@@ -1,7 +1,7 @@
-import csv
 import cv2
 import numpy as np
 import math
+from latticeFiles import loadIslandArray
 
 
 
@@ -97,18 +97,13 @@ class YLattice:
 
             
 
+#load the islands saved by generalizedYShapeReader.py (a csv, or a .npz from --format npz)
+#the file is read into one array (and cached next to it, see latticeFiles.py) and the islands are made from its rows
 def genLattice(filename):
     lattice=YLattice()
 
-    with open(filename, newline='') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',')
-        headers=next(reader)
-        assert headers==["row","col","leg 1 angle", "leg 1 color", "leg 2 color","leg 3 color","center color"]
-
-        
-        for row in reader:
-            island=YIsland(float(row[0]),float(row[1]),float(row[2]),float(row[3]),float(row[4]),float(row[5]),float(row[6]))
-            lattice.addIsland(island)
+    for (row,col,angle,color1,color2,color3,centerColor) in loadIslandArray(filename).tolist():
+        lattice.addIsland(YIsland(row,col,angle,color1,color2,color3,centerColor))
     
     return lattice
 
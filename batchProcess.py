@@ -0,0 +1,93 @@
+"""
+This file runs one of the readers over a list of images without opening any windows, using a grid that was lined up and saved beforehand.
+Line the grid up on one image of a series and save it with --save-grid, e.g.
+    python YShape-Reader.py "Yshape(120-128)/220_phase.jpg" -t --save-grid grid.json
+then every image in the series can be read with the same grid
+    python batchProcess.py YShape-Reader.py grid.json "Yshape(120-128)" --glob "*_phase.jpg" -- -t
+Everything after -- is passed on to the reader. The images are split between several processes and each one gets a csv with the same name
+as the image (next to it, or in --output-dir).
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import runpy
+import sys
+
+IMAGE_EXTENSIONS=(".jpg",".jpeg",".png",".bmp",".tif",".tiff")
+
+#every image in a list of files and directories, only files matching pattern are used from the directories
+def findImages(paths,pattern="*"):
+    images=[]
+    for path in paths:
+        if os.path.isdir(path):
+            matches=sorted(glob.glob(os.path.join(glob.escape(path),pattern)))
+            images+=[match for match in matches if match.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            images.append(path)
+    return images
+
+#where the csv (or other format, see exporter.py) for an image goes
+def getOutputPath(imagePath,outputDir=None,format="csv"):
+    if outputDir is None:
+        outputDir=os.path.dirname(imagePath)
+    return os.path.join(outputDir,os.path.splitext(os.path.basename(imagePath))[0]+"."+format)
+
+#read one image with a reader and write its csv, returns the number of errors found (this runs in a worker process)
+#the reader script is not run as __main__ so it only loads the image and sets up its NodeNetwork without opening any windows
+def processImage(readerPath,imagePath,readerArgs,gridState,outputPath):
+    readerDir=os.path.dirname(os.path.abspath(readerPath))
+    if readerDir not in sys.path:
+        sys.path.insert(0,readerDir)
+
+    sys.argv=[readerPath,imagePath]+readerArgs
+    reader=runpy.run_path(readerPath,run_name="batch")
+    n=reader["n"]
+    n.setGridState(gridState)
+    reader["writeData"](outputPath)
+    return n.countErrors()
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description='Read a series of MFM images with a saved grid, without opening any windows')
+    parser.add_argument('reader', type=str, help="reader script to use (e.g. YShape-Reader.py)")
+    parser.add_argument('grid', type=str, help="grid saved with the --save-grid option of the reader")
+    parser.add_argument('images', type=str, nargs='+', help="images and/or directories of images")
+    parser.add_argument("--glob", help="which files to read from the directories (default=every image)", type=str, default="*")
+    parser.add_argument("--output-dir", help="where to write the csv files (default=next to each image)", type=str)
+    parser.add_argument("--format", help="file format to save the data in, csv or npz (see exporter.py)", choices=["csv","npz"], default="csv")
+    parser.add_argument("-j", "--jobs", help="number of processes to use (default=number of cpus)", type=int)
+
+    #everything after -- goes to the reader
+    argv=sys.argv[1:]
+    readerArgs=[]
+    if "--" in argv:
+        readerArgs=argv[argv.index("--")+1:]
+        argv=argv[:argv.index("--")]
+    args=parser.parse_args(argv)
+
+    with open(args.grid) as file:
+        gridState=json.load(file)
+
+    images=findImages(args.images,args.glob)
+    if len(images)==0:
+        raise Exception("No images found")
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir,exist_ok=True)
+    outputPaths=[getOutputPath(image,args.output_dir,args.format) for image in images]
+
+    failed=0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures=[pool.submit(processImage,args.reader,image,readerArgs,gridState,outputPath) for (image,outputPath) in zip(images,outputPaths)]
+        for (image,outputPath,future) in zip(images,outputPaths,futures):
+            try:
+                errors=future.result()
+                print(image+" -> "+outputPath+" ("+str(errors)+" errors)")
+            except Exception as e:
+                failed+=1
+                print(image+" failed: "+str(e))
+
+    if failed>0:
+        print(str(failed)+" of "+str(len(images))+" images failed")
+        sys.exit(1)
@@ -51,23 +51,19 @@ class SquareNodeNetwork(NodeNetwork):
         if pointI==0 or pointI==1:
             return False
 
-        #get the current row and grid cell
-        row = samplePoints[rowI]
-        vertex=row[vertexI]
-
         if pointI==2:#if we are on the right side of the cell
 
             #if this is not the last cell in the row, check that the cell to the right has the opposite color
-            if vertexI < len(row)-1:
+            if vertexI < samplePoints.cols-1:
                 
                 #if the colors are the same, this is the error
-                if(vertex[2][2] == row[vertexI+1][1][2]):
+                if(samplePoints.getColor(rowI,vertexI,2) == samplePoints.getColor(rowI,vertexI+1,1)):
                     return True
 
         #same process as above but for the bottom point
         if pointI==3:
-            if rowI < len(samplePoints)-1:
-                if(vertex[3][2] == samplePoints[rowI+1][vertexI][0][2]):
+            if rowI < samplePoints.rows-1:
+                if(samplePoints.getColor(rowI,vertexI,3) == samplePoints.getColor(rowI+1,vertexI,0)):
                     return True
         
         #false by default
@@ -104,8 +100,7 @@ def mouse_event(event, x, y,flags, param):
 
     #stop dragging on mouse up
     elif event==cv2.EVENT_LBUTTONUP:
-        n.dragging=False
-        n.setSamplePoints()
+        n.stopDragging()
 
     show()
 
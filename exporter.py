@@ -0,0 +1,47 @@
+"""
+This file writes the data read from an image to a file.
+CSV files are written a line at a time as they are made (see NodeNetwork.dataAsLines()) instead of building the whole file as one string first,
+so even a very large lattice only ever has one line of it in memory. The same data can also be saved as a compressed NumPy .npz file with one
+array per column (positions, colors and where each point is in the lattice) so it can be loaded for analysis with np.load() without parsing text.
+The format is picked from the extension of the file name.
+"""
+
+import numpy as np
+
+#write an iterable of strings (e.g. a generator of lines) to a text file one after another, header is written first
+def writeLines(path,lines,header=""):
+    with open(path,"w") as file:
+        file.write(header)
+        file.writelines(lines)
+
+#save arrays (and single values) to a compressed .npz file under their names
+def writeArrays(path,**arrays):
+    np.savez_compressed(path,**arrays)
+
+#every sample point of a NodeNetwork as arrays, one value per point in the order of samplePoints
+#x and y are on the display (like the grid), imageX and imageY are the same positions in pixels of the image
+#row and col are the cell of the lattice the point is in and index is which point of the cell it is, error is whether it is an error (see getErrors())
+def getSamplePointArrays(network):
+    samplePoints=network.samplePoints
+    rows,cols,indices=samplePoints.getLatticeIndices()
+    return {
+        "x":samplePoints.x,
+        "y":samplePoints.y,
+        "imageX":(samplePoints.x-network.borderWidth)/network.displayScale[0],
+        "imageY":(samplePoints.y-network.borderWidth)/network.displayScale[1],
+        "color":samplePoints.color,
+        "row":rows,
+        "col":cols,
+        "index":indices,
+        "error":network.getErrorMask(),
+        "rows":samplePoints.rows,
+        "cols":samplePoints.cols
+    }
+
+#write the data of a NodeNetwork to a file, a .npz file gets the arrays from getSamplePointArrays() and anything in extra (e.g. the reader's settings)
+#any other file gets the csv from network.dataAsLines() with header before it
+def exportData(network,path,header="",**extra):
+    if path.lower().endswith(".npz"):
+        writeArrays(path,**getSamplePointArrays(network),**extra)
+    else:
+        writeLines(path,network.dataAsLines(),header)
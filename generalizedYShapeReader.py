@@ -4,10 +4,14 @@ from random import random
 import time
 from generalizedYShapeAnalysis import YLattice
 from newNodeNetwork import NodeNetwork, Node
+from renderScheduler import RenderScheduler
+from imageLoading import loadImage
+from exporter import writeLines,writeArrays
 import numpy as np
 import cv2
 import math
 import argparse
+import json
 
 #Set up argparser to allow for input image
 parser = argparse.ArgumentParser(description='MFM image analysis')
@@ -15,24 +19,20 @@ parser.add_argument('image', metavar='image', type=str, nargs='+',help='Path of
 parser.add_argument('-s', "--spacing",  help="how dense the islands are packed small=denser (default=0.25)", type=float, default=0.25)
 parser.add_argument("-t", "--trim", help="Set if the offset row is shorter than the non-offset rows",action="store_true", default=False)
 parser.add_argument("-a", "--reference_image", help="image of the height(to help line up the sample points)", type=str)
+parser.add_argument("--save-grid", help="save the alignment of the grid and pattern to this file when done", type=str)
+parser.add_argument("--load-grid", help="start with the grid and pattern saved with --save-grid, e.g. from the previous image in a series", type=str)
+parser.add_argument("--format", help="file format to save the data in, csv or npz (a compressed NumPy file with one array per column, see exporter.py)", choices=["csv","npz"], default="csv")
+parser.add_argument("--fps", help="most times per second to redraw the windows while the mouse moves (0 redraws on every mouse event)", type=int, default=60)
 args=parser.parse_args()
 
 WINDOWSIZE=800
 
 
 #read image and reference image
-try:
-    phase_image = cv2.imread(args.image[0])
-    phase_image=cv2.resize(phase_image,(WINDOWSIZE,WINDOWSIZE))
-except:
-    raise Exception("File not found")
+phase_image=cv2.resize(loadImage(args.image[0],color=True),(WINDOWSIZE,WINDOWSIZE))
 
 if args.reference_image is not None:
-    try:
-        height_image = cv2.imread(args.reference_image)
-        height_image = cv2.resize(height_image, (WINDOWSIZE,WINDOWSIZE))
-    except:
-        raise Exception("File not found")
+    height_image = cv2.resize(loadImage(args.reference_image,color=True), (WINDOWSIZE,WINDOWSIZE))
 else:
     height_image=np.zeros((WINDOWSIZE,WINDOWSIZE,3), np.uint8)
 
@@ -190,6 +190,25 @@ class Pattern:
 
         return validPoints, validLegAngles
     
+    #the offsets and island sizes in a form that can be saved as json
+    def getState(self):
+        return {
+            "rowOffset":self.rowOffset,
+            "colOffset":self.colOffset,
+            "rowEndOffset":self.rowEndOffset,
+            "colEndOffset":self.colEndOffset,
+            "radii":[island.radius for island in self.islands]
+        }
+
+    def setState(self,state):
+        self.rowOffset=state["rowOffset"]
+        self.colOffset=state["colOffset"]
+        self.rowEndOffset=state["rowEndOffset"]
+        self.colEndOffset=state["colEndOffset"]
+        for island,radius in zip(self.islands,state["radii"]):
+            island.radius=radius
+        self.invalidateCache()
+
     def incrementYRadius(self):
         for island in self.islands:
             island.radius*=1.01
@@ -304,24 +323,18 @@ def show():
     
     if not n.dragging:
         points,_=yLattice.getSamplePoints(n.rows-1,n.cols-1)
-        for island in points:
-            colorPattern=[]
-            for point in island:
-                coord=n.getXY(point.row,point.col)
-                bwColor=BWImage[coord[1]][coord[0]]
-                if bwColor==0: 
+        for coords,colorPattern in zip(*getIslandPixels(points)):
+            for coord,colorCode in zip(coords,colorPattern):
+                if colorCode==-1: 
                     color=(255,0,0)
-                    colorPattern.append(-1)
-                elif bwColor==255: 
+                elif colorCode==1: 
                     color=(0,0,255)
-                    colorPattern.append(1)
                 else:
                     color=(0,255,0)
-                    colorPattern.append(0)
                 cv2.circle(image,coord,2,color,-1)
             
             if YIsland.hasError(colorPattern):
-                cv2.circle(image,n.getXY(island[0].row,island[0].col),5,(0,255,0),3)
+                cv2.circle(image,coords[0],5,(0,255,0),3)
 
     cv2.imshow("window",image)
 
@@ -338,21 +351,24 @@ def cycleArea(x,y):
 
     BWImage[(y-2):(y+2),(x-2):(x+2)]=blankSquare
 
+#the pixel (x,y) of every point of every island and the color of the black and white image there (-1, 1 or 0 if it is unclear)
+#all the points are mapped onto the image with one call to getXYArray() and read from the image at once, returns a list of each for every island
+def getIslandPixels(points):
+    rows=[point.row for island in points for point in island]
+    cols=[point.col for island in points for point in island]
+    xs,ys=n.getXYArray(rows,cols)
+    bwColors=BWImage[ys,xs]
+    colors=np.where(bwColors==0,-1,np.where(bwColors==255,1,0)).tolist()
+    coords=list(zip(xs.tolist(),ys.tolist()))
+
+    starts=np.cumsum([0]+[len(island) for island in points]).tolist()
+    return [coords[start:end] for start,end in zip(starts,starts[1:])],[colors[start:end] for start,end in zip(starts,starts[1:])]
+
 def countTotalErrors():
     total=0
     points,_=yLattice.getSamplePoints(n.rows-1,n.cols-1)
-    for island in points:
-        colorPattern=[]
-        for point in island:
-            coord=n.getXY(point.row,point.col)
-            bwColor=BWImage[coord[1]][coord[0]]
-            if bwColor==0: 
-                colorPattern.append(-1)
-            elif bwColor==255:
-                colorPattern.append(1)
-            else:
-                colorPattern.append(0)
-        
+    _,colorPatterns=getIslandPixels(points)
+    for colorPattern in colorPatterns:
         if YIsland.hasError(colorPattern):
             total+=1
     return total
@@ -378,24 +394,30 @@ def jiggle(x,y):
 
     n.invalidateCache()
 
-def dataAsString():
-    string="row,col,leg 1 angle,leg 1 color,leg 2 color,leg 3 color,center color\n"
+#every island as (row, col, leg 1 angle, colors) where colors are the center and then the three legs (-1, 1 or 0 if it is unclear)
+def getIslands():
     points,legAngles=yLattice.getSamplePoints(n.rows-1,n.cols-1)
-    for island,legAngle in zip(points,legAngles):
-        colorPattern=[]
-        for point in island:
-            coord=n.getXY(point.row,point.col)
-            bwColor=BWImage[coord[1]][coord[0]]
-            if bwColor==0: 
-                colorPattern.append(-1)
-            elif bwColor==255:
-                colorPattern.append(1)
-            else:
-                colorPattern.append(0)
-        colorCode=colorPattern
-        string+=f"{island[0].row},{island[0].col},{legAngle},{colorCode[1]},{colorCode[2]},{colorCode[3]},{colorCode[0]}\n"
-
-    return string
+    _,colorPatterns=getIslandPixels(points)
+    for island,legAngle,colorPattern in zip(points,legAngles,colorPatterns):
+        yield island[0].row,island[0].col,legAngle,colorPattern
+
+#the csv file a line at a time, so it can be written while it is made (see exporter.py)
+def dataAsLines():
+    yield "row,col,leg 1 angle,leg 1 color,leg 2 color,leg 3 color,center color\n"
+    for row,col,legAngle,colorCode in getIslands():
+        yield f"{row},{col},{legAngle},{colorCode[1]},{colorCode[2]},{colorCode[3]},{colorCode[0]}\n"
+
+#write every island to a csv file, or to a npz file with one array per column (color has the center and leg colors of each island in that order)
+def writeData(fileName):
+    if fileName.lower().endswith(".npz"):
+        islands=list(getIslands())
+        writeArrays(fileName,
+            row=np.array([island[0] for island in islands],dtype=np.float64),
+            col=np.array([island[1] for island in islands],dtype=np.float64),
+            legAngle=np.array([island[2] for island in islands],dtype=np.float64),
+            color=np.array([island[3] for island in islands],dtype=np.int8).reshape(-1,4))
+    else:
+        writeLines(fileName,dataAsLines())
 
 
 
@@ -415,24 +437,45 @@ def mouse_event(event, x, y,flags, param):
 
     lastMouse=(x,y)
 
-    show()
+    #moving the mouse only changes anything while dragging
+    if event!=cv2.EVENT_MOUSEMOVE or n.dragging:
+        scheduler.requestRender()
 
 
 
 n=NodeNetwork(Node(10,10),Node(600,10),Node(10,600),Node(600,600),15,15)
 
+#save/load the grid along with the pattern offsets
+def saveGrid(fileName):
+    state=n.getGridState()
+    state["pattern"]=yLattice.getState()
+    with open(fileName,'w') as file:
+        json.dump(state,file)
+
+def loadGrid(fileName):
+    with open(fileName) as file:
+        state=json.load(file)
+    n.setGridState(state)
+    if "pattern" in state:
+        yLattice.setState(state["pattern"])
+
+if args.load_grid is not None:
+    loadGrid(args.load_grid)
+
 
 
     
 
 
-show()
+#the windows are redrawn at most args.fps times a second (see renderScheduler.py)
+scheduler=RenderScheduler(show,fps=args.fps)
+scheduler.requestRender()
 cv2.setMouseCallback('window', mouse_event)
 
 while(True):
-    show()
-
-    key=cv2.waitKey(0)
+    key=scheduler.waitKey()
+    if key==-1:
+        continue
     if(key==ord("\r")):
         break;
     elif(key==ord("r")):
@@ -476,6 +519,8 @@ while(True):
     elif(key==ord("l")):
         yLattice.rowEndOffset+=0.25
         yLattice.invalidateCache()
+
+    scheduler.requestRender()
     
     
 
@@ -484,8 +529,10 @@ while(True):
 outputname=args.image[0].split("/")[-1].split(".")[0]
 print(outputname)
 
-with open(outputname+".csv", 'w') as file:
-    file.write(dataAsString())
+writeData(outputname+"."+args.format)
+
+if args.save_grid is not None:
+    saveGrid(args.save_grid)
 
 outputImage=np.zeros((1000,1000,3), np.uint8)
 outputImage[:,:]=(127,127,127)
@@ -0,0 +1,60 @@
+"""
+This file reads images for the readers so that every reader handles the same kinds of files the same way.
+MFM scans are often saved as single channel TIFFs with 16 bit or floating point values. These are kept single channel (a NodeNetwork samples a
+single channel image just as well and it takes a third of the memory) and are stretched to 0-255 in one vectorized step so the darkest pixel is 0 and
+the brightest is 255. 8 bit images are returned as they are, so ordinary jpg/png/bmp images come out the same as with cv2.imread.
+"""
+
+import cv2
+import numpy as np
+
+#dtypes cv2.convertScaleAbs() can read, anything else is turned into float64 first
+CONVERTIBLE_DTYPES=(np.int8,np.uint16,np.int16,np.int32,np.float32,np.float64)
+
+#read an image as a contiguous uint8 array, (height, width) if it has one channel or (height, width, 3) if it has color
+#if color is set, a single channel image is turned into 3 channels anyway (e.g. for a reference image that gets drawn on)
+def loadImage(path,color=False):
+    image=cv2.imread(path,cv2.IMREAD_ANYDEPTH|cv2.IMREAD_ANYCOLOR)
+    if image is None:
+        raise FileNotFoundError("Cannot find image")
+    image=normalizeImage(image)
+    if color and image.ndim==2:
+        image=cv2.cvtColor(image,cv2.COLOR_GRAY2BGR)
+    return image
+
+#turn an array of any dtype into a contiguous uint8 image, stretched over its own range of values (see getRange())
+def normalizeImage(image):
+    image=normalizeChannels(image)
+    if image.dtype!=np.uint8:
+        image=toUint8(image,*getRange(image))
+    return np.ascontiguousarray(image)
+
+#drop a single channel axis and an alpha channel, the rest of the code works on (height, width) or (height, width, 3) images
+def normalizeChannels(image):
+    if image.ndim==3 and image.shape[2]==1:
+        return image[:,:,0]
+    if image.ndim==3 and image.shape[2]==4:
+        return image[:,:,0:3]
+    return image
+
+#smallest and largest value of an image, not counting nan or infinity
+#a part of the image can be given at a time by passing the range so far in, so an image that doesn't fit in memory can be done in pieces
+def getRange(image,low=np.inf,high=-np.inf):
+    if image.dtype.kind=="f":
+        finite=image[np.isfinite(image)]
+        if len(finite)==0:
+            return low,high
+        return min(low,float(finite.min())),max(high,float(finite.max()))
+    return min(low,float(image.min())),max(high,float(image.max()))
+
+#stretch the values from low to high to 0-255, low and high have to cover every value of the image (see getRange()) and nan is 0
+def toUint8(image,low,high):
+    if image.dtype.type not in CONVERTIBLE_DTYPES:
+        image=image.astype(np.float64)
+    if image.dtype.kind=="f" and not np.isfinite(image).all():
+        image=np.nan_to_num(image,nan=low,posinf=high,neginf=low)
+    #an image with only one value (or none) is all black
+    if not high>low:
+        return np.zeros(image.shape,dtype=np.uint8)
+    scale=255/(high-low)
+    return cv2.convertScaleAbs(image,alpha=scale,beta=-low*scale)
@@ -0,0 +1,177 @@
+"""
+This file finds the lattice in an MFM image so that a NodeNetwork can start out roughly aligned instead of from hard coded corners.
+The autocorrelation of the image (computed with an FFT) has a peak at every translation that maps the lattice onto itself.
+The two shortest of these translations give the spacing and rotation of the lattice, and the phase of the image at the matching
+frequencies gives where the lattice points are. The result is a proposed set of four corners
+and a number of rows and columns which can then be fine tuned by hand.
+"""
+
+import cv2
+import numpy as np
+import math
+from nodeNetwork import Node
+from tiledImage import TiledImage
+
+#turn an image into a float grayscale image with a mean of 0
+def toGray(image):
+    if image.ndim==3:
+        image=cv2.cvtColor(image.astype(np.float32),cv2.COLOR_BGR2GRAY)
+    gray=image.astype(np.float64)
+    return gray-gray.mean()
+
+#the image the lattice is found in
+#in a phase image every island has a black and a white half and which side is which depends on the island, so the image itself doesn't repeat.
+#how far each pixel is from the average of the area around it does (it is high on every island no matter which way it points) so that is used instead
+#backgroundSize is the width of the area that is averaged, by default it is 1/50 of the image
+def getFeatureImage(image,backgroundSize=None):
+    gray=toGray(image)
+    if backgroundSize is None:
+        backgroundSize=max(gray.shape)/50
+    feature=np.abs(gray-cv2.GaussianBlur(gray,(0,0),backgroundSize))
+    feature=cv2.GaussianBlur(feature,(0,0),1.5)
+    return feature-feature.mean()
+
+#autocorrelation of a grayscale image, shifted so that no translation is in the center and normalized so the center is 1
+def getAutocorrelation(gray):
+    #window the image so the edges don't show up as a lattice
+    window=cv2.createHanningWindow((gray.shape[1],gray.shape[0]),cv2.CV_64F)
+    spectrum=np.fft.rfft2(gray*window)
+    autocorrelation=np.fft.fftshift(np.fft.irfft2(np.abs(spectrum)**2,s=gray.shape))
+    return autocorrelation/autocorrelation.max()
+
+#find the local maxima in the autocorrelation
+#returns an (N,3) array of [dx, dy, value] relative to the center, with sub-pixel dx and dy
+def findPeaks(autocorrelation):
+    height,width=autocorrelation.shape
+    centerY,centerX=height//2,width//2
+
+    isPeak=(autocorrelation==cv2.dilate(autocorrelation,np.ones((3,3),np.uint8))) & (autocorrelation>0)
+    isPeak[[0,-1],:]=False
+    isPeak[:,[0,-1]]=False
+    isPeak[centerY,centerX]=False
+    y,x=np.nonzero(isPeak)
+
+    #fit a parabola through the peak and its neighbours in each direction to get the peak to less than a pixel
+    def refine(before,peak,after):
+        denominator=before-2*peak+after
+        safeDenominator=np.where(denominator<0,denominator,-1)
+        return np.where(denominator<0,(before-after)/(2*safeDenominator),0)
+    dx=refine(autocorrelation[y,x-1],autocorrelation[y,x],autocorrelation[y,x+1])
+    dy=refine(autocorrelation[y-1,x],autocorrelation[y,x],autocorrelation[y+1,x])
+
+    return np.stack([x+dx-centerX,y+dy-centerY,autocorrelation[y,x]],axis=1)
+
+#find the two shortest translations that map the lattice onto itself (and aren't in the same direction), as [dx,dy] arrays
+#only peaks at least minStrength times as strong as the strongest of the short translations count, this ignores translations that only line up part of the lattice
+#(the strongest short translation is used instead of the strongest overall since a larger repeat, like the whole Santa Fe pattern, can be stronger than the islands)
+#minAngle is how many degrees apart the two translations must be
+def findLatticeVectors(feature,minStrength=0.75,minAngle=20):
+    peaks=findPeaks(getAutocorrelation(feature))
+    if len(peaks)==0:
+        raise Exception("Could not find a lattice in the image")
+    lengths=np.hypot(peaks[:,0],peaks[:,1])
+    order=np.argsort(lengths)
+    peaks=peaks[order]
+    lengths=lengths[order]
+    strongest=peaks[lengths<=2*lengths[0],2].max()
+    peaks=peaks[peaks[:,2]>=minStrength*strongest]
+
+    first=peaks[0,0:2]
+    for peak in peaks[1:]:
+        second=peak[0:2]
+        sin=abs(first[0]*second[1]-first[1]*second[0])/(np.linalg.norm(first)*np.linalg.norm(second))
+        if sin>=math.sin(math.radians(minAngle)):
+            return first,second
+    raise Exception("Could not find a lattice in the image")
+
+#turn two lattice vectors into the ones the grid is built on
+#horizontal is the short lattice vector closest to pointing right (it must be within maxAngle degrees)
+#vertical is the lattice vector that goes down to the next row of the lattice, it can be slanted (e.g. if every other row is shifted)
+def getGridVectors(first,second,maxAngle=20):
+    candidates=[first,second,first+second,first-second]
+    candidates=[candidate if candidate[0]>=0 else -candidate for candidate in candidates]
+    angles=[abs(math.degrees(math.atan2(candidate[1],candidate[0]))) for candidate in candidates]
+    horizontal=candidates[int(np.argmin(angles))]
+    if min(angles)>maxAngle:
+        raise Exception("Could not find a lattice in the image lined up with the window")
+
+    across=horizontal/np.linalg.norm(horizontal)
+    down=np.array([-across[1],across[0]])
+    candidates=[candidate if np.dot(candidate,down)>=0 else -candidate for candidate in candidates]
+    candidates=[candidate for candidate in candidates if np.dot(candidate,down)>1e-6*np.linalg.norm(horizontal)]
+    vertical=min(candidates,key=lambda candidate:(round(np.dot(candidate,down),6),abs(np.dot(candidate,across))))
+    return horizontal,vertical
+
+#fourier coefficient of the image at a frequency [fx,fy] (in cycles per pixel)
+def getCoefficient(gray,frequency):
+    y,x=np.mgrid[0:gray.shape[0],0:gray.shape[1]]
+    return np.sum(gray*np.exp(-2j*math.pi*(frequency[0]*x+frequency[1]*y)))
+
+#where along a frequency the image is brightest, as a fraction of a cycle
+def getPhase(coefficient):
+    return -np.angle(coefficient)/(2*math.pi)
+
+#propose a grid for a NodeNetwork that lines up with the lattice in an image
+#periodCells is how many (rows, cols) of the reader's squares it takes to go down one row of the lattice and across one repeat of the lattice
+#the grid lines cross on an island, phaseOffset moves the islands by (rows, cols) squares (e.g. (0.5,0.5) puts them in the middle of the squares)
+#the grid is kept margin pixels inside the image and every corner is moved by borderWidth (see NodeNetwork)
+#if the image is shown at a different size, displaySize is that (width, height) and the corners are given on the display
+#a TiledImage is too big to search whole, so the level of its pyramid that is closest to displaySize is searched instead
+#returns (topLeft, topRight, bottomLeft, bottomRight, rows, cols) in the same format NodeNetwork takes them
+def proposeGrid(image,periodCells=(1,1),phaseOffset=(0,0),margin=10,borderWidth=0,maxAngle=20,minStrength=0.75,displaySize=None):
+    if isinstance(image,TiledImage):
+        if displaySize is None:
+            displaySize=(image.shape[1],image.shape[0])
+        image=image.getLevelImage(image.chooseLevel(displaySize))
+    feature=getFeatureImage(image)
+    horizontal,vertical=getGridVectors(*findLatticeVectors(feature,minStrength=minStrength),maxAngle=maxAngle)
+
+    #unit vectors along the rows and down the columns of the grid
+    across=horizontal/np.linalg.norm(horizontal)
+    down=np.array([-across[1],across[0]])
+
+    colPeriod=np.linalg.norm(horizontal)
+    rowPeriod=np.dot(vertical,down)
+    cellWidth=colPeriod/periodCells[1]
+    cellHeight=rowPeriod/periodCells[0]
+
+    #fit as many squares in the image as possible (the grid might be rotated a little)
+    height,width=feature.shape
+    availableWidth=width-2*margin
+    availableHeight=height-2*margin
+    cos=abs(across[0])
+    sin=abs(across[1])
+    cols=int(availableWidth//cellWidth)
+    rows=int(availableHeight//cellHeight)
+    while cols>1 and rows>1 and (cols*cellWidth*cos+rows*cellHeight*sin>availableWidth or cols*cellWidth*sin+rows*cellHeight*cos>availableHeight):
+        cols-=1
+        rows-=1
+
+    #leave room to shift the grid by up to half a repeat in each direction to line it up with the lattice
+    cols=max(cols-periodCells[1],1)
+    rows=max(rows-periodCells[0],1)
+
+    #where the centered grid would start, and where the island that should be there would be
+    center=np.array([width/2,height/2])
+    offset=across*phaseOffset[1]*cellWidth+down*phaseOffset[0]*cellHeight
+    target=center-across*cols*cellWidth/2-down*rows*cellHeight/2+offset
+
+    #the phase of the image along both lattice vectors gives where the lattice points are, then move to the one closest to the target
+    lattice=np.stack([horizontal,vertical],axis=1)
+    phase=[getPhase(getCoefficient(feature,frequency)) for frequency in np.linalg.inv(lattice)]
+    point=lattice@np.array(phase)
+    point=point+vertical*round(np.dot(target-point,down)/rowPeriod)
+    point=point+horizontal*round(np.dot(target-point,across)/colPeriod)
+
+    origin=point-offset
+    topLeft=origin
+    topRight=origin+across*cols*cellWidth
+    bottomLeft=origin+down*rows*cellHeight
+    bottomRight=topRight+bottomLeft-origin
+
+    #stretching the image to the display stretches the lattice the same way so the corners can just be scaled
+    scale=np.ones(2)
+    if displaySize is not None:
+        scale=np.array([displaySize[0]/width,displaySize[1]/height])
+    corners=[Node(float(corner[0]*scale[0]+borderWidth),float(corner[1]*scale[1]+borderWidth)) for corner in (topLeft,topRight,bottomLeft,bottomRight)]
+    return corners[0],corners[1],corners[2],corners[3],rows+1,cols+1
@@ -0,0 +1,77 @@
+"""
+This file loads the islands of a Y shaped lattice saved by generalizedYShapeReader.py into arrays, for genLattice() in the analysis scripts.
+The csv is parsed with one call to np.loadtxt() into a (number of islands, 7) array in the order of its columns instead of a line and a field at a time.
+The array is then cached in a sidecar file next to the csv (the csv name with ".cache.npz" added) along with the size and modification time
+of the csv, so running an analysis over the same frames again loads the arrays straight from the cache without parsing any text.
+The .npz files written by generalizedYShapeReader.py --format npz can be loaded too.
+"""
+
+import numpy as np
+import io
+import os
+
+#columns of the csv written by generalizedYShapeReader.py, every array returned here has its columns in this order
+COLUMNS=["row","col","leg 1 angle","leg 1 color","leg 2 color","leg 3 color","center color"]
+
+#added to the name of a csv to get the name of its cache
+CACHE_SUFFIX=".cache.npz"
+
+#every island in a csv (or .npz) file as a (number of islands, 7) float64 array with the columns in COLUMNS
+def loadIslandArray(filename):
+    if filename.endswith(CACHE_SUFFIX):
+        raise ValueError(filename+" is a cache, load the csv it was made from instead")
+    if filename.lower().endswith(".npz"):
+        return readIslandNPZ(filename)
+
+    #the cache is only used if the csv is the same size and hasn't been modified since it was made
+    stat=os.stat(filename)
+    key=np.array([stat.st_size,stat.st_mtime_ns],dtype=np.int64)
+    cachePath=filename+CACHE_SUFFIX
+    if os.path.exists(cachePath):
+        try:
+            with np.load(cachePath) as cache:
+                if np.array_equal(cache["key"],key):
+                    return cache["islands"]
+        except (OSError,ValueError,KeyError):
+            pass
+
+    islands=readIslandCSV(filename)
+
+    #write the cache to a temporary file first so a half written cache is never read (e.g. by another process of a batch)
+    #if it can't be written (e.g. the folder is read only) the csv is just parsed again next time
+    #the temporary file also ends in CACHE_SUFFIX so it is ignored by git like the cache, and it is deleted if it was never moved
+    temporaryPath=filename+"."+str(os.getpid())+".tmp"+CACHE_SUFFIX
+    try:
+        np.savez(temporaryPath,key=key,islands=islands)
+        os.replace(temporaryPath,cachePath)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(temporaryPath):
+            try:
+                os.remove(temporaryPath)
+            except OSError:
+                pass
+    return islands
+
+#parse a csv written by generalizedYShapeReader.py
+def readIslandCSV(filename):
+    with open(filename) as csvfile:
+        headers=[header.strip() for header in csvfile.readline().split(",")]
+        if headers!=COLUMNS:
+            raise ValueError(f"unexpected columns {headers} in {filename}")
+        body=csvfile.read().strip()
+
+    if len(body)==0:
+        return np.zeros((0,len(COLUMNS)))
+    #np.loadtxt raises a ValueError for a field that isn't a number or a line with a different number of fields
+    islands=np.loadtxt(io.StringIO(body),delimiter=",",dtype=np.float64,ndmin=2)
+    if islands.shape[1]!=len(COLUMNS):
+        raise ValueError(filename+" does not have "+str(len(COLUMNS))+" numbers on every line")
+    return islands
+
+#load a .npz written by generalizedYShapeReader.py, its colors are (center, leg 1, leg 2, leg 3) so they are moved to the order of the csv
+def readIslandNPZ(filename):
+    with np.load(filename) as data:
+        color=data["color"].astype(np.float64)
+        return np.column_stack([data["row"],data["col"],data["legAngle"],color[:,1],color[:,2],color[:,3],color[:,0]])
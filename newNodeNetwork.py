@@ -15,6 +15,7 @@ import numpy as np
 import math
 from random import random, sample
 import time
+import json
 
 #constants
 WHITE=(255,255,255)
@@ -137,6 +138,7 @@ class NodeNetwork:
     def invalidateCache(self):
         self.getGrid.cache_clear()
         self.getXY.cache_clear()
+        self.getPatchMaps.cache_clear()
 
     @cache
     #generates the grid based on the subgrids
@@ -207,6 +209,44 @@ class NodeNetwork:
 
         return (math.floor(out[0][0]),math.floor(out[1][0]))
 
+    @cache
+    #the map getXY() uses for every patch of the grid, made once so getXYArray() can look them up instead of building them for every point
+    #origins[row][col] is the top left point of a patch and matrices[rowStep][colStep][row][col] is the matrix of the patch from (row,col) to
+    #(row+rowStep,col+colStep), a step of 0 is the edge getXY() uses for a whole row or col (the patch wraps around like the grid list does)
+    def getPatchMaps(self):
+        origins=np.array(self.getGrid(),dtype=np.float64)
+
+        matrices=np.empty((2,2)+origins.shape+(2,))
+        for rowStep in range(2):
+            for colStep in range(2):
+                topLeftPoints=origins
+                topRightPoints=np.roll(origins,-colStep,axis=1)
+                bottomLeftPoints=np.roll(origins,-rowStep,axis=0)
+                bottomRightPoints=np.roll(bottomLeftPoints,-colStep,axis=1)
+
+                iHatPrime=(topRightPoints-topLeftPoints)/2+(bottomRightPoints-bottomLeftPoints)/2
+                jHatPrime=(bottomLeftPoints-topLeftPoints)/2+(bottomRightPoints-topRightPoints)/2
+                matrices[rowStep][colStep]=np.stack([iHatPrime,jHatPrime],axis=-1)
+        return origins,matrices
+
+    #getXY() for arrays of rows and cols at once, returns the arrays of x and y (the same shape as rows and cols)
+    def getXYArray(self,rows,cols):
+        rows=np.asarray(rows,dtype=np.float64)
+        cols=np.asarray(cols,dtype=np.float64)
+        origins,matrices=self.getPatchMaps()
+
+        rowFloors=np.floor(rows).astype(int)
+        rowCeils=np.ceil(rows).astype(int)
+        colFloors=np.floor(cols).astype(int)
+        colCeils=np.ceil(cols).astype(int)
+        if rows.size>0 and (rowFloors.min()<-self.rows or rowCeils.max()>=self.rows or colFloors.min()<-self.cols or colCeils.max()>=self.cols):
+            raise IndexError("point outside of the grid")
+
+        offsetVectors=np.stack([cols%1,rows%1],axis=-1)[...,np.newaxis]
+        out=origins[rowFloors,colFloors]+np.matmul(matrices[rowCeils-rowFloors,colCeils-colFloors,rowFloors,colFloors],offsetVectors)[...,0]
+
+        return np.floor(out[...,0]).astype(int),np.floor(out[...,1]).astype(int)
+
         
 
     #gets the nearest point on the grid to (x,y)
@@ -291,6 +331,42 @@ class NodeNetwork:
         self.fixedPoints.sort(key=eval)
         return self.fixedPoints
 
+    #the alignment of the grid (number of rows and columns and every fixed point) in a form that can be saved as json
+    def getGridState(self):
+        return {
+            "rows":self.rows,
+            "cols":self.cols,
+            "fixedPoints":[[point["row"],point["col"],point["node"].x,point["node"].y] for point in self.getSortedFixedPoints()]
+        }
+
+    #line the grid up the way it was when getGridState() was called
+    def setGridState(self,state):
+        self.rows=state["rows"]
+        self.cols=state["cols"]
+        self.fixedPoints=[{"row":row,"col":col,"node":Node(x,y)} for (row,col,x,y) in state["fixedPoints"]]
+        self.fixedRows=sorted({point["row"] for point in self.fixedPoints})
+        self.fixedCols=sorted({point["col"] for point in self.fixedPoints})
+
+        corners={(point["row"],point["col"]):point["node"] for point in self.fixedPoints}
+        self.topLeft=corners[(0,0)]
+        self.topRight=corners[(0,self.cols-1)]
+        self.bottomLeft=corners[(self.rows-1,0)]
+        self.bottomRight=corners[(self.rows-1,self.cols-1)]
+
+        self.selectedPoint=None
+        self.dragging=False
+        self.invalidateCache()
+
+    #save the grid state (see getGridState()) to a json file
+    def saveGrid(self,fileName):
+        with open(fileName,'w') as file:
+            json.dump(self.getGridState(),file)
+
+    #load a grid state saved with saveGrid()
+    def loadGrid(self,fileName):
+        with open(fileName) as file:
+            self.setGridState(json.load(file))
+
     #drag to x,y
     def updateDragging(self,x,y):
         if(self.dragging):
@@ -12,8 +12,14 @@ The output of the nodenetwork will generally just be reading the color of each o
 import cv2
 import numpy as np
 import math
-from random import random, sample
 import time
+import json
+from bisect import bisect_left
+from collections import OrderedDict
+from spatialIndex import BucketGrid
+from preprocessing import Preprocessor
+from overlay import Overlay
+from tiledImage import TiledImage
 
 #constants
 WHITE=(255,255,255)
@@ -22,14 +28,60 @@ GREEN=(0,255,0)
 BLUE=(255,0,0)
 RED=(0,0,255)
 
+#settings of the adaptive threshold tried by useBestThreshold(), the block sizes are in pixels of the display like the default one (see toImageSize())
+SWEEP_BLOCK_SIZES=(5,7,11,15,21,31,41)
+SWEEP_OFFSETS=(-6,-4,-2,0,2,4,6)
+
+#how many black and white tiles of a TiledImage are kept (see getTileBWImage())
+TILE_CACHE_SIZE=64
+
+#nearest odd size to a size (at least minimum), e.g. for a blur or threshold scaled to the image
+def toOddSize(size,minimum=1):
+    return max(int(2*round((size-1)/2)+1),minimum)
+
 #takes in an [x1,y1] and [x2,y2] and returns their distance
 def dist(point1, point2):
     return math.sqrt(math.pow(point1[0] - point2[0], 2)+math.pow(point1[1] - point2[1], 2))
+#mean of the rectangles from (x-radiusX,y-radiusY) to (x+radiusX,y+radiusY) of the image an integral image was made from (see Preprocessor.getIntegral())
+#the part of a rectangle outside the image is ignored and it is nan if all of it is outside
+def getMeanFromIntegral(integral,x,y,radiusX,radiusY):
+    height=integral.shape[0]-1
+    width=integral.shape[1]-1
+    x0=np.clip(x-radiusX,0,width)
+    x1=np.clip(x+radiusX+1,0,width)
+    y0=np.clip(y-radiusY,0,height)
+    y1=np.clip(y+radiusY+1,0,height)
+    area=(x1-x0)*(y1-y0)
+    total=integral[y1,x1]-integral[y0,x1]-integral[y1,x0]+integral[y0,x0]
+    return np.where(area>0,total/np.maximum(area,1),np.nan)
+
 #takes in an [x1,y1] and [x2,y2] and returns a point a certain percent between the two
 def getIntermediate(point1,point2,percent):
     return [(point2[0]-point1[0])*percent+point1[0], (point2[1]-point1[1])*percent+point1[1]]
 
-
+#takes in the sorted indices of the fixed rows (or cols) and the rows (or cols) to look up, start inclusive and end exclusive
+#returns, for every row, the index of the patch it falls in and how far through that patch it is (0-1)
+def getPatchFractions(fixedIndices,start,end):
+    fixedIndices=np.asarray(fixedIndices)
+    indices=np.arange(start,end)
+    patch=np.searchsorted(fixedIndices,indices,side="right")-1
+    patch=np.clip(patch,0,len(fixedIndices)-2)
+    start=fixedIndices[patch]
+    end=fixedIndices[patch+1]
+    return patch, (indices-start)/(end-start)
+
+
+
+#takes in an (M,K,2) array of K sample points for each of M squares and optionally an (M,) boolean array of which squares have points
+#returns the points as a single (N,2) array and the number of points in each square (the format returned by getSamplePointsFromSquares)
+def stackSamplePoints(points,keep=None):
+    points=np.asarray(points,dtype=np.float64)
+    counts=np.full(len(points),points.shape[1],dtype=np.int64)
+    if keep is not None:
+        keep=np.asarray(keep,dtype=bool)
+        counts[~keep]=0
+        points=points[keep]
+    return points.reshape(-1,2),counts
 
 #Basic class to hold an x and y value
 class Node:
@@ -52,28 +104,186 @@ def xyArrayToIntTuple(arr):
     return (int(arr[0]),int(arr[1]))
 
 
+#stores every sample point of the lattice in flat arrays instead of nested [row][cell][point] lists
+#the points of the cell at (row,col) are x[offsets[i]:offsets[i+1]] (same for y and color) where i=row*cols+col
+#color is 1 for white, -1 for black and 0 for unreadable
+class SamplePointStore:
+    def __init__(self,rows,cols,x,y,color,offsets):
+        #number of rows and columns of cells (one less than the rows and cols of the grid)
+        self.rows=rows
+        self.cols=cols
+
+        self.x=np.asarray(x,dtype=np.float32)
+        self.y=np.asarray(y,dtype=np.float32)
+        self.color=np.asarray(color,dtype=np.int8)
+        self.offsets=np.asarray(offsets,dtype=np.int64)
+
+        #goes up every time a point is changed so anything computed from the points (e.g. the error mask) knows when it is out of date
+        self.version=0
+
+        #row and col in the whole lattice of the first cell (not 0 when this only holds part of the lattice, see getRegion())
+        self.firstRow=0
+        self.firstCol=0
+
+    #build a store from flat arrays of points and the number of points in each cell (cells ordered left-to-right, top-to-bottom)
+    @staticmethod
+    def fromCounts(rows,cols,x,y,color,counts):
+        offsets=np.zeros(len(counts)+1,dtype=np.int64)
+        offsets[1:]=np.cumsum(counts)
+        return SamplePointStore(rows,cols,x,y,color,offsets)
+
+    #total number of sample points
+    def __len__(self):
+        return len(self.color)
+
+    #index of the first point in a cell
+    def pointIndex(self,row,col,index=0):
+        return self.offsets[row*self.cols+col]+index
+
+    #number of sample points in a cell
+    def cellSize(self,row,col):
+        cell=row*self.cols+col
+        return int(self.offsets[cell+1]-self.offsets[cell])
+
+    #number of sample points in every cell as a (rows,cols) array
+    def getCellSizes(self):
+        return np.diff(self.offsets).reshape(self.rows,self.cols)
+
+    def getPoint(self,row,col,index):
+        i=self.pointIndex(row,col,index)
+        return [float(self.x[i]),float(self.y[i]),int(self.color[i])]
+
+    def getColor(self,row,col,index):
+        return int(self.color[self.pointIndex(row,col,index)])
+
+    def setColor(self,row,col,index,color):
+        self.setColorAt(self.pointIndex(row,col,index),color)
+
+    #set the color of a point by its index in the flat arrays
+    def setColorAt(self,pointIndex,color):
+        self.color[pointIndex]=color
+        self.version+=1
+
+    #colors of every point in a cell (this is a view, use setColor() to change colors so the version is updated)
+    def getCellColors(self,row,col):
+        cell=row*self.cols+col
+        return self.color[self.offsets[cell]:self.offsets[cell+1]]
+
+    #indices of the points of every cell with rowStart<=row<rowEnd and colStart<=col<colEnd (ordered left-to-right, top-to-bottom)
+    def getCellRangeIndices(self,rowStart,rowEnd,colStart,colEnd):
+        rowFirstCells=np.arange(rowStart,rowEnd)*self.cols
+        return np.concatenate([np.arange(self.offsets[cell+colStart],self.offsets[cell+colEnd]) for cell in rowFirstCells]+[np.zeros(0,dtype=np.int64)])
+
+    #a copy of the cells with rowStart<=row<rowEnd and colStart<=col<colEnd as a new (smaller) store
+    def getRegion(self,rowStart,rowEnd,colStart,colEnd):
+        indices=self.getCellRangeIndices(rowStart,rowEnd,colStart,colEnd)
+        counts=self.getCellSizes()[rowStart:rowEnd,colStart:colEnd].ravel()
+        region=SamplePointStore.fromCounts(rowEnd-rowStart,colEnd-colStart,self.x[indices],self.y[indices],self.color[indices],counts)
+        region.firstRow=self.firstRow+rowStart
+        region.firstCol=self.firstCol+colStart
+        return region
+
+    def copy(self):
+        store=SamplePointStore(self.rows,self.cols,self.x.copy(),self.y.copy(),self.color.copy(),self.offsets.copy())
+        store.firstRow=self.firstRow
+        store.firstCol=self.firstCol
+        return store
+
+    #replace the points of every cell with rowStart<=row<rowEnd and colStart<=col<colEnd
+    #x, y and color are the new points of those cells (ordered left-to-right, top-to-bottom) and counts is the number of new points in each cell
+    #returns the indices of the replaced points if they could be overwritten in place, otherwise None (every index may have changed)
+    def replaceCells(self,rowStart,rowEnd,colStart,colEnd,x,y,color,counts):
+        counts=np.asarray(counts,dtype=np.int64)
+        oldCounts=self.getCellSizes()[rowStart:rowEnd,colStart:colEnd].ravel()
+
+        #if every cell keeps the same number of points we can just overwrite them in place
+        if np.array_equal(counts,oldCounts):
+            indices=self.getCellRangeIndices(rowStart,rowEnd,colStart,colEnd)
+            self.x[indices]=x
+            self.y[indices]=y
+            self.color[indices]=color
+            self.version+=1
+            return indices
+
+        #otherwise rebuild the arrays, putting the new points in between the old ones by cell
+        regionCells=(np.arange(rowStart,rowEnd)[:,np.newaxis]*self.cols+np.arange(colStart,colEnd)).ravel()
+        cells=np.repeat(np.arange(self.rows*self.cols),np.diff(self.offsets))
+        keep=~np.isin(cells,regionCells)
+        order=np.argsort(np.concatenate([cells[keep],np.repeat(regionCells,counts)]),kind="stable")
+        self.x=np.concatenate([self.x[keep],np.asarray(x,dtype=np.float32)])[order]
+        self.y=np.concatenate([self.y[keep],np.asarray(y,dtype=np.float32)])[order]
+        self.color=np.concatenate([self.color[keep],np.asarray(color,dtype=np.int8)])[order]
+
+        allCounts=np.diff(self.offsets)
+        allCounts[regionCells]=counts
+        self.offsets[1:]=np.cumsum(allCounts)
+        self.version+=1
+        return None
+
+    #row, col and index within its cell for every point
+    def getLatticeIndices(self):
+        counts=np.diff(self.offsets)
+        cells=np.repeat(np.arange(self.rows*self.cols),counts)
+        index=np.arange(len(self))-self.offsets[cells]
+        return cells//self.cols, cells%self.cols, index
+
+    #given the index of a point in the flat arrays, find the row, col, and index within the cell
+    def getLocation(self,pointIndex):
+        cell=int(np.searchsorted(self.offsets,pointIndex,side="right"))-1
+        return cell//self.cols, cell%self.cols, int(pointIndex-self.offsets[cell])
+
+
 #main class
 class NodeNetwork:
-    def __init__(self,topLeft,topRight,bottomLeft,bottomRight,rows, cols, image,pointSampleRadius=5,borderWidth=0,colorBias=0):
-        #make border
+    def __init__(self,topLeft,topRight,bottomLeft,bottomRight,rows, cols, image,pointSampleRadius=5,borderWidth=0,colorBias=0,preprocessor=None,sampleRadius=None,displaySize=None):
+        #the border is a gray area around the image so the grid can go past the edges of the image
+        #it is only drawn (see getBaseImage()), all positions are shifted by borderWidth when the image is sampled and anything in the border is unreadable
         self.borderWidth=borderWidth
-        imHeight=len(image)
-        imWidth=len(image[0])
-        base=np.zeros((imHeight+2*borderWidth,imWidth+2*borderWidth,3),dtype=np.uint8)
-        base[:,:]=127
-        base[borderWidth:imHeight+borderWidth,borderWidth:imWidth+borderWidth]=image
-        image=base
+        if image.dtype!=np.uint8:
+            image=image.astype(np.uint8)
         
 
         self.colorBias=colorBias
         self.image=image
-        cv2.waitKey(0)
+
+        #a TiledImage is never loaded whole, it is sampled and thresholded one tile at a time
+        self.tiled=isinstance(image,TiledImage)
+
+        #the image is sampled at its own resolution but shown stretched to displaySize (width, height), by default the size of the image
+        #everything the NodeNetwork is given or gives back (corners, mouse positions, sample points, sizes) is in pixels of the display
+        #and only turned into pixels of the image when it is sampled (see toImagePixels())
+        height,width=image.shape[0:2]
+        if displaySize is None:
+            displaySize=(width,height)
+        self.displaySize=(int(displaySize[0]),int(displaySize[1]))
+        self.displayScale=np.array([self.displaySize[0]/width,self.displaySize[1]/height])
+        if self.tiled:
+            self.displayImage=image.getDisplayImage(self.displaySize)
+        elif self.displaySize==(width,height):
+            self.displayImage=image
+        else:
+            self.displayImage=cv2.resize(image,self.displaySize)
+        #a single channel image is sampled as it is but shown in color so the grid can be drawn over it
+        if self.displayImage.ndim==2:
+            self.displayImage=cv2.cvtColor(self.displayImage,cv2.COLOR_GRAY2BGR)
 
 
         #how far around the pixel to look when determining the color of a point
         assert(pointSampleRadius%2==1)#must be odd
         self.pointSampleWidth=pointSampleRadius
-        self.bwImage=self.makeBWImage(image)
+
+        #if sampleRadius is set, a point is colored by the mean of the (2*sampleRadius+1) wide square around it instead of by the blurred black and white image
+        #this is done with the integral image so it can be changed (see setSampleRadius()) without reprocessing the image, override getSampleRadius() to use a different radius for each point
+        self.sampleRadius=sampleRadius
+
+        #turns the image into the black and white image that gets sampled, pass in a Preprocessor to change its settings (its sizes are in pixels of the image)
+        #colorBias raises the threshold, a point must be colorBias brighter than the area around it to be white
+        #by default the blur is as wide as pointSampleRadius on the display and the threshold area is 11 pixels of the display wide
+        if preprocessor is None:
+            blurSize=self.toImageSize(pointSampleRadius) if pointSampleRadius>0 else pointSampleRadius
+            preprocessor=Preprocessor(blurSize=blurSize,blockSize=self.toImageSize(11,3),offset=-colorBias)
+        self.preprocessor=preprocessor
+        self.makeBWImage(image)
 
         #number of rows and columns
         self.rows=rows;
@@ -83,327 +293,608 @@ class NodeNetwork:
         self.selectedPoint=None;
         self.dragging=False
 
+        #live preview resamples the patches around the dragged point while dragging, at most once every livePreviewInterval seconds
+        self.livePreview=False
+        self.livePreviewInterval=1/15
+        self.lastPreviewTime=0
+
+        #rows and columns which contain fixed points (always kept sorted)
+        self.fixedRows=[0,rows-1]
+        self.fixedCols=[0,cols-1]
+
+        #every fixed row and column cross at a fixed point, fixedTable[i][j] is the fixed point at row fixedRows[i] and col fixedCols[j]
         #format {row: rowIndex, col:colIndex, node:Node}
-        self.fixedPoints=[
-        {"row":0,"col":0,"node":topLeft},
-        {"row":0,"col":cols-1,"node":topRight},
-        {"row":rows-1,"col":0,"node":bottomLeft},
-        {"row":rows-1, "col":cols-1, "node":bottomRight}
+        self.fixedTable=[
+        [{"row":0,"col":0,"node":topLeft}, {"row":0,"col":cols-1,"node":topRight}],
+        [{"row":rows-1,"col":0,"node":bottomLeft}, {"row":rows-1, "col":cols-1, "node":bottomRight}]
             ]
 
         #defines boundaries
-        self.topLeft=self.fixedPoints[0]["node"];
-        self.topRight=self.fixedPoints[1]["node"];
-        self.bottomLeft=self.fixedPoints[2]["node"];
-        self.bottomRight=self.fixedPoints[3]["node"];
+        self.topLeft=topLeft;
+        self.topRight=topRight;
+        self.bottomLeft=bottomLeft;
+        self.bottomRight=bottomRight;
 
-        #rows and columns which contain fixed points
-        self.fixedRows=[0,rows-1]
-        self.fixedCols=[0,cols-1]
 
 
+        #spatial indices for finding the nearest grid point, fixed point and sample point to a click
+        #they are built when first needed and set to None whenever they are out of date
+        self.gridIndex=None
+        self.fixedPointIndex=None
+        self.samplePointIndex=None
+
+        #cached result of getErrors(), see getErrorMask()
+        self.errorMask=None
+        self.errorMaskVersion=None
+
+        #layers that draw() puts over the image, only the parts that changed are redrawn (see overlay.py)
+        self.overlay=None
 
         #array of stored samplepoints
         self.samplePoints=[]
         self.setSamplePoints()
     
+    #copy of the image at the display size with the border around it to draw on
     def getBaseImage(self):
-        return self.image.copy()
+        if self.borderWidth==0:
+            return self.displayImage.copy()
+        b=self.borderWidth
+        return cv2.copyMakeBorder(self.displayImage,b,b,b,b,cv2.BORDER_CONSTANT,value=(127,127,127))
+
+    #convert positions on the display (which include the border) to pixels in the image, x and y can be numbers or arrays
+    #the pixels can be outside of the image
+    def toImagePixels(self,x,y):
+        x=np.floor((np.asarray(x,dtype=np.float64)-self.borderWidth)/self.displayScale[0]).astype(np.int64)
+        y=np.floor((np.asarray(y,dtype=np.float64)-self.borderWidth)/self.displayScale[1]).astype(np.int64)
+        return x,y
+
+    #convert a distance on the display to a (horizontal, vertical) number of pixels in the image, radius can be a number or an array
+    def toImageRadius(self,radius):
+        radius=np.maximum(np.asarray(radius,dtype=np.float64),0)
+        return np.rint(radius/self.displayScale[0]).astype(np.int64),np.rint(radius/self.displayScale[1]).astype(np.int64)
+
+    #convert a size on the display (e.g. of a blur or threshold area) to the nearest odd size in pixels of the image, at least minimum
+    def toImageSize(self,size,minimum=1):
+        return toOddSize(size/self.displayScale.mean(),minimum)
+
+    #the block sizes of a threshold sweep (in pixels of the display) in pixels of the image, sizes that end up the same are only tried once
+    def toImageBlockSizes(self,blockSizes):
+        return sorted({self.toImageSize(blockSize,3) for blockSize in blockSizes})
+
+    #convert a position on the display to a pixel in the image, clamped to the edge of the image
+    def toImagePixel(self,x,y):
+        height,width=self.image.shape[0:2]
+        x,y=self.toImagePixels(x,y)
+        return min(max(int(x),0),width-1), min(max(int(y),0),height-1)
+
+    #whether pixels of the image (e.g. from toImagePixels()) are inside of it
+    def isInImage(self,x,y):
+        height,width=self.image.shape[0:2]
+        return (x>=0) & (x<width) & (y>=0) & (y<height)
 
     #turn an image black and white so that it can be easily sampled to find the color of a point
+    #both are single channel uint8 images
+    #a TiledImage isn't processed here, the tiles are processed when they are sampled (see getTileBWImage())
+    #the integral image is only made when a mean is first needed (see getImageMean()) since it takes 8 bytes a pixel
     def makeBWImage(self,image):
-        avg_color_per_row = np.average(image, axis=0)
-        avg_color = np.average(avg_color_per_row, axis=0)
-        avg=np.average(avg_color,axis=0)
-        print("Average color:",avg)
-
-        if(self.pointSampleWidth>0):
-            blur = cv2.GaussianBlur(image,(self.pointSampleWidth,self.pointSampleWidth),0)
-        else:
-            blur=image.copy()
-        self.blurredImage=blur
-        blur=cv2.cvtColor(blur,cv2.COLOR_RGB2GRAY)
-        self.BWImage=cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11,0)
-        self.BWImage=cv2.cvtColor(self.BWImage,cv2.COLOR_GRAY2RGB)
-        #ret,self.BWImage=cv2.threshold(blur,avg+self.colorBias,255,cv2.THRESH_BINARY)
-        cv2.imwrite("bw.jpg", self.BWImage);
+        self.tileCache=OrderedDict()
+        self.integral=None
+        if self.tiled:
+            self.blurredImage=self.BWImage=None
+            return
+        self.blurredImage,gray,self.BWImage=self.preprocessor.process(image)
+
+    #split pixels of a TiledImage (e.g. from toImagePixels()) up by the tile they are in, pixels outside of the image go with the closest tile
+    #yields (tileRow, tileCol, indices) for every tile with pixels in it, where indices are the positions of its pixels in x and y
+    def groupByTile(self,x,y):
+        height,width=self.image.shape[0:2]
+        tileSize=self.image.tileSize
+        tilesX=self.image.getTileCount()[1]
+        tiles=(np.clip(y,0,height-1)//tileSize)*tilesX+np.clip(x,0,width-1)//tileSize
+        order=np.argsort(tiles,kind="stable")
+        tiles=tiles[order]
+        starts=np.flatnonzero(np.concatenate([[True],tiles[1:]!=tiles[:-1]]))
+        for start,end in zip(starts,np.append(starts[1:],len(tiles))):
+            yield int(tiles[start]//tilesX),int(tiles[start]%tilesX),order[start:end]
+
+    #black and white image of one tile of a TiledImage
+    #the tile is processed with enough of the image around it that the blur and threshold come out the same as for the whole image
+    #the last TILE_CACHE_SIZE tiles are kept so sampling the same area again (e.g. while dragging) doesn't process them again
+    def getTileBWImage(self,tileRow,tileCol):
+        key=(tileRow,tileCol,self.preprocessor.getSettings())
+        if key in self.tileCache:
+            self.tileCache.move_to_end(key)
+            return self.tileCache[key]
+
+        halo=max(self.preprocessor.blurSize,0)//2+self.preprocessor.blockSize//2
+        x0,y0,x1,y1=self.image.getTileRect(tileRow,tileCol,halo=halo)
+        tileX0,tileY0,tileX1,tileY1=self.image.getTileRect(tileRow,tileCol)
+        blurred,gray,bw=self.preprocessor.process(self.image.getRegion(x0,y0,x1,y1))
+        bw=bw[tileY0-y0:tileY1-y0,tileX0-x0:tileX1-x0].copy()
+
+        self.tileCache[key]=bw
+        if len(self.tileCache)>TILE_CACHE_SIZE:
+            self.tileCache.popitem(last=False)
+        return bw
+
+    #the black and white image at arrays of pixels that are inside the image
+    def getBWPixels(self,x,y):
+        if not self.tiled:
+            return self.BWImage[y,x]
+        values=np.empty(len(x),dtype=np.uint8)
+        for tileRow,tileCol,indices in self.groupByTile(x,y):
+            x0,y0,x1,y1=self.image.getTileRect(tileRow,tileCol)
+            values[indices]=self.getTileBWImage(tileRow,tileCol)[y[indices]-y0,x[indices]-x0]
+        return values
 
     def countErrors(self):
-        count=0
-        for (rowI, row) in enumerate(self.samplePoints):
-            for (vertexI, vertex) in enumerate(row):
-                for (pointI, point) in enumerate(vertex):
-                    if(self.hasError(self.samplePoints,rowI,vertexI,pointI)):
-                        count+=1
-        return count
+        return int(np.count_nonzero(self.getErrorMask()))
 
+    #boolean array of which sample points have an error (same order as the SamplePointStore)
+    #this is cached until the sample points change
+    def getErrorMask(self):
+        samplePoints=self.samplePoints
+        if self.errorMask is None or self.errorMaskVersion!=samplePoints.version:
+            self.errorMask=np.asarray(self.getErrors(samplePoints),dtype=bool)
+            self.errorMaskVersion=samplePoints.version
+        return self.errorMask
+
+    #number of errors with every combination of blockSize and offset for the adaptive threshold of the black and white image (see Preprocessor)
+    #blockSizes are in pixels of the display so the sweep covers the same areas at any resolution
+    #returns a (len(toImageBlockSizes(blockSizes)), len(offsets)) array. Every sample point is thresholded with every setting in one pass (see Preprocessor.sweepThreshold())
+    #so no black and white image is made and the points don't move, manual corrections are ignored
+    def sweepThreshold(self,blockSizes=SWEEP_BLOCK_SIZES,offsets=SWEEP_OFFSETS):
+        blockSizes=self.toImageBlockSizes(blockSizes)
+        samplePoints=self.samplePoints
+        x,y=self.toImagePixels(samplePoints.x,samplePoints.y)
+        inside=self.isInImage(x,y)
+        x=x[inside]
+        y=y[inside]
+        if not self.tiled:
+            white=self.preprocessor.sweepThreshold(self.image,x,y,blockSizes,offsets)
+        else:
+            #one tile at a time, with enough of the image around it for the biggest blur and threshold area
+            white=np.empty((len(blockSizes),len(offsets),len(x)),dtype=bool)
+            halo=max(self.preprocessor.blurSize,0)//2+max(blockSizes)//2
+            for tileRow,tileCol,indices in self.groupByTile(x,y):
+                x0,y0,x1,y1=self.image.getTileRect(tileRow,tileCol,halo=halo)
+                white[:,:,indices]=self.preprocessor.sweepThreshold(self.image.getRegion(x0,y0,x1,y1),x[indices]-x0,y[indices]-y0,blockSizes,offsets)
+
+        #score each setting with a store that has the same points and that setting's colors
+        store=SamplePointStore(samplePoints.rows,samplePoints.cols,samplePoints.x,samplePoints.y,np.zeros(len(samplePoints),dtype=np.int8),samplePoints.offsets)
+        counts=np.zeros((len(blockSizes),len(offsets)),dtype=np.int64)
+        for i in range(len(blockSizes)):
+            for j in range(len(offsets)):
+                store.color[inside]=np.where(white[i,j],1,-1)
+                store.version+=1
+                counts[i,j]=np.count_nonzero(self.getErrors(store))
+        return counts
+
+    #change the settings of the adaptive threshold and resample the image
+    def setThreshold(self,blockSize,offset):
+        self.preprocessor.blockSize=blockSize
+        self.preprocessor.offset=offset
+        self.makeBWImage(self.image)
+        self.setSamplePoints()
 
-    #this is an experimental function to move around a fixed point in order to minimize the number of errors
-    #it does not work too well in practice
-    def jiggleNearestFixedPoint(self,x,y):
-
-        fixedPoint=self.getNearestFixedPoint(x,y)
+    #sweep the threshold settings (see sweepThreshold()) and switch to the one with the fewest errors, the current setting is kept on a tie
+    #returns the error counts of the sweep
+    def useBestThreshold(self,blockSizes=SWEEP_BLOCK_SIZES,offsets=SWEEP_OFFSETS):
+        counts=self.sweepThreshold(blockSizes,offsets)
+        i,j=np.unravel_index(np.argmin(counts),counts.shape)
+        if counts[i,j]<self.countErrors():
+            self.setThreshold(self.toImageBlockSizes(blockSizes)[i],offsets[j])
+        return counts
+
+    #table of the error counts from sweepThreshold(), one row per block size (in pixels of the image) and one column per offset, the current setting is marked with a *
+    def thresholdSweepAsString(self,counts,blockSizes=SWEEP_BLOCK_SIZES,offsets=SWEEP_OFFSETS):
+        string="block/offset"+"".join("%8s"%offset for offset in offsets)
+        for (i,blockSize) in enumerate(self.toImageBlockSizes(blockSizes)):
+            string+="\n%12d"%blockSize
+            for (j,offset) in enumerate(offsets):
+                current=(blockSize,offset)==(self.preprocessor.blockSize,self.preprocessor.offset)
+                string+="%8s"%(str(counts[i,j])+("*" if current else ""))
+        return string
 
 
-        errorsBefore=self.countErrors()
+    #move the nearest fixed point to (x,y) to where it gives the fewest errors
+    def jiggleNearestFixedPoint(self,x,y,timeBudget=0.5):
+        return self.alignFixedPoint(self.getNearestFixedPoint(x,y),timeBudget=timeBudget)
 
+    #move a fixed point around to minimize the number of errors in the patches around it
+    #this is a coordinate descent: try moving step pixels up/down/left/right, keep the best move, and halve step when nothing helps
+    #the point never moves more than maxOffset from where it started and it gives up after timeBudget seconds
+    #returns how many errors were removed
+    def alignFixedPoint(self,fixedPoint,timeBudget=0.5,maxOffset=10,startStep=4,minStep=0.25):
+        endTime=time.time()+timeBudget
         node=fixedPoint["node"]
-        originalNode=node.copy()
-
-        radius=5
-
-        node.x+=random()*2*radius-radius
-        node.y+=random()*2*radius-radius
-
-        self.setSamplePoints()
-
-
-        if(errorsBefore<self.countErrors()):
-            fixedPoint["node"]=originalNode
-        self.setSamplePoints()
+        startX,startY=node.x,node.y
+
+        #cells whose sample points move with the fixed point, and one more cell around them since errors can depend on neighbouring cells
+        rowStart,rowEnd,colStart,colEnd=self.getAffectedCells(fixedPoint)
+        scoreRowStart=max(rowStart-1,0)
+        scoreRowEnd=min(rowEnd+1,self.rows-1)
+        scoreColStart=max(colStart-1,0)
+        scoreColEnd=min(colEnd+1,self.cols-1)
+        region=self.samplePoints.getRegion(scoreRowStart,scoreRowEnd,scoreColStart,scoreColEnd)
+
+        #number of errors in the region with the fixed point at (x,y)
+        def score(x,y):
+            node.x=x
+            node.y=y
+            points,colors,counts=self.getSamplePointsInCells(rowStart,rowEnd,colStart,colEnd)
+            candidate=region.copy()
+            candidate.replaceCells(rowStart-scoreRowStart,rowEnd-scoreRowStart,colStart-scoreColStart,colEnd-scoreColStart,points[:,0],points[:,1],colors,counts)
+            return int(np.count_nonzero(self.getErrors(candidate)))
+
+        bestX,bestY=startX,startY
+        startErrors=bestErrors=score(startX,startY)
+        step=startStep
+        while step>=minStep and bestErrors>0 and time.time()<endTime:
+            improved=False
+            for (dx,dy) in ((step,0),(-step,0),(0,step),(0,-step)):
+                x=bestX+dx
+                y=bestY+dy
+                if math.hypot(x-startX,y-startY)>maxOffset:
+                    continue
+                errors=score(x,y)
+                if errors<bestErrors:
+                    bestErrors=errors
+                    bestMove=(x,y)
+                    improved=True
+            if improved:
+                bestX,bestY=bestMove
+            else:
+                step/=2
+
+        node.x=bestX
+        node.y=bestY
+        self.fixedPointIndex=None
+        self.updateSamplePoints(rowStart,rowEnd,colStart,colEnd)
+        return startErrors-bestErrors
+
+    #align every fixed point (see alignFixedPoint()), spending at most timeBudget seconds on the whole lattice
+    #the fixed points are visited top-to-bottom, left-to-right and each gets an equal share of the time that is left
+    #moving one point can help its neighbours, so this keeps going over the lattice until nothing improves
+    #returns how many errors were removed
+    def autoAlign(self,timeBudget=5):
+        endTime=time.time()+timeBudget
+        fixedPoints=self.fixedPoints
+        removed=0
+        improved=True
+        while improved and time.time()<endTime:
+            improved=False
+            for (i,fixedPoint) in enumerate(fixedPoints):
+                timeLeft=endTime-time.time()
+                if timeLeft<=0:
+                    break
+                pointRemoved=self.alignFixedPoint(fixedPoint,timeBudget=timeLeft/(len(fixedPoints)-i))
+                removed+=pointRemoved
+                improved=improved or pointRemoved>0
+        return removed
 
 
     #draws the current grid onto an image
+    #a layer is only rebuilt if what it is made from changed, e.g. the sample points aren't touched while a fixed point is dragged
     def draw(self,im,samplePointSize=2,showGrid=True):
-
-        #draw all fixed points
-        sortedPoints=self.getSortedFixedPoints()
-        for (i,point) in enumerate(self.getSortedFixedPoints()):
-            #draw fixed point
-            im=cv2.circle(im,point["node"].xyAsIntTuple(), 5,RED,-1)
-
-            #hasGrid represents if the point is the topLeft corner of a subgrid
-            hasGrid=True;
-            topLeft=point
-            topLeftCoord=point["node"].xyAsArray()
-            if(i==len(sortedPoints)-1):#bottomLeftCorner
-                hasGrid=False
-            elif(point["row"]==self.rows-1):#bottomRow
-                hasGrid=False
-            elif(point["col"]==self.cols-1):#last col
-                hasGrid=False
-            else:#has a valid grid
-                #if it has a valid grid then get the coordinants of the verticies
-                topRight=sortedPoints[i+1]
-                bottomLeft=sortedPoints[i+len(self.fixedCols)]
-                bottomRight=sortedPoints[i+len(self.fixedCols)+1]
-                cols=topRight["col"]-topLeft["col"]
-                rows=bottomLeft["row"]-topLeft["row"]
-
-                topRightCoord=topRight["node"].xyAsArray()
-                bottomLeftCoord=bottomLeft["node"].xyAsArray()
-                bottomRightCoord=bottomRight["node"].xyAsArray()
-
-                #draw the outline and grid
-                if showGrid or self.dragging:
-                    im=cv2.line(im,xyArrayToIntTuple(topLeftCoord),xyArrayToIntTuple(topRightCoord),BLACK,1)
-                    im=cv2.line(im,xyArrayToIntTuple(topLeftCoord),xyArrayToIntTuple(bottomLeftCoord),BLACK,1)
-                    im=cv2.line(im,xyArrayToIntTuple(bottomLeftCoord),xyArrayToIntTuple(bottomRightCoord),BLACK,1)
-                    im=cv2.line(im,xyArrayToIntTuple(topRightCoord),xyArrayToIntTuple(bottomRightCoord),BLACK,1)
-
-                    for (startX,startY,endX,endY) in zip(np.linspace(topLeftCoord[0],topRightCoord[0],cols+1), np.linspace(topLeftCoord[1],topRightCoord[1],cols+1), np.linspace(bottomLeftCoord[0],bottomRightCoord[0],cols+1), np.linspace(bottomLeftCoord[1],bottomRightCoord[1],cols+1)):
-                        im=cv2.line(im,(int(startX),int(startY)),(int(endX),int(endY)),RED,1)
-                    for (startX,startY,endX,endY) in zip(np.linspace(topLeftCoord[0],bottomLeftCoord[0],rows+1), np.linspace(topLeftCoord[1],bottomLeftCoord[1],rows+1), np.linspace(topRightCoord[0],bottomRightCoord[0],rows+1), np.linspace(topRightCoord[1],bottomRightCoord[1],rows+1)):
-                        im=cv2.line(im,(int(startX),int(startY)),(int(endX),int(endY)),RED,1)
-
-        #draw the sample points if we are not dragging
-        if not self.dragging:
-            self.drawSamplePoints(im,size=samplePointSize)
-
+        overlay=self.getOverlay(im)
+        showGrid=showGrid or self.dragging
+        gridKey=self.getGridKey(showGrid)
+        if not overlay.hasShapes("grid",gridKey):
+            overlay.setShapes("grid",*self.getGridShapes(showGrid),key=gridKey)
+        visible=["grid"]
+
+        #draw the sample points if we are not dragging (or live preview is on)
+        if self.samplePointsVisible():
+            self.setSamplePointShapes(overlay,samplePointSize)
+            visible+=["samplePoints","errors"]
+        overlay.drawOnto(im,visible)
 
     def drawSamplePoints(self,im,size=2):
+        overlay=self.getOverlay(im)
+        self.setSamplePointShapes(overlay,size)
+        overlay.drawOnto(im,["samplePoints","errors"])
+
+    #the overlay for images the size of im, a new one is made if the size changes
+    def getOverlay(self,im):
+        if self.overlay is None or self.overlay.shape!=im.shape[0:2]:
+            self.overlay=Overlay(im.shape[0:2],["grid","samplePoints","errors"])
+        return self.overlay
+
+    #everything getGridShapes() depends on, it is only as big as the fixed points so it is cheap to compare every frame
+    def getGridKey(self,showGrid=True):
+        return (showGrid,self.rows,self.cols,tuple(self.fixedRows),tuple(self.fixedCols),self.getFixedPointTable().tobytes())
+
+    #the fixed points and (if showGrid) the grid lines of every patch (a patch is the area between four fixed points) as shapes for an overlay layer
+    def getGridShapes(self,showGrid=True):
+        fixed=np.array([point["node"].xyAsIntTuple() for point in self.fixedPoints],dtype=np.int64).reshape(-1,2)
+        circles=np.concatenate([fixed,np.tile([5,-1],(len(fixed),1))],axis=1)
+
+        lines=[np.zeros((0,4),dtype=np.int64)]
+        if showGrid:
+            grid=self.getGrid().astype(np.int64)
+            fixedRows=self.fixedRows
+            fixedCols=self.fixedCols
+            for (startRow,endRow) in zip(fixedRows[:-1],fixedRows[1:]):
+                for (startCol,endCol) in zip(fixedCols[:-1],fixedCols[1:]):
+                    lines.append(np.concatenate([grid[startRow,startCol:endCol+1],grid[endRow,startCol:endCol+1]],axis=1))
+                    lines.append(np.concatenate([grid[startRow:endRow+1,startCol],grid[startRow:endRow+1,endCol]],axis=1))
+        lines=np.concatenate(lines)
+        return circles,np.tile(RED,(len(circles),1)),lines,RED
+
+    #put the sample points and a circle around every error on their overlay layers
+    #they are only made again when the store changed (its version goes up whenever a point moves or changes color) or it was replaced
+    def setSamplePointShapes(self,overlay,size=2):
         samplePoints=self.samplePoints
-        for (rowI, row) in enumerate(samplePoints):
-            for (vertexI, vertex) in enumerate(row):
-                for (pointI, point) in enumerate(vertex):
-                    #Draw Point based on color
-                    if(point[2]==1):
-                        color=RED
-                    elif(point[2]==0):
-                        color=GREEN
-                    elif(point[2]==-1):
-                        color=BLUE
-
-                    im=cv2.circle(im,(int(point[0]),int(point[1])),size,color,-1)
-
-                    #Check for errors:
-                    if(self.hasError(samplePoints,rowI,vertexI,pointI)):
-                        im=cv2.circle(im,(int(point[0]),int(point[1])),5,GREEN,2)
+        key=(samplePoints,samplePoints.version,size)
+        if overlay.hasShapes("samplePoints",key) and overlay.hasShapes("errors",key):
+            return
+        points=np.stack([samplePoints.x,samplePoints.y],axis=1).astype(np.int64)
+        pointColors=np.array([BLUE,GREEN,RED])[samplePoints.color.astype(np.int64)+1]
+        circles=np.concatenate([points,np.tile([size,-1],(len(points),1))],axis=1)
+        overlay.setShapes("samplePoints",circles,pointColors,key=key)
+
+        #every point gets a circle which is hidden if there is no error
+        radii=np.where(self.getErrorMask(),5,-1)
+        circles=np.concatenate([points,radii[:,np.newaxis],np.full((len(points),1),2)],axis=1)
+        overlay.setShapes("errors",circles,np.tile(GREEN,(len(circles),1)),key=key)
 
     #given a given row, vertex, point. Determine if there is an error or not
+    #samplePoints is the SamplePointStore of the whole lattice
     def hasError(self, samplePoints, rowI, vertexI, pointI):
         raise Exception("You need to define this function")
 
+    #whole lattice version of hasError(). Returns a boolean array with one value per sample point (same order as samplePoints.color)
+    #samplePoints may only be part of the lattice (samplePoints.firstRow/firstCol say where it starts), e.g. when scoring a fixed point in alignFixedPoint()
+    #override this to find every error at once with numpy, by default it calls hasError() on each point
+    def getErrors(self, samplePoints):
+        rows,cols,indices=samplePoints.getLatticeIndices()
+        return np.array([self.hasError(samplePoints,rowI,vertexI,pointI) for (rowI,vertexI,pointI) in zip(rows,cols,indices)],dtype=bool)
+
+    #get the positions of the fixed points as a (len(fixedRows), len(fixedCols), 2) array
+    #optionally only for the fixed rows/cols at positions rowIStart<=i<rowIEnd and colIStart<=j<colIEnd in fixedRows/fixedCols
+    def getFixedPointTable(self,rowIStart=0,rowIEnd=None,colIStart=0,colIEnd=None):
+        return np.array([[point["node"].xyAsArray() for point in row[colIStart:colIEnd]] for row in self.fixedTable[rowIStart:rowIEnd]],dtype=np.float64)
+
     #generates the grid based on the subgrids
+    #the grid is a (rows, cols, 2) array of [x,y] positions. Every patch between four fixed points is
+    #bilinearly interpolated from its corners, all patches are computed at once
     def getGrid(self):
-        #generate an empty grid representing each point
-        grid=[]
-        for row in range(self.rows):
-            grid.append([])
-            for col in range(self.cols):
-                grid[len(grid)-1].append("")
-
-        #loop through each fixed point and draw the grid that it is the top left of
-        sortedPoints=self.getSortedFixedPoints()
-        for (i,point) in enumerate(self.getSortedFixedPoints()):
-
-            #make sure that point is the topleft ofo a grid and not an edge
-            hasGrid=True;
-            topLeft=point
-            topLeftCoord=point["node"].xyAsArray()
-            if(i==len(sortedPoints)-1):#bottomLeftCorner
-                hasGrid=False
-            elif(point["row"]==self.rows-1):#bottomRow
-                hasGrid=False
-            elif(point["col"]==self.cols-1):#last col
-                hasGrid=False
-            else:#has a valid grid
-                #get grid coordinates if valid grid
-                topRight=sortedPoints[i+1]
-                bottomLeft=sortedPoints[i+len(self.fixedCols)]
-                bottomRight=sortedPoints[i+len(self.fixedCols)+1]
-                cols=topRight["col"]-topLeft["col"]
-                rows=bottomLeft["row"]-topLeft["row"]
-
-                topRightCoord=topRight["node"].xyAsArray()
-                bottomLeftCoord=bottomLeft["node"].xyAsArray()
-                bottomRightCoord=bottomRight["node"].xyAsArray()
-
-            #get all the points in that subgrid
-            if(hasGrid):
-                for (rowI, rowStartX,rowStartY,rowEndX,rowEndY) in  zip(range(0,rows+1), np.linspace(topLeftCoord[0],bottomLeftCoord[0],rows+1), np.linspace(topLeftCoord[1],bottomLeftCoord[1],rows+1), np.linspace(topRightCoord[0],bottomRightCoord[0],rows+1), np.linspace(topRightCoord[1],bottomRightCoord[1],rows+1)):
-                    for(colI, pointX, pointY) in zip(range(0,cols+1), np.linspace(rowStartX,rowEndX,cols+1), np.linspace(rowStartY,rowEndY,cols+1)):
-                        grid[point["row"]+rowI][point["col"]+colI]=[pointX,pointY]
-        return grid
+        return self.getGridRegion(0,self.rows,0,self.cols)
+
+    #same as getGrid() but only for rowStart<=row<rowEnd and colStart<=col<colEnd
+    def getGridRegion(self,rowStart,rowEnd,colStart,colEnd):
+        rowPatch,rowFraction=getPatchFractions(self.fixedRows,rowStart,rowEnd)
+        colPatch,colFraction=getPatchFractions(self.fixedCols,colStart,colEnd)
+
+        #only look up the fixed points around the patches that are needed
+        rowIStart=rowPatch[0]
+        colIStart=colPatch[0]
+        table=self.getFixedPointTable(rowIStart,rowPatch[-1]+2,colIStart,colPatch[-1]+2)
+        rowPatch=rowPatch-rowIStart
+        colPatch=colPatch-colIStart
+
+        #corners of the patch that each grid point is in
+        topLeft=table[rowPatch][:,colPatch]
+        topRight=table[rowPatch][:,colPatch+1]
+        bottomLeft=table[rowPatch+1][:,colPatch]
+        bottomRight=table[rowPatch+1][:,colPatch+1]
+
+        rowFraction=rowFraction[:,np.newaxis,np.newaxis]
+        colFraction=colFraction[np.newaxis,:,np.newaxis]
+
+        #interpolate down the left and right side of the patch, then across
+        rowStart=topLeft+(bottomLeft-topLeft)*rowFraction
+        rowEnd=topRight+(bottomRight-topRight)*rowFraction
+        return rowStart+(rowEnd-rowStart)*colFraction
 
     #given an x, y. Find whether that point in the image should be considered black or white
     def sampleImageColor(self,im,x,y):
-        #originally this function would average every time (see commented out code below)
-        #now it just generates a blurred black and white image in the beginning which provides much better performance
-        return self.blurredImage[int(y)][int(x)][0]
-        """avg=0;
-        count=0;#number of pixels checked
-        width=self.pointSampleWidth;#distance away from center pixel to sample
-        x=int(x)
-        y=int(y)
-
-        imWidth, imHeight, channels=im.shape
-
-        #loop through rows and columns
-        for i in range(x-width,x+width):
-            for j in range(y-width,y+width):
-                #make sure pixel is not offscreen
-                if i<0 or j<0 or i>imWidth-1 or j>imHeight-1:
-                    continue
-                #add to average
-                avg+=im[j][i][0]#(im[j][i][0]+im[j][i][1]+im[j][i][2])/3
-                count+=1
-
-        #prevent divide by 0 error
-        if count==0:
-            return 0
+        #the average brightness of the area around the point (about as wide as the blur used for the black and white image)
+        x,y=self.toImagePixel(x,y)
+        return float(self.getImageMean(x,y,*self.toImageRadius(self.pointSampleWidth//2)))
+
+    #mean of the grayscale image over the square from (x-radius,y-radius) to (x+radius,y+radius) on the display, x and y include the border
+    #x, y and radius can be numbers or arrays, the part of the square outside the image is ignored and it is nan if all of it is outside
+    def sampleImageMean(self,x,y,radius):
+        x,y=self.toImagePixels(x,y)
+        return self.getImageMean(x,y,*self.toImageRadius(radius))
+
+    #same as sampleImageMean() but in pixels of the image, the rectangle goes from (x-radiusX,y-radiusY) to (x+radiusX,y+radiusY)
+    #this only takes four lookups in the integral image so any radius costs the same
+    #for a TiledImage every tile with points in it gets its own integral image, made with enough of the image around it to fit the biggest rectangle
+    def getImageMean(self,x,y,radiusX,radiusY):
+        if not self.tiled:
+            if self.integral is None:
+                self.integral=self.preprocessor.getIntegral(self.image)
+            return getMeanFromIntegral(self.integral,x,y,radiusX,radiusY)
+
+        x,y,radiusX,radiusY=np.broadcast_arrays(*(np.asarray(value,dtype=np.int64) for value in (x,y,radiusX,radiusY)))
+        shape=x.shape
+        x,y,radiusX,radiusY=(value.ravel() for value in (x,y,radiusX,radiusY))
+        means=np.empty(len(x))
+        for tileRow,tileCol,indices in self.groupByTile(x,y):
+            halo=int(max(radiusX[indices].max(),radiusY[indices].max()))
+            x0,y0,x1,y1=self.image.getTileRect(tileRow,tileCol,halo=halo)
+            integral=self.preprocessor.getIntegral(self.image.getRegion(x0,y0,x1,y1))
+            means[indices]=getMeanFromIntegral(integral,x[indices]-x0,y[indices]-y0,radiusX[indices],radiusY[indices])
+        return means.reshape(shape)
+
+    #radius (on the display) used for every sample point when sampleRadius is set, x and y are arrays of the points
+    #override this to return an array with a radius for each point (e.g. depending on the island size)
+    def getSampleRadius(self,x,y):
+        return self.sampleRadius
+
+    #change the sample radius (None goes back to the black and white image) and resample, the image doesn't have to be processed again
+    def setSampleRadius(self,sampleRadius):
+        self.sampleRadius=sampleRadius
+        self.setSamplePoints()
 
-        #return avg color
-        avg/=count;
-        return avg"""
-    
     #same as sampling a color but only returns 1 or -1
     def sampleImage(self,x,y):
-        if int(y)<self.borderWidth or int(y)>=len(self.BWImage)-self.borderWidth or int(x)<self.borderWidth or int(x)>=len(self.BWImage[int(y)])-self.borderWidth:
-            return 0
-        color=self.BWImage[int(y)][int(x)][0]
-        if(color>127):
-            return 1
-        return -1
-
-    #get sample points as [row][vertex][island] which is an array [x,y,color]
+        return int(self.sampleImageArray(np.array([x]),np.array([y]))[0])
+
+    #same as sampleImage() but for arrays of x and y, returns an int8 array of 1, -1 or 0 (in the border)
+    def sampleImageArray(self,x,y):
+        if self.sampleRadius is not None:
+            return self.sampleImageArrayMean(x,y)
+
+        x,y=self.toImagePixels(x,y)
+        inside=self.isInImage(x,y)
+
+        colors=np.zeros(x.shape,dtype=np.int8)
+        colors[inside]=np.where(self.getBWPixels(x[inside],y[inside])>127,1,-1)
+        return colors
+
+    #sampleImageArray() when sampleRadius is set
+    #uses the same rule as the adaptive threshold of the black and white image, a point is white if the mean around it is brighter than the mean
+    #of the blockSize area around it minus the offset (see Preprocessor), except the point is averaged over its square instead of blurred
+    #the area used for the threshold is always at least twice as wide as the square so that it still shows the surroundings
+    def sampleImageArrayMean(self,x,y):
+        radiusX,radiusY=self.toImageRadius(self.getSampleRadius(x,y))
+        x,y=self.toImagePixels(x,y)
+        blockRadius=self.preprocessor.blockSize//2
+        mean=self.getImageMean(x,y,radiusX,radiusY)
+        threshold=self.getImageMean(x,y,np.maximum(blockRadius,2*radiusX),np.maximum(blockRadius,2*radiusY))-self.preprocessor.offset
+
+        #points in the border are unreadable like in the black and white image
+        colors=np.where(mean>threshold,1,-1).astype(np.int8)
+        colors[~self.isInImage(x,y)]=0
+        return colors
+
+    #get sample points and their colors and store them in a SamplePointStore
     def setSamplePoints(self):
-        image=self.image
-
-
-        grid=self.getGrid()
-        samplePoints=[]
-        for (rowI, row) in enumerate(grid[:-1]):
-            samplePoints.append([])
-            for (pointI,point) in enumerate(row[:-1]):
-
-                #get corners of square
-                topLeft=point
-                topRight=grid[rowI][pointI+1]
-                bottomLeft=grid[rowI+1][pointI]
-                bottomRight=grid[rowI+1][pointI+1]
-
-                squareSamplePoints=self.getSamplePointsFromSquare(topLeft,topRight,bottomLeft,bottomRight, row=rowI, col=pointI)
-                #get what color each point is
-
-                for samplePoint in squareSamplePoints:
-
-                    samplePoint.append(self.sampleImage(samplePoint[0],samplePoint[1]))
-  
-
-                samplePoints[-1].append(squareSamplePoints)
-        self.samplePoints=samplePoints
-
-    def getSamplePointsFromSquare(self,topLeft,topRight,bottomLeft,bottomRight,row=0):
+        points,colors,counts=self.getSamplePointsInCells(0,self.rows-1,0,self.cols-1)
+        self.samplePoints=SamplePointStore.fromCounts(self.rows-1,self.cols-1,points[:,0],points[:,1],colors,counts)
+
+        #the grid or fixed points may have changed too so rebuild every index
+        self.gridIndex=None
+        self.fixedPointIndex=None
+        self.samplePointIndex=None
+        self.errorMask=None
+
+    #only recompute the sample points of the cells with rowStart<=row<rowEnd and colStart<=col<colEnd
+    def updateSamplePoints(self,rowStart,rowEnd,colStart,colEnd):
+        if rowStart>=rowEnd or colStart>=colEnd:
+            return
+        points,colors,counts=self.getSamplePointsInCells(rowStart,rowEnd,colStart,colEnd)
+        replaced=self.samplePoints.replaceCells(rowStart,rowEnd,colStart,colEnd,points[:,0],points[:,1],colors,counts)
+
+        #patch the indices with the moved points
+        if self.samplePointIndex is not None:
+            if replaced is None:
+                self.samplePointIndex=None
+            else:
+                self.samplePointIndex.move(replaced,points)
+        if self.gridIndex is not None:
+            gridRows,gridCols=np.meshgrid(np.arange(rowStart,rowEnd+1),np.arange(colStart,colEnd+1),indexing="ij")
+            self.gridIndex.move((gridRows*self.cols+gridCols).ravel(),self.getGridRegion(rowStart,rowEnd+1,colStart,colEnd+1).reshape(-1,2))
+
+    #sample points, their colors and the number of points per cell for the cells with rowStart<=row<rowEnd and colStart<=col<colEnd
+    def getSamplePointsInCells(self,rowStart,rowEnd,colStart,colEnd):
+        grid=self.getGridRegion(rowStart,rowEnd+1,colStart,colEnd+1)
+
+        #corners of every square in the grid, one row per square
+        topLeft=grid[:-1,:-1].reshape(-1,2)
+        topRight=grid[:-1,1:].reshape(-1,2)
+        bottomLeft=grid[1:,:-1].reshape(-1,2)
+        bottomRight=grid[1:,1:].reshape(-1,2)
+        rows,cols=np.meshgrid(np.arange(rowStart,rowEnd),np.arange(colStart,colEnd),indexing="ij")
+
+        points,counts=self.getSamplePointsFromSquares(topLeft,topRight,bottomLeft,bottomRight,rows.ravel(),cols.ravel())
+
+        #get what color each point is
+        colors=self.sampleImageArray(points[:,0],points[:,1])
+        return points,colors,counts
+
+    #the cells whose sample points depend on a fixed point: every patch that has the fixed point as a corner
+    #returns (rowStart,rowEnd,colStart,colEnd) with the end exclusive
+    def getAffectedCells(self,fixedPoint):
+        fixedRows=self.fixedRows
+        fixedCols=self.fixedCols
+        rowI=bisect_left(fixedRows,fixedPoint["row"])
+        colI=bisect_left(fixedCols,fixedPoint["col"])
+        rowStart=fixedRows[max(rowI-1,0)]
+        rowEnd=fixedRows[min(rowI+1,len(fixedRows)-1)]
+        colStart=fixedCols[max(colI-1,0)]
+        colEnd=fixedCols[min(colI+1,len(fixedCols)-1)]
+        return rowStart,rowEnd,colStart,colEnd
+
+    #given the four corners of a square, return a list of [x,y] sample points inside that square
+    def getSamplePointsFromSquare(self,topLeft,topRight,bottomLeft,bottomRight,row=0,col=0):
         raise Exception("You need to define this function")
 
+    #batched version of getSamplePointsFromSquare(). Each corner is an (M,2) array with one square per row, row and col are (M,) arrays
+    #must return an (N,2) array of every sample point (grouped by square, in order) and an (M,) array of the number of points in each square
+    #override this to compute every square at once with numpy (see stackSamplePoints), by default it calls getSamplePointsFromSquare() on each square
+    def getSamplePointsFromSquares(self,topLeft,topRight,bottomLeft,bottomRight,row,col):
+        points=[]
+        counts=np.zeros(len(row),dtype=np.int64)
+        for i in range(len(row)):
+            squareSamplePoints=self.getSamplePointsFromSquare(topLeft[i].tolist(),topRight[i].tolist(),bottomLeft[i].tolist(),bottomRight[i].tolist(),row=int(row[i]),col=int(col[i]))
+            counts[i]=len(squareSamplePoints)
+            points+=[point[0:2] for point in squareSamplePoints]
+        return np.array(points,dtype=np.float64).reshape(-1,2),counts
+
+    #spatial index of every grid point, the index of the point at (row,col) is row*cols+col
+    def getGridIndex(self):
+        if self.gridIndex is None or self.gridIndex.isStale():
+            self.gridIndex=BucketGrid(self.getGrid().reshape(-1,2))
+        return self.gridIndex
+
+    #spatial index of the fixed points, the indices are the positions in self.fixedPoints when it was built (see getIndexedFixedPoints())
+    def getFixedPointIndex(self):
+        if self.fixedPointIndex is None:
+            self.indexedFixedPoints=self.fixedPoints
+            self.fixedPointIndex=BucketGrid([point["node"].xyAsArray() for point in self.indexedFixedPoints])
+        return self.fixedPointIndex
+
+    #spatial index of the sample points, the indices are the same as in self.samplePoints
+    def getSamplePointIndex(self):
+        if self.samplePointIndex is None or self.samplePointIndex.isStale():
+            self.samplePointIndex=BucketGrid(np.stack([self.samplePoints.x,self.samplePoints.y],axis=1))
+        return self.samplePointIndex
+
     #given an x,y find the nearest sample point and cycle it between black/white/error states
     def toggleNearestSamplePoint(self,x,y):
-        closestPoint=None
-
-        closestDist=10000000
-        for row in self.samplePoints:
-            for island in row:
-                for point in island:
-                    distance=dist([x,y],point)
-                    if(distance<closestDist):
-                        closestPoint=point
-                        closestDist=distance
+        samplePoints=self.samplePoints
+        if len(samplePoints)==0:
+            return
+        closestPoint,distance=self.getSamplePointIndex().nearest(x,y)
 
-        closestPoint[2]+=1
-        if(closestPoint[2]==2):
-            closestPoint[2]=-1
+        color=samplePoints.color[closestPoint]+1
+        if(color==2):
+            color=-1
+        samplePoints.setColorAt(closestPoint,color)
 
 
 
     #gets the nearest point on the grid to (x,y)
     def getNearestPoint(self,x,y):
-        nearestPointRow=-1
-        nearestPointCol=-1
-        nearestPointDist=100000000000
-        nearestPoint=[];
-        for (rowI,row) in enumerate(self.getGrid()):
-            for (colI, point) in enumerate(row):
-                distance=dist([x,y],point)
-                if(distance<nearestPointDist):
-                    nearestPointDist=distance
-                    nearestPointRow=rowI
-                    nearestPointCol=colI
-                    nearestPoint=point
-        return {"row":nearestPointRow, "col":nearestPointCol,"point":nearestPoint}
+        #while dragging the grid is moving so the index would be out of date
+        if self.dragging:
+            grid=self.getGrid()
+            distances=np.hypot(grid[:,:,0]-x,grid[:,:,1]-y)
+            nearestPointRow,nearestPointCol=np.unravel_index(np.argmin(distances),distances.shape)
+            nearestPoint=grid[nearestPointRow,nearestPointCol].tolist()
+            return {"row":int(nearestPointRow), "col":int(nearestPointCol),"point":nearestPoint}
+
+        gridIndex=self.getGridIndex()
+        nearestPointIndex,distance=gridIndex.nearest(x,y)
+        nearestPoint=gridIndex.points[nearestPointIndex].tolist()
+        return {"row":nearestPointIndex//self.cols, "col":nearestPointIndex%self.cols,"point":nearestPoint}
 
     #gets the nearest fix point to (x,y)
     def getNearestFixedPoint(self,x,y):
-        nearestPoint=self.fixedPoints[0];
-        nearestPointDist=100000000000
-        for point in self.fixedPoints:
-            distance=dist([x,y],point["node"].xyAsArray())
-            if(distance<nearestPointDist):
-                nearestPointDist=distance
-                nearestPoint=point
-        return nearestPoint
+        nearestPointIndex,distance=self.getFixedPointIndex().nearest(x,y)
+        return self.indexedFixedPoints[nearestPointIndex]
     def getNearestSamplePoint(self,x,y):
-        nearestPoint=None
-        nearestPointDist=1000000000
-        toReturn={}
-        for (rowI,row) in enumerate(self.samplePoints):
-            for(colI,cell) in enumerate(row):
-                for (pointI,point) in enumerate(cell):
-                    distance=dist([x,y],point[0:2])
-                    if(distance<nearestPointDist):
-                        nearestPointDist=distance
-                        toReturn={"row":rowI,"col":colI,"index":pointI,"point":point}
-        return toReturn
+        samplePoints=self.samplePoints
+        if len(samplePoints)==0:
+            return {}
+        nearestPoint,distance=self.getSamplePointIndex().nearest(x,y)
+        rowI,colI,pointI=samplePoints.getLocation(nearestPoint)
+        return {"row":rowI,"col":colI,"index":pointI,"point":samplePoints.getPoint(rowI,colI,pointI)}
 
     def selectNearestFixedPoint(self,x,y):
         self.selectedPoint=self.getNearestFixedPoint(x,y)
@@ -415,111 +906,195 @@ class NodeNetwork:
 
     #get the position of a point at given row and column
     def getPointPosition(self,row,col):
-        return self.getGrid()[row][col]
+        return self.getGrid()[row,col].tolist()
 
-    #adds a fixed point to a row and col
-    #BE CAREFUL IT WILL NOT CHECK IF OTHER POINTS NEED TO BE ADDED TO MAKE EVERYTHING SQUARE
-    def addFixedPointNotRecursive(self,node,row,col):
-        for fixedPoint in self.fixedPoints:
-            if(fixedPoint["row"]==row and fixedPoint["col"]==col):
-                return;
+    #every fixed point sorted left-to-right, top-to-bottom
+    @property
+    def fixedPoints(self):
+        return [point for row in self.fixedTable for point in row]
 
+    #get fixed points sorted left-to-right, top-to-bottom
+    def getSortedFixedPoints(self):
+        return self.fixedPoints
 
-        if row not in self.fixedRows:
-            self.fixedRows.append(row)
-        if col not in self.fixedCols:
-            self.fixedCols.append(col)
-        self.fixedPoints.append({"row":row, "col":col, "node":node})
+    #get the fixed point at a row and col, or None if there isn't one
+    def getFixedPoint(self,row,col):
+        rowI=bisect_left(self.fixedRows,row)
+        colI=bisect_left(self.fixedCols,col)
+        if rowI<len(self.fixedRows) and self.fixedRows[rowI]==row and colI<len(self.fixedCols) and self.fixedCols[colI]==col:
+            return self.fixedTable[rowI][colI]
+        return None
+
+    #make a row fixed, nodes are the fixed points for every col in fixedCols
+    def insertFixedRow(self,row,nodes):
+        rowI=bisect_left(self.fixedRows,row)
+        self.fixedRows.insert(rowI,row)
+        self.fixedTable.insert(rowI,[{"row":row,"col":col,"node":node} for (col,node) in zip(self.fixedCols,nodes)])
+        self.fixedPointIndex=None
+
+    #make a col fixed, nodes are the fixed points for every row in fixedRows
+    def insertFixedCol(self,col,nodes):
+        colI=bisect_left(self.fixedCols,col)
+        self.fixedCols.insert(colI,col)
+        for (tableRow,row,node) in zip(self.fixedTable,self.fixedRows,nodes):
+            tableRow.insert(colI,{"row":row,"col":col,"node":node})
+        self.fixedPointIndex=None
+
+    #adds a fixed point to a row and col
+    #every fixed row and col must have a fixed point where they cross, so this is the same as addFixedPointRecursive()
+    #if the point is already fixed, nothing happens
+    def addFixedPointNotRecursive(self,node,row,col):
+        if self.getFixedPoint(row,col) is None:
+            self.addFixedPointRecursive(node,row,col)
 
     #safe to use function to make a given row and col location a fixed point
+    #the new fixed row and/or col get fixed points wherever they cross the other fixed rows and cols, placed where the grid currently is
     #(not actually recursive, it is just called that from when it used to be)
     def addFixedPointRecursive(self,node,row,col):
+        if self.getFixedPoint(row,col) is not None:
+            return
 
-        toAdd=[(node,row,col)]
+        #get the grid positions before changing anything so the grid doesn't get messed up by an invalid set of fixed points
+        gridRow=self.getGridRegion(row,row+1,0,self.cols)[0]
+        gridCol=self.getGridRegion(0,self.rows,col,col+1)[:,0]
+        def nodeAt(xy):
+            return Node(float(xy[0]),float(xy[1]))
 
+        if row not in self.fixedRows:
+            self.insertFixedRow(row,[node if fixedCol==col else nodeAt(gridRow[fixedCol]) for fixedCol in self.fixedCols])
+        if col not in self.fixedCols:
+            self.insertFixedCol(col,[node if fixedRow==row else nodeAt(gridCol[fixedRow]) for fixedRow in self.fixedRows])
+
+    #the alignment of the grid (number of rows and columns, every fixed point and the reader's settings) in a form that can be saved as json
+    #like the fixed points, the threshold area is saved in pixels of the display so the grid can be used on the same lattice at another resolution
+    def getGridState(self):
+        return {
+            "rows":self.rows,
+            "cols":self.cols,
+            "fixedPoints":[[point["row"],point["col"],point["node"].x,point["node"].y] for point in self.fixedPoints],
+            "reader":self.getReaderState(),
+            "threshold":[self.preprocessor.blockSize*float(self.displayScale.mean()),self.preprocessor.offset]
+        }
+
+    #line the grid up the way it was when getGridState() was called and resample the image
+    def setGridState(self,state):
+        rows=state["rows"]
+        cols=state["cols"]
+        nodes={(row,col):Node(x,y) for (row,col,x,y) in state["fixedPoints"]}
+        fixedRows=sorted({row for (row,col) in nodes})
+        fixedCols=sorted({col for (row,col) in nodes})
+
+        #every fixed row and col must cross at a fixed point and the corners must be fixed
+        if len(nodes)!=len(fixedRows)*len(fixedCols) or fixedRows[0]!=0 or fixedRows[-1]!=rows-1 or fixedCols[0]!=0 or fixedCols[-1]!=cols-1:
+            raise Exception("Invalid grid state")
+
+        self.rows=rows
+        self.cols=cols
+        self.fixedRows=fixedRows
+        self.fixedCols=fixedCols
+        self.fixedTable=[[{"row":row,"col":col,"node":nodes[(row,col)]} for col in fixedCols] for row in fixedRows]
+        self.topLeft=self.fixedTable[0][0]["node"]
+        self.topRight=self.fixedTable[0][-1]["node"]
+        self.bottomLeft=self.fixedTable[-1][0]["node"]
+        self.bottomRight=self.fixedTable[-1][-1]["node"]
+        self.selectedPoint=None
+        self.dragging=False
+        self.setReaderState(state.get("reader",{}))
+        if "threshold" in state:
+            blockSize,self.preprocessor.offset=state["threshold"]
+            self.preprocessor.blockSize=self.toImageSize(blockSize,3)
+            self.makeBWImage(self.image)
+        self.setSamplePoints()
 
-        for rowIndex in self.fixedRows:
-            xy=self.getPointPosition(rowIndex,col)
-            node=Node(xy[0],xy[1])
-            toAdd.append((node,rowIndex,col))
-        for colIndex in  self.fixedCols:
-            xy=self.getPointPosition(row,colIndex)
-            node=Node(xy[0],xy[1])
-            toAdd.append((node,row,colIndex))
+    #settings of the reader that change where the sample points go (e.g. the offset of a pattern), these are saved with the grid
+    #override both in the subclass if the reader has any, setReaderState() is given whatever getReaderState() returned
+    def getReaderState(self):
+        return {}
+    def setReaderState(self,state):
+        pass
 
-        #we have to add them all at the end like this so that the getPointPosition function doesn't get messed up by an invalid grid
-        for i in toAdd:
-            self.addFixedPointNotRecursive(*i)
+    #save the grid state (see getGridState()) to a json file
+    def saveGrid(self,fileName):
+        with open(fileName,'w') as file:
+            json.dump(self.getGridState(),file)
 
-    #get fixed points sorted left-to-right, top-to-bottom
-    def getSortedFixedPoints(self):
-        def eval(node):
-            return node["row"]*2*self.cols+node["col"]
-        self.fixedPoints.sort(key=eval)
-        return self.fixedPoints
+    #load a grid state saved with saveGrid()
+    def loadGrid(self,fileName):
+        with open(fileName) as file:
+            self.setGridState(json.load(file))
 
     #drag to x,y
     def updateDragging(self,x,y):
         if(self.dragging):
             self.selectedPoint["node"].x=x;
             self.selectedPoint["node"].y=y;
+            self.fixedPointIndex=None
+
+            #resample the patches around the point, but not more often than livePreviewInterval
+            if self.livePreview and time.time()-self.lastPreviewTime>=self.livePreviewInterval:
+                self.updateSamplePoints(*self.getAffectedCells(self.selectedPoint))
+                self.lastPreviewTime=time.time()
+
+    #turn live preview while dragging on or off
+    def toggleLivePreview(self):
+        self.livePreview=not self.livePreview
 
-    #stop dragging and update the sample points
+    #sample points are hidden while dragging since they are out of date, unless live preview is keeping them updated
+    def samplePointsVisible(self):
+        return not self.dragging or self.livePreview
+
+    #stop dragging and update the sample points around the point that was moved
     def stopDragging(self):
         if(self.dragging):
             self.dragging=False;
-            self.setSamplePoints()
+            self.updateSamplePoints(*self.getAffectedCells(self.selectedPoint))
 
     #draw output
     #this will simply draw a colored circle at each point, for better drawing overwrite
     #this function in the subclass
     def drawData(self, im):
-        if not self.dragging:
+        if self.samplePointsVisible():
             samplePoints=self.samplePoints
-            height, width, channels = im.shape
-            for (rowI, row) in enumerate(samplePoints):
-                for (vertexI, vertex) in enumerate(row):
-                    for (pointI, point) in enumerate(vertex):
-                        if(point[2]==1):
-                            color=WHITE
-                        else:
-                            color=BLACK
-                        im=cv2.circle(im, (int(point[0]),int(point[1])), 3, color, -1)
+            for (x,y,pointColor) in zip(samplePoints.x,samplePoints.y,samplePoints.color):
+                if(pointColor==1):
+                    color=WHITE
+                else:
+                    color=BLACK
+                im=cv2.circle(im, (int(x),int(y)), 3, color, -1)
     
-    #spit out all the point data. Generally it is better to  reemplement this in the subclass
+    #spit out all the point data a line at a time (see exporter.py). Generally it is better to reimplement this in the subclass
+    #this is a generator so the file can be written while it is made instead of holding all of it in one string
+    def dataAsLines(self):
+        samplePoints=self.samplePoints
+        for rowI in range(samplePoints.rows):
+            line=[]
+            for vertexI in range(samplePoints.cols):
+                for color in samplePoints.getCellColors(rowI,vertexI):
+                    line.append(str(color)+", ")
+                line.append("\t")
+            line.append("\n")
+            yield "".join(line)
+
+    #all of the point data as one string
     def dataAsString(self):
-        string=""
-        for (rowI, row) in enumerate(self.samplePoints):
-            for (vertexI, vertex) in enumerate(row):
-                for (pointI, point) in enumerate(vertex):
-                    string+=str(point[2])+", "
-                string+="\t"
-            string+="\n"
-        return string
+        return "".join(self.dataAsLines())
 
     #add row to end of lattice
     def addRow(self):
         self.rows+=1;
-        #make the last row fixed
-        self.fixedRows.append(self.rows-1)
-
-        #move all teh fixed points on the last row to the new last row
-        for point in self.fixedPoints:
-            if(point["row"]==self.rows-2):
-                point["row"]+=1
-        #the second to last row is no longer fixed
-        self.fixedRows.remove(self.rows-2)
+
+        #move all the fixed points on the last row to the new last row (the second to last row is no longer fixed)
+        self.fixedRows[-1]=self.rows-1
+        for point in self.fixedTable[-1]:
+            point["row"]=self.rows-1
         self.setSamplePoints()
 
     #add col to end of lattice
     def addCol(self):
         self.cols+=1
-        self.fixedCols.append(self.cols-1)
-        for point in self.fixedPoints:
-            if(point["col"]==self.cols-2):
-                point["col"]+=1;
-
-        self.fixedCols.remove(self.cols-2)
+        self.fixedCols[-1]=self.cols-1
+        for tableRow in self.fixedTable:
+            tableRow[-1]["col"]=self.cols-1
         self.setSamplePoints()
 
     #remove last row
@@ -527,18 +1102,17 @@ class NodeNetwork:
         if self.rows<=2:
             return
 
-        #Save the positions of the fixed points in the row to be removed
-        savedPoints=[point for point in self.getSortedFixedPoints() if point["row"]==self.rows-1]
-
         self.rows-=1
-        self.fixedRows.remove(self.rows)
-        self.fixedRows.append(self.rows-1)
-
-        #remove fixed points in removed row
-        self.fixedPoints=[point for point in self.fixedPoints if point["row"]<self.rows]
-        self.fixedCols.sort()
-        for (point,col) in zip(savedPoints, self.fixedCols):
-            self.addFixedPointNotRecursive(point["node"],self.rows-1,col)
+
+        #if the new last row is already fixed just drop the fixed points in the removed row
+        if self.fixedRows[-2]==self.rows-1:
+            self.fixedRows.pop()
+            self.fixedTable.pop()
+        else:
+            #otherwise move the fixed points in the removed row up one
+            self.fixedRows[-1]=self.rows-1
+            for point in self.fixedTable[-1]:
+                point["row"]=self.rows-1
         self.setSamplePoints()
 
 
@@ -548,20 +1122,17 @@ class NodeNetwork:
         if self.cols<=2:
             return;
 
-        #save the fixed points in the last column because we have to move them up one
-        savedPoints=[point for point in self.getSortedFixedPoints() if point["col"]==self.cols-1]
-
         #remove column
         self.cols-=1
-        self.fixedCols.remove(self.cols)
 
-        #fix the last column
-        if self.cols-1 not in self.fixedCols:
-            self.fixedCols.append(self.cols-1)
-
-        #add back in the fixed points
-        self.fixedPoints=[point for point in self.fixedPoints if point["col"]<self.cols]
-        self.fixedRows.sort()
-        for (point,row) in zip(savedPoints, self.fixedRows):
-            self.addFixedPointNotRecursive(point["node"],row,self.cols-1)
+        #if the new last column is already fixed just drop the fixed points in the removed column
+        if self.fixedCols[-2]==self.cols-1:
+            self.fixedCols.pop()
+            for tableRow in self.fixedTable:
+                tableRow.pop()
+        else:
+            #otherwise move the fixed points in the removed column over one
+            self.fixedCols[-1]=self.cols-1
+            for tableRow in self.fixedTable:
+                tableRow[-1]["col"]=self.cols-1
         self.setSamplePoints()
@@ -0,0 +1,163 @@
+"""
+This file contains the class Overlay which draws the grid, sample points and errors of a NodeNetwork over an image without redrawing everything every frame.
+Each kind of shape is drawn onto its own transparent layer. A layer remembers the shapes it drew last time, so when it is given new shapes it only
+clears and redraws the rectangle around the ones that changed (e.g. the patches around a dragged point). The layers are flattened into one image
+(again only where something changed) which is then copied onto the image being shown in a single step.
+"""
+
+import cv2
+import numpy as np
+
+#one transparent layer of circles and lines
+class Layer:
+    #shape is the (height,width) of the image the layer goes over
+    def __init__(self,shape):
+        self.shape=shape
+        self.image=np.zeros((shape[0],shape[1],3),dtype=np.uint8)
+        self.mask=np.zeros(shape,dtype=np.uint8)
+
+        #the shapes that are drawn on the layer, see setShapes()
+        self.circles=np.zeros((0,4),dtype=np.int64)
+        self.circleColors=np.zeros((0,3),dtype=np.int64)
+        self.lines=np.zeros((0,4),dtype=np.int64)
+        self.lineColor=(0,0,0)
+
+    #replace the shapes on the layer
+    #circles is an (N,4) array of [x,y,radius,thickness] (thickness -1 fills the circle, a radius under 0 hides it) with an (N,3) array of their colors
+    #hiding circles instead of leaving them out keeps the shapes lined up with the last ones, which is how the changed shapes are found
+    #lines is an (M,4) array of [x1,y1,x2,y2], they are all one pixel wide and lineColor. Circles are drawn in order and then the lines on top of them
+    #the arrays are copied so changing them afterwards doesn't change what the layer thinks it has drawn
+    #returns the rectangle (x0,y0,x1,y1) that was redrawn, or None if nothing changed
+    def setShapes(self,circles,circleColors,lines=(),lineColor=(0,0,0)):
+        circles=np.array(circles,dtype=np.int64).reshape(-1,4)
+        circleColors=np.array(circleColors,dtype=np.int64).reshape(-1,3)
+        lines=np.array(lines,dtype=np.int64).reshape(-1,4)
+        lineColor=tuple(int(value) for value in lineColor)
+
+        #if the number of shapes changed they can't be matched up with the old ones so everything is redrawn
+        if len(circles)!=len(self.circles) or len(lines)!=len(self.lines) or lineColor!=self.lineColor:
+            rect=(0,0,self.shape[1],self.shape[0])
+        else:
+            changedCircles=np.any(circles!=self.circles,axis=1) | np.any(circleColors!=self.circleColors,axis=1)
+            changedLines=np.any(lines!=self.lines,axis=1)
+            if not changedCircles.any() and not changedLines.any():
+                return None
+            #cover both where the changed shapes were and where they are now
+            boxes=np.concatenate([
+                getCircleBoxes(self.circles[changedCircles]),getCircleBoxes(circles[changedCircles]),
+                getLineBoxes(self.lines[changedLines]),getLineBoxes(lines[changedLines])
+            ])
+            rect=clipRect((boxes[:,0].min(),boxes[:,1].min(),boxes[:,2].max(),boxes[:,3].max()),self.shape)
+
+        self.circles=circles
+        self.circleColors=circleColors
+        self.lines=lines
+        self.lineColor=lineColor
+        if rect is not None:
+            self.redraw(rect)
+        return rect
+
+    #clear the rectangle (x0,y0,x1,y1) and draw every shape that touches it again
+    #a shape that is cut off at the edge of what it is drawn on can cover slightly different pixels, so the circles are drawn whole onto a scratch
+    #image and only the rectangle is copied back. The lines are drawn whole straight onto the layer, outside of the rectangle a line only covers
+    #pixels it already covered (any line that moved is inside the rectangle) with the same color, and nothing is drawn over lines
+    def redraw(self,rect):
+        x0,y0,x1,y1=rect
+        touching=np.flatnonzero(touches(getCircleBoxes(self.circles),rect))
+        boxes=getCircleBoxes(self.circles[touching])
+        scratchX0,scratchY0,scratchX1,scratchY1=clipRect((min([x0]+list(boxes[:,0])),min([y0]+list(boxes[:,1])),max([x1]+list(boxes[:,2])),max([y1]+list(boxes[:,3]))),self.shape)
+        image=np.zeros((scratchY1-scratchY0,scratchX1-scratchX0,3),dtype=np.uint8)
+        mask=np.zeros(image.shape[0:2],dtype=np.uint8)
+        for i in touching:
+            x,y,radius,thickness=(int(value) for value in self.circles[i])
+            if radius<0:
+                continue
+            color=tuple(int(value) for value in self.circleColors[i])
+            cv2.circle(image,(x-scratchX0,y-scratchY0),radius,color,thickness)
+            cv2.circle(mask,(x-scratchX0,y-scratchY0),radius,255,thickness)
+        self.image[y0:y1,x0:x1]=image[y0-scratchY0:y1-scratchY0,x0-scratchX0:x1-scratchX0]
+        self.mask[y0:y1,x0:x1]=mask[y0-scratchY0:y1-scratchY0,x0-scratchX0:x1-scratchX0]
+
+        for i in np.flatnonzero(touches(getLineBoxes(self.lines),rect)):
+            lineX0,lineY0,lineX1,lineY1=(int(value) for value in self.lines[i])
+            cv2.line(self.image,(lineX0,lineY0),(lineX1,lineY1),self.lineColor,1)
+            cv2.line(self.mask,(lineX0,lineY0),(lineX1,lineY1),255,1)
+
+#a stack of layers that are drawn over an image in order
+class Overlay:
+    #shape is the (height,width) of the image it is drawn over and names are the names of the layers from the bottom to the top
+    def __init__(self,shape,names):
+        self.shape=tuple(shape)
+        self.names=list(names)
+        self.layers={name:Layer(self.shape) for name in self.names}
+
+        #every visible layer flattened into one image, see drawOnto()
+        self.image=np.zeros((self.shape[0],self.shape[1],3),dtype=np.uint8)
+        self.mask=np.zeros(self.shape,dtype=np.uint8)
+        self.visible=None
+
+        #rectangles of the layers that were redrawn since they were last flattened
+        self.dirty=[]
+
+        #what the shapes of each layer were made from (e.g. a version number), see hasShapes()
+        self.keys={}
+
+    #replace the shapes of a layer (see Layer.setShapes()), key is what they were made from
+    def setShapes(self,name,circles,circleColors,lines=(),lineColor=(0,0,0),key=None):
+        rect=self.layers[name].setShapes(circles,circleColors,lines,lineColor)
+        self.keys[name]=key
+        if rect is not None:
+            self.dirty.append(rect)
+
+    #whether the shapes of a layer were made from key, so making them again and comparing them to the old ones can be skipped
+    def hasShapes(self,name,key):
+        return key is not None and name in self.keys and self.keys[name]==key
+
+    #draw the layers in visible onto an image of the same shape
+    def drawOnto(self,im,visible):
+        visible=[name for name in self.names if name in visible]
+
+        #flatten the layers again where they changed (everywhere if a different set of layers is shown)
+        if visible!=self.visible:
+            self.dirty=[(0,0,self.shape[1],self.shape[0])]
+            self.visible=visible
+        if len(self.dirty)>0:
+            rects=np.array(self.dirty)
+            self.flatten((rects[:,0].min(),rects[:,1].min(),rects[:,2].max(),rects[:,3].max()))
+            self.dirty=[]
+
+        cv2.copyTo(self.image,self.mask,im)
+
+    #rebuild the flattened image in the rectangle (x0,y0,x1,y1)
+    def flatten(self,rect):
+        x0,y0,x1,y1=rect
+        image=self.image[y0:y1,x0:x1]
+        mask=self.mask[y0:y1,x0:x1]
+        image[:]=0
+        mask[:]=0
+        for name in self.visible:
+            layer=self.layers[name]
+            layerMask=layer.mask[y0:y1,x0:x1]
+            cv2.copyTo(layer.image[y0:y1,x0:x1],layerMask,image)
+            mask|=layerMask
+
+#bounding boxes (x0,y0,x1,y1) of an array of circles or lines, with the end exclusive
+def getCircleBoxes(circles):
+    reach=circles[:,2:3]+np.abs(circles[:,3:4])+1
+    return np.concatenate([circles[:,0:2]-reach,circles[:,0:2]+reach+1],axis=1)
+def getLineBoxes(lines):
+    return np.stack([np.minimum(lines[:,0],lines[:,2])-1,np.minimum(lines[:,1],lines[:,3])-1,np.maximum(lines[:,0],lines[:,2])+2,np.maximum(lines[:,1],lines[:,3])+2],axis=1)
+
+#which boxes overlap the rectangle
+def touches(boxes,rect):
+    return (boxes[:,0]<rect[2]) & (boxes[:,2]>rect[0]) & (boxes[:,1]<rect[3]) & (boxes[:,3]>rect[1])
+
+#cut a rectangle down to the part inside an image of the given (height,width), None if none of it is inside
+def clipRect(rect,shape):
+    x0=int(max(rect[0],0))
+    y0=int(max(rect[1],0))
+    x1=int(min(rect[2],shape[1]))
+    y1=int(min(rect[3],shape[0]))
+    if x0>=x1 or y0>=y1:
+        return None
+    return (x0,y0,x1,y1)
@@ -0,0 +1,117 @@
+"""
+This file contains the class Preprocessor which turns an MFM image into the images that the NodeNetwork samples.
+The image is blurred (to average the area around each pixel), turned grayscale and then thresholded into a black and white mask.
+Every output is a single channel uint8 image and they are cached so asking for them again with the same image and settings is free.
+It also makes the integral image (summed-area table) of the unblurred grayscale image, which gives the mean of any rectangle in constant time.
+An integral image of the blurred grayscale image is used to threshold a set of points with many different settings at once (see sweepThreshold()).
+"""
+
+import cv2
+import numpy as np
+
+class Preprocessor:
+    #blurSize is the width of the gaussian blur (must be odd, 0 or less means no blur)
+    #blockSize and offset are passed to cv2.adaptiveThreshold, a pixel is white if it is brighter than the average of the blockSize x blockSize area around it minus offset
+    #if debugPath is set, the black and white image is written there every time it is made
+    def __init__(self,blurSize=5,blockSize=11,offset=0,debugPath=None):
+        self.blurSize=blurSize
+        self.blockSize=blockSize
+        self.offset=offset
+        self.debugPath=debugPath
+
+        #cached outputs, see process()
+        self.cacheKey=None
+        self.cachedImage=None
+        self.blurred=None
+        self.gray=None
+        self.bw=None
+
+        #cached output of getIntegral(), it doesn't depend on the settings so it is cached separately
+        self.integralKey=None
+        self.integralImage=None
+        self.integral=None
+
+        #cached integral image used by sweepThreshold(), it depends on the gray image and how far it is padded
+        self.sweepGray=None
+        self.sweepPad=None
+        self.sweepIntegral=None
+
+    def getSettings(self):
+        return (self.blurSize,self.blockSize,self.offset)
+
+    #returns (blurred, gray, bw) for an image
+    #blurred is the first channel of the blurred image, gray is the blurred image in grayscale and bw is gray thresholded to 0 or 255
+    def process(self,image):
+        key=(id(image),image.shape,self.getSettings())
+        if key==self.cacheKey and self.cachedImage is image:
+            return self.blurred,self.gray,self.bw
+
+        if(self.blurSize>0):
+            blur=cv2.GaussianBlur(image,(self.blurSize,self.blurSize),0)
+        else:
+            blur=image
+        if blur.ndim==2:
+            self.blurred=blur
+            self.gray=blur
+        else:
+            self.blurred=np.ascontiguousarray(blur[:,:,0])
+            self.gray=cv2.cvtColor(blur,cv2.COLOR_RGB2GRAY)
+        self.bw=self.threshold(self.gray,self.blockSize,self.offset)
+
+        if self.debugPath is not None:
+            cv2.imwrite(self.debugPath,self.bw)
+
+        self.cacheKey=key
+        self.cachedImage=image
+        return self.blurred,self.gray,self.bw
+
+    #integral image of the grayscale image (not blurred) as float64, with one more row and column than the image
+    #the sum of gray[y0:y1,x0:x1] is integral[y1,x1]-integral[y0,x1]-integral[y1,x0]+integral[y0,x0]
+    def getIntegral(self,image):
+        key=(id(image),image.shape)
+        if key==self.integralKey and self.integralImage is image:
+            return self.integral
+
+        if image.ndim==2:
+            gray=image
+        else:
+            gray=cv2.cvtColor(image,cv2.COLOR_RGB2GRAY)
+        self.integral=cv2.integral(gray,sdepth=cv2.CV_64F)
+
+        self.integralKey=key
+        self.integralImage=image
+        return self.integral
+
+    #whether each point would be white in the black and white image for every combination of blockSize and offset, without thresholding the whole image each time
+    #x and y are integer arrays of pixels in the image, returns a (len(blockSizes), len(offsets), len(x)) bool array
+    #every mean comes from one integral image of the gray image, padded by repeating the edge like cv2.adaptiveThreshold does, so this matches threshold()
+    def sweepThreshold(self,image,x,y,blockSizes,offsets):
+        blurred,gray,bw=self.process(image)
+        pad=max(blockSizes)//2
+        if self.sweepGray is not gray or self.sweepPad!=pad:
+            padded=cv2.copyMakeBorder(gray,pad,pad,pad,pad,cv2.BORDER_REPLICATE)
+            self.sweepIntegral=cv2.integral(padded,sdepth=cv2.CV_64F)
+            self.sweepGray=gray
+            self.sweepPad=pad
+        integral=self.sweepIntegral
+
+        x=np.asarray(x,dtype=np.int64)
+        y=np.asarray(y,dtype=np.int64)
+        values=gray[y,x].astype(np.float64)
+        x=x+pad
+        y=y+pad
+
+        #the mean is rounded to a whole number and the offset is rounded up like in cv2.adaptiveThreshold
+        differences=[]
+        for blockSize in blockSizes:
+            r=blockSize//2
+            total=integral[y+r+1,x+r+1]-integral[y-r,x+r+1]-integral[y+r+1,x-r]+integral[y-r,x-r]
+            differences.append(values-np.rint(total/(blockSize*blockSize)))
+        differences=np.array(differences)
+        limits=-np.ceil(np.asarray(offsets,dtype=np.float64))
+        return differences[:,np.newaxis,:]>limits[np.newaxis,:,np.newaxis]
+
+    #threshold a grayscale image with the given settings
+    @staticmethod
+    def threshold(gray,blockSize,offset):
+        return cv2.adaptiveThreshold(gray,255,cv2.ADAPTIVE_THRESH_MEAN_C,cv2.THRESH_BINARY,blockSize,offset)
@@ -0,0 +1,58 @@
+"""
+This file contains the class RenderScheduler which decides when the windows of a reader are redrawn.
+cv2 calls the mouse callback for every mouse event (hundreds of times a second while the mouse moves) and redrawing the windows for every one
+makes dragging fall behind the mouse on large lattices. Instead, events only mark the windows as out of date and they are redrawn at most fps
+times a second. A frame that was put off is drawn as soon as it is due by waitKey(), which is used in place of cv2.waitKey(0) in the main loop.
+When nothing has been drawn for a while waitKey() only wakes up a few times a second instead of every frame, so an idle window doesn't keep the CPU busy.
+"""
+
+import cv2
+import time
+
+#after this many seconds without drawing the windows are idle, see waitKey()
+IDLE_AFTER=1
+#how many seconds waitKey() sleeps at a time while the windows are idle, a frame put off while it sleeps is drawn at most this late
+IDLE_TIMEOUT=0.1
+
+class RenderScheduler:
+    #render is the function that draws the windows (e.g. show() in the readers)
+    #fps is the most times per second the windows are drawn, 0 or less draws them every time it is asked to
+    def __init__(self,render,fps=60):
+        self.render=render
+        self.setFPS(fps)
+
+        #whether the windows are out of date and when they were last drawn
+        self.dirty=False
+        self.lastRender=0
+
+    def setFPS(self,fps):
+        self.interval=1/fps if fps>0 else 0
+
+    #mark the windows as out of date, they are drawn right away if the last frame was long enough ago
+    def requestRender(self):
+        self.dirty=True
+        self.update()
+
+    #draw the windows if they are out of date and a frame is due
+    def update(self):
+        if self.dirty and time.time()-self.lastRender>=self.interval:
+            self.dirty=False
+            self.lastRender=time.time()
+            self.render()
+
+    #wait for a key press like cv2.waitKey(0), but wake up when a frame that was put off is due to draw it
+    #cv2.waitKey() can't be woken up by the mouse callback, so it still wakes up every frame while the windows are being drawn and every
+    #IDLE_TIMEOUT seconds once they are idle, in case a mouse event puts a frame off while it is waiting
+    #returns the key, or -1 if no key was pressed yet (the caller should just wait again)
+    def waitKey(self):
+        self.update()
+        if self.interval==0:
+            return cv2.waitKey(0)
+        sinceRender=time.time()-self.lastRender
+        if self.dirty:
+            timeout=self.interval-sinceRender
+        elif sinceRender<IDLE_AFTER:
+            timeout=self.interval
+        else:
+            timeout=IDLE_TIMEOUT
+        return cv2.waitKey(max(1,int(round(timeout*1000))))
@@ -0,0 +1,115 @@
+"""
+This file contains the class BucketGrid which is a spatial index used to quickly find the nearest point to a mouse click.
+The points are split into square buckets, finding the nearest point only has to look through the buckets around the click instead of every point.
+Points can be moved after the index is built (e.g. after a drag), moved points are kept in a small list which is checked directly until the index is rebuilt.
+"""
+
+import numpy as np
+import math
+
+class BucketGrid:
+    #points is an (N,2) array of [x,y]
+    #bucketSize is the width of a bucket, by default it is picked so there are a few points per bucket
+    def __init__(self,points,bucketSize=None):
+        self.points=np.array(points,dtype=np.float64).reshape(-1,2)
+
+        if len(self.points)==0:
+            self.origin=np.zeros(2)
+            self.bucketSize=1.0
+            self.bucketRows=self.bucketCols=0
+        else:
+            self.origin=self.points.min(axis=0)
+            extent=self.points.max(axis=0)-self.origin
+            if bucketSize is None:
+                bucketSize=2*math.sqrt(max(extent[0]*extent[1],1)/len(self.points))
+            self.bucketSize=max(float(bucketSize),1e-6)
+            self.bucketCols=int(extent[0]//self.bucketSize)+1
+            self.bucketRows=int(extent[1]//self.bucketSize)+1
+
+        #the points of bucket i are order[bucketOffsets[i]:bucketOffsets[i+1]]
+        buckets=self.getBuckets(self.points)
+        self.order=np.argsort(buckets,kind="stable")
+        self.bucketOffsets=np.zeros(self.bucketRows*self.bucketCols+1,dtype=np.int64)
+        self.bucketOffsets[1:]=np.cumsum(np.bincount(buckets,minlength=self.bucketRows*self.bucketCols))
+
+        #points which have moved since the buckets were built
+        self.moved=np.zeros(len(self.points),dtype=bool)
+        self.movedIndices=np.zeros(0,dtype=np.int64)
+
+    def __len__(self):
+        return len(self.points)
+
+    #bucket index of every point
+    def getBuckets(self,points):
+        if len(points)==0:
+            return np.zeros(0,dtype=np.int64)
+        bucketX=((points[:,0]-self.origin[0])//self.bucketSize).astype(np.int64)
+        bucketY=((points[:,1]-self.origin[1])//self.bucketSize).astype(np.int64)
+        return bucketY*self.bucketCols+bucketX
+
+    #update the positions of some points, indices is an array of point indices and points is an array of their new [x,y]
+    def move(self,indices,points):
+        indices=np.asarray(indices,dtype=np.int64)
+        self.points[indices]=points
+        self.moved[indices]=True
+        self.movedIndices=np.flatnonzero(self.moved)
+
+    #true if so many points have moved that the index should be rebuilt
+    def isStale(self):
+        return len(self.movedIndices)>max(64,len(self.points)//8)
+
+    #returns the index of the point nearest to (x,y) and its distance, or (None, inf) if there are no points
+    #ties go to the lowest index (the same as np.argmin)
+    def nearest(self,x,y):
+        best=(math.inf,None)
+
+        #the moved points are not in the buckets so check them directly
+        if len(self.movedIndices)>0:
+            distances=np.hypot(self.points[self.movedIndices,0]-x,self.points[self.movedIndices,1]-y)
+            i=np.argmin(distances)
+            best=(float(distances[i]),int(self.movedIndices[i]))
+
+        if self.bucketRows==0:
+            return best[1],best[0]
+
+        #search rings of buckets around (x,y) until no closer point can be in the next ring
+        centerX=int((x-self.origin[0])//self.bucketSize)
+        centerY=int((y-self.origin[1])//self.bucketSize)
+        maxRing=max(abs(centerX),abs(centerX-self.bucketCols+1),abs(centerY),abs(centerY-self.bucketRows+1))
+        #if (x,y) is outside of the buckets, skip the rings which are completely outside
+        firstRing=max(0,-centerX,centerX-self.bucketCols+1,-centerY,centerY-self.bucketRows+1)
+        for ring in range(firstRing,maxRing+1):
+            if best[0]<(ring-1)*self.bucketSize:
+                break
+            candidates=self.getRing(centerX,centerY,ring)
+            if len(candidates)==0:
+                continue
+            candidates=candidates[~self.moved[candidates]]
+            if len(candidates)==0:
+                continue
+            distances=np.hypot(self.points[candidates,0]-x,self.points[candidates,1]-y)
+            minDistance=distances.min()
+            i=int(candidates[distances==minDistance].min())
+            best=min(best,(float(minDistance),i))
+        return best[1],best[0]
+
+    #indices of the points in the buckets exactly ring buckets away from (centerX, centerY)
+    def getRing(self,centerX,centerY,ring):
+        rowStart=max(centerY-ring,0)
+        rowEnd=min(centerY+ring,self.bucketRows-1)
+        colStart=max(centerX-ring,0)
+        colEnd=min(centerX+ring,self.bucketCols-1)
+        if rowStart>rowEnd or colStart>colEnd:
+            return np.zeros(0,dtype=np.int64)
+
+        ranges=[]
+        for row in range(rowStart,rowEnd+1):
+            if row==centerY-ring or row==centerY+ring:
+                #top and bottom of the ring are whole rows of buckets
+                ranges.append((row*self.bucketCols+colStart,row*self.bucketCols+colEnd+1))
+            else:
+                #the sides of the ring are single buckets
+                for col in (centerX-ring,centerX+ring):
+                    if colStart<=col<=colEnd:
+                        ranges.append((row*self.bucketCols+col,row*self.bucketCols+col+1))
+        return np.concatenate([self.order[self.bucketOffsets[start]:self.bucketOffsets[end]] for (start,end) in ranges])
@@ -0,0 +1,67 @@
+"""
+Tests for what happens to manual corrections (points toggled with toggleNearestSamplePoint()) when a fixed point is dragged.
+Run them with "python -m pytest" from this folder.
+"""
+
+import numpy as np
+from nodeNetwork import NodeNetwork, Node, stackSamplePoints
+
+#one sample point in the middle of every square and no errors
+class CenterNodeNetwork(NodeNetwork):
+    def getSamplePointsFromSquares(self,topLeft,topRight,bottomLeft,bottomRight,row,col):
+        center=(topLeft+topRight+bottomLeft+bottomRight)/4
+        return stackSamplePoints(center[:,np.newaxis,:])
+
+    def getErrors(self,samplePoints):
+        return np.zeros(len(samplePoints),dtype=bool)
+
+#a 9x9 grid over a noisy image with fixed points at (2,2) and (4,4), so dragging (2,2) only resamples the cells with row and col below 4
+def makeNetwork():
+    image=np.random.default_rng(0).integers(0,256,(400,400),dtype=np.uint8)
+    n=CenterNodeNetwork(Node(0,0),Node(399,0),Node(0,399),Node(399,399),9,9,image)
+    grid=n.getGrid()
+    for (row,col) in [(4,4),(2,2)]:
+        n.splitAtClosestPoint(*grid[row,col])
+    n.setSamplePoints()
+    assert n.fixedRows==[0,2,4,8] and n.fixedCols==[0,2,4,8]
+    return n
+
+#toggle the point of a cell and return its index
+def toggleCell(n,row,col):
+    i=n.samplePoints.pointIndex(row,col)
+    n.toggleNearestSamplePoint(n.samplePoints.x[i],n.samplePoints.y[i])
+    return i
+
+#drag the fixed point at (row,col) by (dx,dy)
+def dragFixedPoint(n,row,col,dx,dy):
+    node=n.getFixedPoint(row,col)["node"]
+    n.selectNearestFixedPoint(node.x,node.y)
+    n.dragging=True
+    n.updateDragging(node.x+dx,node.y+dy)
+    n.stopDragging()
+
+def test_dragKeepsCorrectionsOutsideMovedPatches():
+    n=makeNetwork()
+    i=toggleCell(n,6,6)
+    corrected=n.samplePoints.color[i]
+
+    dragFixedPoint(n,2,2,3,3)
+    assert n.samplePoints.color[i]==corrected
+
+def test_dragResetsCorrectionsInsideMovedPatches():
+    n=makeNetwork()
+    i=toggleCell(n,1,1)
+
+    dragFixedPoint(n,2,2,3,3)
+    x=n.samplePoints.x[i:i+1]
+    y=n.samplePoints.y[i:i+1]
+    assert n.samplePoints.color[i]==n.sampleImageArray(x,y)[0]
+
+def test_resampleResetsEveryCorrection():
+    n=makeNetwork()
+    i=toggleCell(n,6,6)
+
+    n.setSamplePoints()
+    x=n.samplePoints.x[i:i+1]
+    y=n.samplePoints.y[i:i+1]
+    assert n.samplePoints.color[i]==n.sampleImageArray(x,y)[0]
@@ -0,0 +1,162 @@
+"""
+This file contains the class TiledImage which lets a NodeNetwork work on scans that are too big to keep in memory (e.g. stitched mosaics).
+The image is copied once into a pyramid of levels, each half the size of the one before, and every level is stored on disk as square tiles in a
+memory-mapped .npy file. Only the tiles that are used are read from the disk, so the NodeNetwork samples and thresholds the image one tile at a time
+and the window only reads the smallest level that is still at least as big as the window.
+The pyramid is saved next to the image and reused as long as the image doesn't change, so opening the same scan again is fast.
+cv2 can only decode a whole image at once, so a scan that doesn't fit in memory should be given as a .npy array (e.g. from the stitching software),
+which is copied into the tiles without being loaded all at once.
+"""
+
+import cv2
+import numpy as np
+import json
+import os
+from imageLoading import loadImage,normalizeChannels,getRange,toUint8
+
+#how many pixels wide and high every tile is
+TILESIZE=512
+
+class TiledImage:
+    #path is the image (anything loadImage() can read, or a .npy array of shape (height, width) or (height, width, channels) of any dtype)
+    #the pyramid goes in cacheDir, by default a folder next to the image with "_tiles" added to its name
+    def __init__(self,path,tileSize=TILESIZE,cacheDir=None):
+        self.path=path
+        self.tileSize=tileSize
+        if cacheDir is None:
+            cacheDir=os.path.splitext(path)[0]+"_tiles"
+        self.cacheDir=cacheDir
+
+        #the pyramid is only rebuilt if the image changed since it was made
+        stat=os.stat(path)
+        info={"size":stat.st_size,"mtime":stat.st_mtime,"tileSize":tileSize}
+        infoPath=os.path.join(cacheDir,"info.json")
+        saved=None
+        if os.path.exists(infoPath):
+            with open(infoPath) as file:
+                saved=json.load(file)
+        if saved is None or any(saved.get(key)!=value for key,value in info.items()):
+            saved=self.build(info)
+            with open(infoPath,"w") as file:
+                json.dump(saved,file)
+
+        #levels[i] is a memory-mapped (tilesY, tilesX, tileSize, tileSize, channels) array, levelShapes[i] is the (height, width) of that level
+        self.levels=[np.load(os.path.join(cacheDir,"level"+str(i)+".npy"),mmap_mode="r") for i in range(len(saved["shapes"]))]
+        self.levelShapes=[tuple(shape) for shape in saved["shapes"]]
+        self.gray=saved["gray"]
+
+    #copy the image into the tiles of every level, returns the info that describes the pyramid
+    def build(self,info):
+        os.makedirs(self.cacheDir,exist_ok=True)
+        if self.path.lower().endswith(".npy"):
+            source=normalizeChannels(np.load(self.path,mmap_mode="r"))
+        else:
+            source=loadImage(self.path)
+        gray=source.ndim==2
+        self.gray=gray
+
+        #16 bit or float values are stretched to 0-255 over the range of the whole image (see imageLoading.py), which is found a strip at a time
+        low,high=0,255
+        if source.dtype!=np.uint8:
+            low,high=np.inf,-np.inf
+            for y0 in range(0,source.shape[0],self.tileSize):
+                low,high=getRange(np.asarray(source[y0:y0+self.tileSize]),low,high)
+
+        #the first level is the image itself
+        shapes=[source.shape[0:2]]
+        level=self.makeLevel(0,source.shape[0:2],1 if gray else source.shape[2])
+        for tileRow,tileCol in np.ndindex(*level.shape[0:2]):
+            x0,y0,x1,y1=self.getTileRect(tileRow,tileCol,shape=source.shape[0:2])
+            tile=np.asarray(source[y0:y1,x0:x1])
+            if tile.dtype!=np.uint8:
+                tile=toUint8(tile,low,high)
+            level[tileRow,tileCol,0:y1-y0,0:x1-x0]=tile.reshape(y1-y0,x1-x0,-1)
+        level.flush()
+        self.levels=[level]
+
+        #every other level is made from the one before it, a tile of it is the area of four tiles of the level before shrunk to one
+        while max(shapes[-1])>self.tileSize:
+            height,width=shapes[-1]
+            shape=((height+1)//2,(width+1)//2)
+            level=self.makeLevel(len(shapes),shape,level.shape[4])
+            for tileRow,tileCol in np.ndindex(*level.shape[0:2]):
+                x0,y0,x1,y1=self.getTileRect(tileRow,tileCol,shape=shape)
+                region=self.getRegion(2*x0,2*y0,min(2*x1,width),min(2*y1,height),level=len(shapes)-1)
+                level[tileRow,tileCol,0:y1-y0,0:x1-x0]=cv2.resize(region,(x1-x0,y1-y0),interpolation=cv2.INTER_AREA).reshape(y1-y0,x1-x0,-1)
+            level.flush()
+            self.levels.append(level)
+            shapes.append(shape)
+
+        return dict(info,shapes=[list(shape) for shape in shapes],gray=gray)
+
+    #make an empty level of the pyramid on disk
+    def makeLevel(self,index,shape,channels):
+        tilesY=-(-shape[0]//self.tileSize)
+        tilesX=-(-shape[1]//self.tileSize)
+        return np.lib.format.open_memmap(os.path.join(self.cacheDir,"level"+str(index)+".npy"),mode="w+",dtype=np.uint8,shape=(tilesY,tilesX,self.tileSize,self.tileSize,channels))
+
+    #the image looks like a uint8 numpy array from the outside (e.g. image.shape[0:2] is its height and width)
+    @property
+    def shape(self):
+        if self.gray:
+            return self.levelShapes[0]
+        return self.levelShapes[0]+(self.levels[0].shape[4],)
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8)
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    #number of (rows, columns) of tiles in a level
+    def getTileCount(self,level=0):
+        return self.levels[level].shape[0:2]
+
+    #the rectangle (x0,y0,x1,y1) of the image covered by a tile, and halo more pixels around it (less at the edges of the image)
+    def getTileRect(self,tileRow,tileCol,halo=0,shape=None):
+        if shape is None:
+            shape=self.levelShapes[0]
+        x0=max(tileCol*self.tileSize-halo,0)
+        y0=max(tileRow*self.tileSize-halo,0)
+        x1=min((tileCol+1)*self.tileSize+halo,shape[1])
+        y1=min((tileRow+1)*self.tileSize+halo,shape[0])
+        return x0,y0,x1,y1
+
+    #copy of the rectangle from (x0,y0) to (x1,y1) of a level, only the tiles it covers are read
+    def getRegion(self,x0,y0,x1,y1,level=0):
+        tiles=self.levels[level]
+        size=self.tileSize
+        region=np.empty((y1-y0,x1-x0,tiles.shape[4]),dtype=np.uint8)
+        for tileRow in range(y0//size,-(-y1//size)):
+            for tileCol in range(x0//size,-(-x1//size)):
+                tileX0=max(x0,tileCol*size)
+                tileY0=max(y0,tileRow*size)
+                tileX1=min(x1,(tileCol+1)*size)
+                tileY1=min(y1,(tileRow+1)*size)
+                region[tileY0-y0:tileY1-y0,tileX0-x0:tileX1-x0]=tiles[tileRow,tileCol,tileY0-tileRow*size:tileY1-tileRow*size,tileX0-tileCol*size:tileX1-tileCol*size]
+        if self.gray:
+            return np.ascontiguousarray(region[:,:,0])
+        return region
+
+    #the smallest level that is at least size (width, height), or the first level if none of them are smaller than the image
+    def chooseLevel(self,size):
+        level=0
+        while level+1<len(self.levels) and self.levelShapes[level+1][1]>=size[0] and self.levelShapes[level+1][0]>=size[1]:
+            level+=1
+        return level
+
+    #a whole level as one array
+    def getLevelImage(self,level):
+        height,width=self.levelShapes[level]
+        return self.getRegion(0,0,width,height,level=level)
+
+    #the image stretched to size (width, height) as a 3 channel image to draw on, only the level that is needed for that size is read
+    def getDisplayImage(self,size):
+        image=self.getLevelImage(self.chooseLevel(size))
+        if image.ndim==2:
+            image=cv2.cvtColor(image,cv2.COLOR_GRAY2BGR)
+        if image.shape[1]==size[0] and image.shape[0]==size[1]:
+            return image
+        if image.shape[1]>size[0] and image.shape[0]>size[1]:
+            return cv2.resize(image,size,interpolation=cv2.INTER_AREA)
+        return cv2.resize(image,size)